@@ -0,0 +1,142 @@
+import glob, os, sys, tempfile, time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import main
+
+##################################################
+# FILES
+##################################################
+
+def collect_files(patterns, extension='.ourjs'):
+    # Directories are searched recursively for extension, globs may use **
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for directory, _, names in os.walk(pattern):
+                files.extend(os.path.join(directory, name) for name in names if name.endswith(extension))
+        elif glob.has_magic(pattern):
+            files.extend(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+        else:
+            files.append(pattern)
+    return sorted(set(os.path.normpath(path) for path in files))
+
+def get_output_path(path, root, output_directory, emit=main.STAGE_IC):
+    # The stage emitted is the extension, e.g. src/a.ourjs -> build/a.ic
+    base, _ = os.path.splitext(os.path.relpath(path, root))
+    return os.path.join(output_directory, f'{base}.{emit}')
+
+def open_output(output_path):
+    # A temporary file beside output_path, see replace_output
+    directory, name = os.path.split(output_path)
+    os.makedirs(directory or '.', exist_ok=True)
+    return tempfile.NamedTemporaryFile('w', dir=directory or '.', prefix=f'.{name}.', suffix='.tmp', delete=False)
+
+def replace_output(file, output_path, succeeded):
+    # Moves the finished output into place. A failed compile leaves no
+    # output at all, not even an earlier one, so that a build never takes a
+    # partly written or stale file for up to date.
+    file.close()
+    if succeeded:
+        os.replace(file.name, output_path)
+        return
+    os.unlink(file.name)
+    if os.path.exists(output_path): os.unlink(output_path)
+
+##################################################
+# WORKER
+##################################################
+
+def compile_file(path, output_path, lexer_engine='regex', optimization_level=0, emit=main.STAGE_IC, cache=None,
+                 recover=False, max_errors=None):
+    # Compiles one file with main.run up to the emit stage and writes its
+    # output to output_path. Returns (path, bytes, error text or None,
+    # seconds per stage); errors, including unexpected exceptions, are
+    # reported rather than raised so the batch carries on.
+    report = main.StageReport()
+    instrument = main.Instrumentation([report], counting=False)
+    size = 0
+    error = None
+    file = None
+    try:
+        size = os.path.getsize(path)
+        file = open_output(output_path)
+        _, error = main.run(path, lexer_engine=lexer_engine, output=file, optimization_level=optimization_level,
+                            cache=cache, recover=recover, max_errors=max_errors, emit=emit, instrument=instrument)
+        error = error.as_string() if error else None
+    except Exception as exception:
+        error = f'{type(exception).__name__} : {exception} File {path}'
+    finally:
+        if file is not None: replace_output(file, output_path, error is None)
+    return path, size, error, report.seconds()
+
+def compile_chunk(jobs, cache_options=None, recover=False, max_errors=None):
+    # One CompileCache per chunk, as opening one hashes the compiler
+    cache = main.CompileCache(*cache_options) if cache_options else None
+    return [compile_file(*job, cache, recover, max_errors) for job in jobs]
+
+##################################################
+# BATCH
+##################################################
+
+def get_worker_count():
+    if hasattr(os, 'sched_getaffinity'): return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def compile_batch(files, output_directory, workers=None, lexer_engine='regex', optimization_level=0, report=print,
+                  emit=main.STAGE_IC, cache_options=None, recover=False, max_errors=None):
+    # Compiles files up to the emit stage across a process pool, mirroring
+    # their layout below output_directory. Files are sent in chunks so a worker handles several
+    # per round trip. cache_options are the arguments of the CompileCache
+    # each worker compiles with, None for none. report receives each error
+    # as it comes in. Returns the results of compile_file in the order of files.
+    if not files: return []
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in files])
+    jobs = [(path, get_output_path(os.path.abspath(path), root, output_directory, emit), lexer_engine, optimization_level, emit) for path in files]
+    compile_jobs = partial(compile_chunk, cache_options=cache_options, recover=recover, max_errors=max_errors)
+
+    workers = min(workers or get_worker_count(), len(jobs))
+    if workers == 1:
+        chunks = [compile_jobs(jobs)]
+    else:
+        # About four chunks per worker keeps them busy when file sizes vary
+        chunk_size = max(1, min(64, len(jobs) // (workers * 4)))
+        chunks = [jobs[index:index + chunk_size] for index in range(0, len(jobs), chunk_size)]
+        executor = ProcessPoolExecutor(workers)
+        chunks = executor.map(compile_jobs, chunks)
+
+    results = []
+    try:
+        for chunk in chunks:
+            for result in chunk:
+                if result[2]: report(result[2])
+                results.append(result)
+    finally:
+        if workers > 1: executor.shutdown()
+    return results
+
+def summarize(results, elapsed, workers):
+    # Throughput over the wall time and where the workers spent theirs
+    total_bytes = sum(result[1] for result in results)
+    errors = sum(1 for result in results if result[2])
+    stage_times = {stage: sum(result[3].get(stage, 0.0) for result in results) for stage in main.PROFILE_STAGES}
+    worker_time = sum(stage_times.values()) or 1
+
+    lines = [
+        f'Compiled {len(results) - errors} of {len(results)} files ({errors} with errors) on {workers} workers in {elapsed:.2f}s',
+        f'{len(results) / elapsed:.1f} files/s, {total_bytes / elapsed / 1e6:.2f} MB/s'
+    ]
+    for stage, seconds in stage_times.items():
+        if seconds: lines.append(f'{stage:>8}: {seconds:.2f}s ({seconds / worker_time:.0%})')
+    return '\n'.join(lines)
+
+def run_batch(patterns, output_directory, workers=None, lexer_engine='regex', optimization_level=0, emit=main.STAGE_IC,
+              cache_options=None, recover=False, max_errors=None):
+    # Entry point for run.py; returns whether every file compiled
+    files = collect_files(patterns)
+    workers = min(workers or get_worker_count(), max(len(files), 1))
+    start_time = time.perf_counter()
+    results = compile_batch(files, output_directory, workers, lexer_engine, optimization_level,
+                            lambda error: print(error + '\n', file=sys.stderr), emit, cache_options, recover, max_errors)
+    elapsed = max(time.perf_counter() - start_time, 1e-9)
+    print(summarize(results, elapsed, workers))
+    return all(result[2] is None for result in results)
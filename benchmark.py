@@ -0,0 +1,410 @@
+import os, random, subprocess, sys, tempfile, time, tracemalloc
+import main
+from lexer import *
+from ourjs_parser import *
+from nodes import *
+from optimizer import *
+from vm import *
+from pybackend import *
+from incremental import Document
+
+##################################################
+# PROGRAM GENERATOR
+##################################################
+
+def generate_program(size, seed=0):
+    rng = random.Random(seed)
+    names = [f'value_{i}' for i in range(32)]
+    chunks = []
+    length = 0
+    count = 0
+
+    while length < size:
+        name = rng.choice(names)
+        kind = count % 6
+        if kind == 0:
+            chunk = f'let {name} = {rng.randint(0, 999)}\n'
+        elif kind == 1:
+            chunk = f'let {name} = ({rng.randint(1, 9)} - {rng.choice(names)} + ({rng.randint(1, 9)} - 2)) * 3 + ({name} / 6.5)\n'
+        elif kind == 2:
+            chunk = f'let {name} = "member {count}"\n'
+        elif kind == 3:
+            chunk = f'func add_{count}(a,b){{\n  a+b\n}}\nadd_{count}({rng.randint(0, 9)}+4, {name})\n'
+        elif kind == 4:
+            chunk = f'if ({name} == 1 && {rng.choice(names)} != "Ryan" ) {{\n  log("Group1")\n}} else {{\n  log("Not Group1")\n}}\n'
+        else:
+            chunk = f'while ({name} < 100|| ! {rng.choice(names)} <=1000) {{\n  let status = "counting"\n}}\nfor (let a = 2, a < 8, a + 1) {{\n  let b = 6;\n  3+3\n}}\n'
+        chunks.append(chunk)
+        length += len(chunk)
+        count += 1
+
+    return ''.join(chunks)
+
+def generate_expressions(size, seed=0):
+    # Arithmetic-heavy statements mixing literals and a few variables
+    rng = random.Random(seed)
+    names = [f'value_{i}' for i in range(8)]
+    lines = [f'let {name} = {i}\n' for i, name in enumerate(names)]
+    length = sum(map(len, lines))
+
+    def expression(depth):
+        if depth == 0 or rng.random() < 0.2:
+            return rng.choice(names) if rng.random() < 0.25 else str(rng.randint(0, 9))
+        op = rng.choice(['+', '-', '*', '/', '<', '==', '&&'])
+        return f'({expression(depth - 1)} {op} {expression(depth - 1)})'
+
+    while length < size:
+        line = f'let {rng.choice(names)} = {expression(5)}\n'
+        lines.append(line)
+        length += len(line)
+
+    return ''.join(lines)
+
+##################################################
+# BENCHMARKS
+##################################################
+
+def time_call(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start_time
+        if best is None or elapsed < best: best = elapsed
+    return best
+
+def bench_lexers(size, repeat):
+    text = generate_program(size)
+    print(f'Lexing {len(text)} characters (best of {repeat})\n')
+
+    reference = None
+    baseline = None
+    for name, lexer_class in LEXERS.items():
+        tokens, error = lexer_class('<benchmark>', text).make_tokens()
+        if error: raise RuntimeError(error.as_string())
+        signature = [(t.type, t.value, t.start, t.end) for t in tokens]
+        if reference is None: reference = signature
+        elif signature != reference: raise RuntimeError(f'{name} lexer produced a different token stream')
+
+        elapsed = time_call(lambda: lexer_class('<benchmark>', text).make_tokens(), repeat)
+        if baseline is None: baseline = elapsed
+        print(f'{name:>10}: {elapsed:.4f}s  {len(text) / elapsed / 1e6:.2f} MB/s  x{baseline / elapsed:.2f}')
+
+def bench_parser(size, repeat):
+    print(f'Parsing {size} characters (best of {repeat})\n')
+    for name, text in (('program', generate_program(size)), ('expressions', generate_expressions(size))):
+        tokens, error = RegexLexer('<benchmark>', text).make_tokens()
+        if error: raise RuntimeError(error.as_string())
+        elapsed = time_call(lambda: Parser(tokens).parse(), repeat)
+        print(f'{name:>12}: {elapsed:.4f}s  {len(tokens) / elapsed / 1e6:.2f}M tokens/s')
+
+    # Nesting is limited by memory, not by the recursion limit
+    depth = max(size // 100, 1)
+    for name, text in (('parentheses', '(' * depth + '1' + ')' * depth), ('unary', '-' * depth + '1'), ('not', '!' * depth + '1'), ('calls', 'f(' * depth + ')' * depth)):
+        tokens, error = RegexLexer('<benchmark>', text).make_tokens()
+        if error: raise RuntimeError(error.as_string())
+        ast = Parser(tokens).parse()
+        if ast.error: raise RuntimeError(ast.error.as_string())
+        elapsed = time_call(lambda: Parser(tokens).parse(), repeat)
+        print(f'{name:>12}: depth {depth} in {elapsed:.4f}s')
+
+def measure_allocation(function):
+    tracemalloc.start()
+    result = function()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, allocated
+
+def bench_token_memory(size, repeat):
+    text = generate_program(size)
+    tokens, error = RegexLexer('<benchmark>', text).make_tokens()
+    if error: raise RuntimeError(error.as_string())
+    print(f'Token memory for {len(text)} characters, {len(tokens)} tokens\n')
+
+    def make_stream():
+        stream = TokenStream(tokens.source)
+        stream.types.extend(tokens.types)
+        stream.starts.extend(tokens.starts)
+        stream.ends.extend(tokens.ends)
+        stream.values.extend(tokens.values)
+        return stream
+
+    _, list_bytes = measure_allocation(lambda: list(tokens))
+    _, stream_bytes = measure_allocation(make_stream)
+    print(f'list of Token: {list_bytes / 1e6:8.2f} MB  {list_bytes / len(tokens):6.1f} bytes/token')
+    print(f'  TokenStream: {stream_bytes / 1e6:8.2f} MB  {stream_bytes / len(tokens):6.1f} bytes/token  x{list_bytes / stream_bytes:.1f} smaller')
+
+def bench_streaming(size, repeat):
+    text = generate_program(size)
+    print(f'Lexing and parsing {len(text)} characters\n')
+
+    def parse_eager():
+        tokens, error = RegexLexer('<benchmark>', text).make_tokens()
+        return Parser(tokens).parse(), len(tokens)
+
+    def parse_streaming():
+        tokens = TokenBuffer(RegexLexer('<benchmark>', text))
+        result = Parser(tokens).parse()
+        tokens.finish()
+        return result, len(tokens.types)
+
+    for name, function in (('eager', parse_eager), ('streaming', parse_streaming)):
+        tracemalloc.start()
+        start_time = time.perf_counter()
+        (result, held_tokens) = function()
+        elapsed = time.perf_counter() - start_time
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        if result.error: raise RuntimeError(result.error.as_string())
+        print(f'{name:>10}: {elapsed:.4f}s  peak {peak / 1e6:8.2f} MB  {held_tokens} tokens held at the end')
+
+def bench_file_input(size, repeat):
+    with tempfile.NamedTemporaryFile('w', suffix='.ourjs', delete=False) as file:
+        file.write(generate_program(size))
+    file_size = os.path.getsize(file.name)
+    print(f'Lexing a {file_size} byte file (best of {repeat})\n')
+
+    def lex_text():
+        with open(file.name, 'r') as source:
+            return RegexLexer(file.name, source.read()).make_tokens()
+
+    def lex_mapped():
+        return RegexLexer(file.name, main.map_source(file.name)).make_tokens()
+
+    try:
+        for name, function in (('read()', lex_text), ('mmap', lex_mapped)):
+            elapsed = time_call(function, repeat)
+            tracemalloc.start()
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f'{name:>10}: {elapsed:.4f}s  {file_size / elapsed / 1e6:.2f} MB/s  peak {peak / 1e6:8.2f} MB')
+    finally:
+        os.remove(file.name)
+
+def count_tree(root):
+    node_count = 0
+    token_ids = set()
+    pending = [root]
+    while pending:
+        item = pending.pop()
+        if isinstance(item, (list, tuple)):
+            pending.extend(item)
+        elif isinstance(item, Token):
+            token_ids.add(id(item))
+        elif isinstance(item, Node):
+            node_count += 1
+            for cls in type(item).__mro__:
+                for slot in getattr(cls, '__slots__', ()):
+                    if slot not in ('start', 'end', 'source'):
+                        pending.append(getattr(item, slot))
+    return node_count, len(token_ids)
+
+def bench_node_memory(size, repeat):
+    text = generate_program(size)
+    tokens, error = RegexLexer('<benchmark>', text).make_tokens()
+    if error: raise RuntimeError(error.as_string())
+
+    tracemalloc.start()
+    result = Parser(tokens).parse()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    if result.error: raise RuntimeError(result.error.as_string())
+
+    node_count, token_count = count_tree(result.node)
+    _, stream_bytes = measure_allocation(lambda: list(tokens))
+    print(f'AST for {len(text)} characters: {node_count} nodes holding {token_count} tokens\n')
+    print(f'  AST: {allocated / 1e6:8.2f} MB  {allocated / node_count:6.1f} bytes/node (including its tokens)')
+    print(f'Token: {stream_bytes / len(tokens):6.1f} bytes/token as a standalone object')
+    print(f'       {tokens_bytes(tokens) / len(tokens):6.1f} bytes/token in a TokenStream')
+
+def bench_intermediate_code(size, repeat):
+    # Emission should scale linearly, so doubling the input doubles the time
+    print(f'Generating IC (best of {repeat})\n')
+    for scale in (size // 4, size // 2, size):
+        tokens, error = RegexLexer('<benchmark>', generate_program(scale)).make_tokens()
+        if error: raise RuntimeError(error.as_string())
+        result = Parser(tokens).parse()
+        if result.error: raise RuntimeError(result.error.as_string())
+
+        string_time = time_call(lambda: main.IntermediateCodeGenerator(result.node).generate_intermediate_code(), repeat)
+        with open(os.devnull, 'w') as sink:
+            stream_time = time_call(lambda: main.IntermediateCodeGenerator(result.node, sink).write_intermediate_code(), repeat)
+        print(f'{scale:>10} chars: string {string_time:.4f}s  stream {stream_time:.4f}s')
+
+def bench_optimizer(size, repeat):
+    tokens, error = RegexLexer('<benchmark>', generate_program(size)).make_tokens()
+    if error: raise RuntimeError(error.as_string())
+    result = Parser(tokens).parse()
+    if result.error: raise RuntimeError(result.error.as_string())
+    instructions = main.IntermediateCodeGenerator(result.node).generate_instructions()
+    print(f'Optimizing {len(instructions)} instructions (best of {repeat})\n')
+
+    for level in (1, 2):
+        optimized = optimize(instructions, level)
+        temps = {dest for dest in optimized.dests if type(dest) == int}
+        elapsed = time_call(lambda: optimize(instructions, level), repeat)
+        print(f'level {level}: {len(optimized)} instructions  {len(temps)} temps  {len(format_instructions(optimized))} bytes  {elapsed:.4f}s')
+
+def bench_folding(size, repeat):
+    text = generate_expressions(size)
+    tokens, error = RegexLexer('<benchmark>', text).make_tokens()
+    if error: raise RuntimeError(error.as_string())
+    print(f'Expression-heavy program of {len(text)} characters (best of {repeat})\n')
+
+    def compile_program(fold):
+        result = Parser(tokens).parse()
+        if result.error: raise RuntimeError(result.error.as_string())
+        node = fold_ast(result.node) if fold else result.node
+        return main.IntermediateCodeGenerator(node).generate_instructions()
+
+    for name, fold in (('unfolded', False), ('folded', True)):
+        instructions = compile_program(fold)
+        elapsed = time_call(lambda: compile_program(fold), repeat)
+        print(f'{name:>10}: {len(instructions)} instructions  {elapsed:.4f}s')
+
+VM_PROGRAMS = {
+    'loop': 'let i = 0\nlet total = 0\nwhile (i < {n}) {{\n  let total = total + i * 2\n  let i = i + 1\n}}\ntotal\n',
+    'calls': 'func add(a,b){{\n  a+b\n}}\nlet total = 0\nfor (let i = 0, i < {n}, i + 1) {{\n  let total = add(total, i)\n}}\ntotal\n',
+    'recursion': 'func fib(n){{\n  if (n < 2) {{ n }} else {{ fib(n - 1) + fib(n - 2) }}\n}}\nfib({depth})\n'
+}
+
+def bench_vm(size, repeat):
+    # size is the number of loop iterations; recursion runs fib to match
+    depth = 1
+    while fib_calls(depth + 1) <= size: depth += 1
+    print(f'Running on the VM (best of {repeat})\n')
+
+    for name, template in VM_PROGRAMS.items():
+        text = template.format(n=size, depth=depth)
+        result, error = main.parse_source('<benchmark>', text, 'regex')
+        if error: raise RuntimeError(error.as_string())
+        bytecode = BytecodeCompiler().compile(result.node)
+        value, error = VM(bytecode).run()
+        if error: raise RuntimeError(error.as_string())
+
+        elapsed = time_call(lambda: VM(bytecode).run(), repeat)
+        count = fib_calls(depth) if name == 'recursion' else size
+        unit = 'calls' if name == 'recursion' else 'iterations'
+        print(f'{name:>10}: {elapsed:.4f}s  {count / elapsed / 1e6:.2f}M {unit}/s  result {value}')
+
+def bench_python_backend(size, repeat):
+    # Same programs as bench_vm, compiled to Python code objects
+    depth = 1
+    while fib_calls(depth + 1) <= size: depth += 1
+    print(f'Running as Python code objects against the VM (best of {repeat})\n')
+
+    for name, template in VM_PROGRAMS.items():
+        text = template.format(n=size, depth=depth)
+        result, error = main.parse_source('<benchmark>', text, 'regex')
+        if error: raise RuntimeError(error.as_string())
+        bytecode = BytecodeCompiler().compile(result.node)
+        code = PythonCompiler('<benchmark>').compile(result.node)
+        value, error = run_code(code, result.node.source)
+        if error: raise RuntimeError(error.as_string())
+
+        vm_elapsed = time_call(lambda: VM(bytecode).run(), repeat)
+        elapsed = time_call(lambda: run_code(code, result.node.source), repeat)
+        load_elapsed = time_call(lambda: load_code(dump_code(code)), repeat)
+        print(f'{name:>10}: {elapsed:.4f}s  {vm_elapsed / elapsed:.1f}x the VM  marshal round trip {load_elapsed * 1e6:.0f}us  result {value}')
+
+def bench_incremental(size, repeat):
+    # Types a statement one character at a time into the middle of the program
+    text = generate_program(size)
+    typed = 'let total = (value_1 + 12) * value_2\n'
+    print(f'Typing {len(typed)} characters into {len(text)} characters\n')
+
+    full = time_call(lambda: main.parse_source('<benchmark>', text, 'regex'), repeat)
+    document = Document('<benchmark>', text)
+    offset = text.index('\n', len(text) // 2) + 1
+    times = []
+    for char in typed:
+        start_time = time.perf_counter()
+        document.edit(offset, 0, char)
+        times.append(time.perf_counter() - start_time)
+        offset += 1
+
+    ast, error = document.get_ast()
+    expected, expected_error = main.parse_source('<benchmark>', document.source.text, 'regex')
+    statements = [(repr(node), node.start, node.end) for node in ast.node.element_nodes]
+    expected_statements = [(repr(node), node.start, node.end) for node in expected.node.element_nodes]
+    if error or expected_error or statements != expected_statements: raise RuntimeError('incremental parse differs from a full parse')
+    print(f'{"full":>10}: {full * 1000:.2f}ms')
+    print(f'{"edit":>10}: {sum(times) / len(times) * 1000:.2f}ms mean  {max(times) * 1000:.2f}ms max')
+
+def bench_server(size, repeat):
+    # Latency of a file through a cold run.py, a client.py process talking
+    # to server.py, and a request on a connection the caller keeps open
+    import client
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'program.ourjs')
+    socket_path = os.path.join(directory, 'server.sock')
+    with open(path, 'w') as file:
+        file.write(generate_program(size))
+    print(f'Compiling a {os.path.getsize(path)} byte file (best of {repeat})\n')
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    server = subprocess.Popen([sys.executable, os.path.join(here, 'server.py'), '--socket', socket_path, '--results', '0'])
+    try:
+        while True:
+            try:
+                connection = client.CompileClient(socket_path)
+                break
+            except OSError:
+                if server.poll() is not None: raise RuntimeError('server.py did not start')
+                time.sleep(0.05)
+
+        def run_cold():
+            subprocess.run([sys.executable, os.path.join(here, 'run.py'), path, '--no-cache'], check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        def run_client():
+            subprocess.run([sys.executable, os.path.join(here, 'client.py'), path, '--socket', socket_path], check=True,
+                           stdout=subprocess.DEVNULL)
+
+        def run_connected():
+            if not connection.compile(path)['ok']: raise RuntimeError('the server failed to compile')
+
+        cold = None
+        for name, function in (('run.py', run_cold), ('client.py', run_client), ('connected', run_connected)):
+            elapsed = time_call(function, repeat)
+            if cold is None: cold = elapsed
+            print(f'{name:>10}: {elapsed * 1000:8.2f}ms  x{cold / elapsed:.1f}')
+        connection.request(op='shutdown')
+        connection.close()
+        server.wait(10)
+    finally:
+        if server.poll() is None: server.kill()
+        os.remove(path)
+        if os.path.exists(socket_path): os.remove(socket_path)
+        os.rmdir(directory)
+
+def fib_calls(depth):
+    a, b = 1, 1
+    for _ in range(depth): a, b = b, a + b + 1
+    return a
+
+def tokens_bytes(tokens):
+    return sum(sys.getsizeof(column) for column in (tokens.types, tokens.starts, tokens.ends, tokens.values))
+
+BENCHMARKS = {
+    'lexer': bench_lexers,
+    'parser': bench_parser,
+    'tokens': bench_token_memory,
+    'streaming': bench_streaming,
+    'file': bench_file_input,
+    'nodes': bench_node_memory,
+    'ic': bench_intermediate_code,
+    'optimizer': bench_optimizer,
+    'folding': bench_folding,
+    'vm': bench_vm,
+    'python': bench_python_backend,
+    'incremental': bench_incremental,
+    'server': bench_server
+}
+
+if __name__ == '__main__':
+    benchmark = sys.argv[1] if len(sys.argv) > 1 else 'lexer'
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    BENCHMARKS[benchmark](size, repeat)
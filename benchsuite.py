@@ -0,0 +1,255 @@
+import argparse, gc, hashlib, json, platform, random, statistics, sys, time
+import main
+
+# The timed stages, in pipeline order
+SUITE_STAGES = ('lex', 'parse', 'ic')
+
+DEFAULT_SIZES = ('1K', '10K', '100K', '1M')
+DEFAULT_THRESHOLD = 0.15
+
+# Each measurement repeats a stage until it has run at least this long, so
+# small corpora are not timed at the resolution of the clock
+MIN_MEASUREMENT_TIME = 0.2
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 * 1024}
+
+##################################################
+# CORPUS
+##################################################
+
+class CorpusGenerator:
+    # Writes a program using every construct of sample.ourjs: let chains,
+    # nested arithmetic, logic and comparisons, strings, if/else, while and
+    # for blocks nested up to max_depth, and functions called after they are
+    # defined. The same size and seed always give the same text.
+    def __init__(self, seed=0, max_depth=6):
+        self.rng = random.Random(seed)
+        self.max_depth = max_depth
+        self.names = [f'value_{i}' for i in range(32)]
+        self.functions = []
+        self.count = 0
+
+    def name(self):
+        return self.rng.choice(self.names)
+
+    def operand(self):
+        if self.rng.random() < 0.4: return self.name()
+        return str(self.rng.randint(0, 999))
+
+    def arithmetic(self, depth):
+        if depth == 0 or self.rng.random() < 0.25: return self.operand()
+        left = self.arithmetic(depth - 1)
+        right = self.arithmetic(depth - 1)
+        operator = self.rng.choice('+-*/')
+        if self.rng.random() < 0.5: return f'({left} {operator} {right})'
+        return f'{left} {operator} {right}'
+
+    def condition(self):
+        comparison = f'{self.name()} {self.rng.choice(("==", "!=", "<", ">", "<=", ">="))} {self.arithmetic(2)}'
+        kind = self.rng.randrange(3)
+        if kind == 0: return comparison
+        if kind == 1: return f'{comparison} && {self.name()} != "Ryan"'
+        return f'{comparison} || ! {self.name()} <= 1000'
+
+    def let_chain(self):
+        names = ' = let '.join(self.rng.sample(self.names, self.rng.randint(1, 4)))
+        return f'let {names} = {self.arithmetic(3)}'
+
+    def call(self):
+        if not self.functions: return f'log("member {self.count}")'
+        name, arity = self.rng.choice(self.functions)
+        return f'{name}({", ".join(self.arithmetic(2) for _ in range(arity))})'
+
+    def simple_statement(self):
+        kind = self.rng.randrange(4)
+        if kind == 0: return self.let_chain()
+        if kind == 1: return f'let {self.name()} = "member {self.count}"'
+        if kind == 2: return self.call()
+        return self.arithmetic(4)
+
+    def block(self, depth, indent):
+        # The statements of a block, ending in a nested block while depth lasts
+        pad = '  ' * indent
+        lines = [pad + self.simple_statement() for _ in range(self.rng.randint(1, 2))]
+        if depth > 0: lines.append(self.nested(depth - 1, indent))
+        return '\n'.join(lines)
+
+    def nested(self, depth, indent):
+        pad = '  ' * indent
+        kind = self.rng.randrange(3)
+        body = self.block(depth, indent + 1)
+        if kind == 0:
+            text = f'{pad}if ({self.condition()}) {{\n{body}\n{pad}}}'
+            if self.rng.random() < 0.5: text += f' else {{\n{self.block(0, indent + 1)}\n{pad}}}'
+            return text
+        if kind == 1: return f'{pad}while ({self.condition()}) {{\n{body}\n{pad}}}'
+        return f'{pad}for (let a = {self.rng.randint(0, 9)}, a < {self.rng.randint(10, 99)}, a + 1) {{\n{body}\n{pad}}}'
+
+    def function(self):
+        name = f'function_{len(self.functions)}'
+        parameters = ['a', 'b', 'c'][:self.rng.randint(1, 3)]
+        body = f'  let total = {" + ".join(parameters)}\n  total * {self.rng.randint(1, 9)}'
+        self.functions.append((name, len(parameters)))
+        return f'func {name}({",".join(parameters)}){{\n{body}\n}}'
+
+    def statement(self):
+        self.count += 1
+        kind = self.count % 8
+        if kind == 0: return self.function()
+        if kind in (1, 2): return self.let_chain()
+        if kind == 3: return f'let {self.name()} = {self.arithmetic(6)}'
+        if kind == 4: return self.call()
+        if kind == 5: return f'let {self.name()} = "member {self.count}"'
+        return self.nested(self.rng.randint(0, self.max_depth), 0)
+
+    def generate(self, size):
+        chunks = []
+        length = 0
+        while length < size:
+            chunk = self.statement() + '\n'
+            chunks.append(chunk)
+            length += len(chunk)
+        return ''.join(chunks)
+
+def generate_corpus(size, seed=0):
+    return CorpusGenerator(seed).generate(size)
+
+def parse_size(text):
+    # '64K' -> 65536; a plain number is in bytes
+    text = text.strip().upper().rstrip('B')
+    if text[-1:] in SIZE_UNITS: return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+##################################################
+# MEASUREMENT
+##################################################
+
+def measure(function, repeat):
+    # Times function repeat times, each time calling it as often as it takes
+    # to run MIN_MEASUREMENT_TIME. Returns the seconds per call of every
+    # measurement and the last result.
+    start_time = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start_time
+    number = max(1, int(MIN_MEASUREMENT_TIME / max(elapsed, 1e-9)))
+
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start_time = time.perf_counter()
+        for _ in range(number): result = function()
+        times.append((time.perf_counter() - start_time) / number)
+    return times, result
+
+def summarize_times(times, size):
+    best = min(times)
+    return {
+        'min': best,
+        'median': statistics.median(times),
+        'mean': statistics.fmean(times),
+        'runs': times,
+        'mb_per_second': size / best / 1e6
+    }
+
+def bench_size(size, repeat, seed=0, lexer_engine='regex'):
+    # Times each stage on its own, feeding it what the previous stage produced
+    text = generate_corpus(size, seed)
+    lexer_class = main.LEXERS[lexer_engine]
+
+    def lex():
+        tokens, error = lexer_class('<benchmark>', text).make_tokens()
+        if error: raise RuntimeError(error.as_string())
+        return tokens
+
+    lex_times, tokens = measure(lex, repeat)
+
+    def parse():
+        ast = main.Parser(tokens).parse()
+        if ast.error: raise RuntimeError(ast.error.as_string())
+        return ast.node
+
+    parse_times, node = measure(parse, repeat)
+    del tokens
+
+    ic_times, code = measure(lambda: main.IntermediateCodeGenerator(node).generate_intermediate_code(), repeat)
+
+    return {
+        'size': len(text),
+        'sha256': hashlib.sha256(text.encode()).hexdigest(),
+        'lines': text.count('\n'),
+        'ic_lines': code.count('\n'),
+        'stages': {
+            'lex': summarize_times(lex_times, len(text)),
+            'parse': summarize_times(parse_times, len(text)),
+            'ic': summarize_times(ic_times, len(text))
+        }
+    }
+
+def run_suite(sizes=DEFAULT_SIZES, repeat=5, seed=0, lexer_engine='regex', report=print):
+    results = {}
+    for label in sizes:
+        result = results[label] = bench_size(parse_size(label), repeat, seed, lexer_engine)
+        stages = '  '.join(f"{stage} {result['stages'][stage]['min'] * 1000:10.3f}ms" for stage in SUITE_STAGES)
+        report(f"{label:>6} {result['size']:>11} chars: {stages}")
+    return {
+        'python': platform.python_version(),
+        'implementation': sys.implementation.name,
+        'machine': platform.machine(),
+        'lexer': lexer_engine,
+        'seed': seed,
+        'repeat': repeat,
+        'results': results
+    }
+
+##################################################
+# REGRESSION GATE
+##################################################
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    # Returns (lines, regressions) comparing the best time of every stage
+    # both runs measured; a stage regresses when it is more than threshold
+    # slower than the baseline. Corpora that differ are not compared.
+    lines = []
+    regressions = []
+    for label, result in current['results'].items():
+        expected = baseline['results'].get(label)
+        if expected is None: continue
+        if expected['sha256'] != result['sha256']:
+            lines.append(f'{label:>6}: corpus differs from the baseline, not compared')
+            continue
+        for stage in SUITE_STAGES:
+            ratio = result['stages'][stage]['min'] / expected['stages'][stage]['min']
+            regressed = ratio > 1 + threshold
+            lines.append(f"{label:>6} {stage:>5}: {expected['stages'][stage]['min'] * 1000:10.3f}ms -> "
+                         f"{result['stages'][stage]['min'] * 1000:10.3f}ms  x{ratio:.2f}{'  REGRESSION' if regressed else ''}")
+            if regressed: regressions.append((label, stage, ratio))
+    return lines, regressions
+
+def main_suite(arguments=None):
+    argumentParser = argparse.ArgumentParser(description='Time lexing, parsing and IC generation on generated programs')
+    argumentParser.add_argument('--sizes', default=','.join(DEFAULT_SIZES), help='comma separated corpus sizes such as 1K,1M,100M')
+    argumentParser.add_argument('--repeat', type=int, default=5, help='measurements per stage')
+    argumentParser.add_argument('--seed', type=int, default=0)
+    argumentParser.add_argument('--lexer', choices=sorted(main.LEXERS), default='regex')
+    argumentParser.add_argument('--output', help='write the results as JSON to this file')
+    argumentParser.add_argument('--baseline', help='JSON results to compare against')
+    argumentParser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='allowed slowdown per stage (0.15 is 15%%)')
+    arguments = argumentParser.parse_args(arguments)
+
+    current = run_suite([size.strip() for size in arguments.sizes.split(',')], arguments.repeat, arguments.seed, arguments.lexer)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump(current, file, indent=2)
+
+    if not arguments.baseline: return 0
+    with open(arguments.baseline) as file:
+        baseline = json.load(file)
+    lines, regressions = compare(current, baseline, arguments.threshold)
+    print('\n' + '\n'.join(lines))
+    if regressions:
+        print(f'\n{len(regressions)} stage(s) regressed by more than {arguments.threshold:.0%}')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main_suite())
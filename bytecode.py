@@ -0,0 +1,303 @@
+from array import array
+from nodes import *
+
+##################################################
+# BYTECODE
+##################################################
+
+class Function:
+    __slots__ = ('name', 'entry', 'arg_count', 'local_names')
+
+    def __init__(self, name, arg_count, local_names):
+        self.name = name
+        self.entry = None
+        self.arg_count = arg_count
+        self.local_names = local_names
+
+    def __repr__(self):
+        return f'<function {self.name}/{self.arg_count} at {self.entry}>'
+
+
+class Bytecode:
+    # code holds opcode, argument pairs; jump targets and function entries
+    # are offsets into it. starts and ends hold the source span of each
+    # instruction, for runtime errors.
+    def __init__(self, source):
+        self.source = source
+        self.code = array('i')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.constants = []
+        self.global_names = []
+        self.functions = []
+
+    def emit(self, opcode, arg, node):
+        offset = len(self.code)
+        self.code.append(opcode)
+        self.code.append(arg)
+        self.starts.append(node.start)
+        self.ends.append(node.end)
+        return offset
+
+    def patch(self, offset, arg):
+        self.code[offset + 1] = arg
+
+    def here(self):
+        return len(self.code)
+
+    def get_start(self, offset):
+        return self.starts[offset // 2]
+
+    def get_end(self, offset):
+        return self.ends[offset // 2]
+
+    def disassemble(self):
+        entries = {function.entry: function.name for function in self.functions}
+        lines = []
+        for offset in range(0, len(self.code), 2):
+            if offset in entries: lines.append(f'{entries[offset]}:')
+            opcode, arg = self.code[offset], self.code[offset + 1]
+            if opcode == OP_CONST or opcode == OP_FAIL: detail = f' ({self.constants[arg]!r})'
+            elif opcode in (OP_LOAD_GLOBAL, OP_STORE_GLOBAL): detail = f' ({self.global_names[arg]})'
+            elif opcode == OP_CALL: detail = f' ({self.functions[arg].name})'
+            else: detail = ''
+            lines.append(f'{offset:>6} {OP_NAMES[opcode]:<20} {arg}{detail}')
+        return '\n'.join(lines)
+
+##################################################
+# COMPILER
+##################################################
+
+BINARY_OPCODES = {
+    TOKEN_PLUS: OP_ADD,
+    TOKEN_MINUS: OP_SUB,
+    TOKEN_MUL: OP_MUL,
+    TOKEN_DIV: OP_DIV,
+    TOKEN_EE: OP_EE,
+    TOKEN_NE: OP_NE,
+    TOKEN_LT: OP_LT,
+    TOKEN_GT: OP_GT,
+    TOKEN_LTE: OP_LTE,
+    TOKEN_GTE: OP_GTE
+}
+
+class BytecodeCompiler:
+    # Every node leaves exactly one value on the stack. Blocks evaluate to
+    # their last statement, if to the branch taken, and loops, function
+    # definitions and empty blocks to 0. A call returns the value of the
+    # function body.
+    #
+    # Functions are hoisted: any named function in the program can be
+    # called from anywhere, and a later definition of a name wins. Inside a
+    # function, parameters and every variable it assigns are locals; other
+    # names are globals.
+    def __init__(self):
+        self.bytecode = None
+        self.locals = None
+        self.function_indices = {}
+        self.function_nodes = []
+        self.constant_indices = {}
+        self.global_indices = {}
+
+    def compile(self, node):
+        self.bytecode = Bytecode(node.source)
+        self.collect_functions(node)
+
+        self.compile_node(node)
+        self.bytecode.emit(OP_HALT, 0, node)
+
+        for function, function_node in zip(self.bytecode.functions, self.function_nodes):
+            function.entry = self.bytecode.here()
+            self.locals = {name: slot for slot, name in enumerate(function.local_names)}
+            self.compile_node(function_node.body_node)
+            self.bytecode.emit(OP_RETURN, 0, function_node.body_node)
+        self.locals = None
+
+        return self.bytecode
+
+    ###################################
+
+    def collect_functions(self, root):
+        pending = [root]
+        while pending:
+            node = pending.pop()
+            if isinstance(node, FuncDefNode):
+                name = node.var_name_token.value
+                arg_names = [token.value for token in node.arg_name_tokens]
+                function = Function(name, len(arg_names), arg_names + sorted(self.get_assigned_names(node.body_node) - set(arg_names)))
+                if name in self.function_indices:
+                    index = self.function_indices[name]
+                    self.bytecode.functions[index] = function
+                    self.function_nodes[index] = node
+                else:
+                    self.function_indices[name] = len(self.bytecode.functions)
+                    self.bytecode.functions.append(function)
+                    self.function_nodes.append(node)
+            pending.extend(reversed(get_children(node)))
+
+    def get_assigned_names(self, root):
+        names = set()
+        pending = [root]
+        while pending:
+            node = pending.pop()
+            if isinstance(node, VarAssignNode): names.add(node.var_name_token.value)
+            if not isinstance(node, FuncDefNode): pending.extend(get_children(node))
+        return names
+
+    def add_constant(self, value):
+        key = (type(value), repr(value))
+        if key not in self.constant_indices:
+            self.constant_indices[key] = len(self.bytecode.constants)
+            self.bytecode.constants.append(value)
+        return self.constant_indices[key]
+
+    def get_global(self, name):
+        if name not in self.global_indices:
+            self.global_indices[name] = len(self.bytecode.global_names)
+            self.bytecode.global_names.append(name)
+        return self.global_indices[name]
+
+    def emit_load(self, name, node):
+        if self.locals is not None and name in self.locals:
+            self.bytecode.emit(OP_LOAD_LOCAL, self.locals[name], node)
+        else:
+            self.bytecode.emit(OP_LOAD_GLOBAL, self.get_global(name), node)
+
+    def emit_store(self, name, node):
+        if self.locals is not None and name in self.locals:
+            self.bytecode.emit(OP_STORE_LOCAL, self.locals[name], node)
+        else:
+            self.bytecode.emit(OP_STORE_GLOBAL, self.get_global(name), node)
+
+    ###################################
+
+    def compile_node(self, node):
+        method = getattr(self, f'compile_{type(node).__name__}')
+        method(node)
+
+    def compile_effect(self, node):
+        # Compiles node for its side effects only
+        if isinstance(node, VarAssignNode):
+            self.compile_node(node.value_node)
+            self.emit_store(node.var_name_token.value, node)
+        elif isinstance(node, ListNode):
+            for element_node in node.element_nodes: self.compile_effect(element_node)
+        else:
+            self.compile_node(node)
+            self.bytecode.emit(OP_POP, 0, node)
+
+    def compile_NumberNode(self, node):
+        self.bytecode.emit(OP_CONST, self.add_constant(node.token.value), node)
+
+    def compile_StringNode(self, node):
+        self.bytecode.emit(OP_CONST, self.add_constant(node.token.value), node)
+
+    def compile_VarAccessNode(self, node):
+        self.emit_load(node.var_name_token.value, node)
+
+    def compile_VarAssignNode(self, node):
+        self.compile_node(node.value_node)
+        self.bytecode.emit(OP_DUP, 0, node)
+        self.emit_store(node.var_name_token.value, node)
+
+    def compile_BinOpNode(self, node):
+        # && and || short-circuit and give the operand that decided them
+        op_type = node.op_token.type
+        if op_type == TOKEN_AND or op_type == TOKEN_OR:
+            self.compile_node(node.left_node)
+            jump = self.bytecode.emit(OP_JUMP_IF_FALSE_OR_POP if op_type == TOKEN_AND else OP_JUMP_IF_TRUE_OR_POP, 0, node)
+            self.compile_node(node.right_node)
+            self.bytecode.patch(jump, self.bytecode.here())
+            return
+
+        self.compile_node(node.left_node)
+        self.compile_node(node.right_node)
+        self.bytecode.emit(BINARY_OPCODES[op_type], 0, node)
+
+    def compile_UnaryOpNode(self, node):
+        self.compile_node(node.node)
+        if node.op_token.type == TOKEN_NOT: self.bytecode.emit(OP_NOT, 0, node)
+        elif node.op_token.type == TOKEN_MINUS: self.bytecode.emit(OP_NEG, 0, node)
+
+    def compile_IfNode(self, node):
+        end_jumps = []
+        for condition, body in node.cases:
+            self.compile_node(condition)
+            next_case = self.bytecode.emit(OP_JUMP_IF_FALSE, 0, condition)
+            self.compile_node(body)
+            end_jumps.append(self.bytecode.emit(OP_JUMP, 0, node))
+            self.bytecode.patch(next_case, self.bytecode.here())
+
+        if node.else_case: self.compile_node(node.else_case)
+        else: self.bytecode.emit(OP_CONST, self.add_constant(0), node)
+
+        for jump in end_jumps: self.bytecode.patch(jump, self.bytecode.here())
+
+    def compile_WhileNode(self, node):
+        start = self.bytecode.here()
+        self.compile_node(node.condition_node)
+        exit_jump = self.bytecode.emit(OP_JUMP_IF_FALSE, 0, node.condition_node)
+        self.compile_effect(node.body_node)
+        self.bytecode.emit(OP_JUMP, start, node)
+        self.bytecode.patch(exit_jump, self.bytecode.here())
+        self.bytecode.emit(OP_CONST, self.add_constant(0), node)
+
+    def compile_ForNode(self, node):
+        # for (let a = start, condition, step) assigns step to a after the body
+        self.compile_effect(node.expr_node)
+        start = self.bytecode.here()
+        self.compile_node(node.comp_expr_node)
+        exit_jump = self.bytecode.emit(OP_JUMP_IF_FALSE, 0, node.comp_expr_node)
+        self.compile_effect(node.body_node)
+        self.compile_node(node.arith_expr_node)
+        self.emit_store(node.expr_node.var_name_token.value, node.arith_expr_node)
+        self.bytecode.emit(OP_JUMP, start, node)
+        self.bytecode.patch(exit_jump, self.bytecode.here())
+        self.bytecode.emit(OP_CONST, self.add_constant(0), node)
+
+    def compile_FuncDefNode(self, node):
+        # The body is compiled once all top-level code is done
+        self.bytecode.emit(OP_CONST, self.add_constant(0), node)
+
+    def compile_CallNode(self, node):
+        name = node.node_to_call.var_name_token.value if isinstance(node.node_to_call, VarAccessNode) else None
+        for arg_node in node.arg_nodes: self.compile_node(arg_node)
+
+        if name in self.function_indices:
+            function = self.bytecode.functions[self.function_indices[name]]
+            if function.arg_count == len(node.arg_nodes):
+                self.bytecode.emit(OP_CALL, self.function_indices[name], node)
+                return
+            details = f"'{name}' takes {function.arg_count} arguments but {len(node.arg_nodes)} were given"
+        elif name == 'log':
+            self.bytecode.emit(OP_LOG, len(node.arg_nodes), node)
+            return
+        elif name is None:
+            details = 'Only named functions can be called'
+        else:
+            details = f"'{name}' is not a function"
+        self.bytecode.emit(OP_FAIL, self.add_constant(details), node)
+
+    def compile_ListNode(self, node):
+        if not node.element_nodes:
+            self.bytecode.emit(OP_CONST, self.add_constant(0), node)
+            return
+        for element_node in node.element_nodes[:-1]:
+            self.compile_effect(element_node)
+        self.compile_node(node.element_nodes[-1])
+
+def get_children(node):
+    # The nodes directly below node, in source order
+    if isinstance(node, ListNode): return node.element_nodes
+    if isinstance(node, VarAssignNode): return [node.value_node]
+    if isinstance(node, BinOpNode): return [node.left_node, node.right_node]
+    if isinstance(node, UnaryOpNode): return [node.node]
+    if isinstance(node, CallNode): return [node.node_to_call] + node.arg_nodes
+    if isinstance(node, IfNode):
+        children = [child for case in node.cases for child in case]
+        if node.else_case: children.append(node.else_case)
+        return children
+    if isinstance(node, ForNode): return [node.expr_node, node.comp_expr_node, node.arith_expr_node, node.body_node]
+    if isinstance(node, WhileNode): return [node.condition_node, node.body_node]
+    if isinstance(node, FuncDefNode): return [node.body_node]
+    return []
@@ -0,0 +1,223 @@
+import gc, hashlib, importlib.util, io, os, pickle, sys
+from collections import Counter
+from position import SourceFile
+
+##################################################
+# FINGERPRINT
+##################################################
+
+# Bump when the layout of the stored artifacts changes
+CACHE_FORMAT = 1
+
+# Modules whose code decides what the cached stages produce
+COMPILER_MODULES = (
+    'constants', 'position', 'error', 'string_with_arrows', 'lexer', 'nodes',
+    'ir', 'ourjs_parser', 'operations', 'cfg', 'optimizer', 'main', 'cache'
+)
+
+STAGE_TOKENS = 'tokens'
+STAGE_AST = 'ast'
+STAGE_IC = 'ic'
+
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+def compiler_fingerprint():
+    # Changes whenever the compiler or the interpreter unpickling its objects does
+    digest = hashlib.sha256(f'{CACHE_FORMAT} {sys.implementation.cache_tag} {pickle.HIGHEST_PROTOCOL}'.encode())
+    for name in COMPILER_MODULES:
+        with open(importlib.util.find_spec(name).origin, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+def default_cache_directory():
+    return os.environ.get('OURJS_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'ourjs')
+
+##################################################
+# PICKLING
+##################################################
+
+def source_reference():
+    # Stands for the SourceFile in stored artifacts; see SourceUnpickler
+    raise pickle.UnpicklingError('An artifact referring to a source needs a SourceUnpickler')
+
+class SourcePickler(pickle.Pickler):
+    # Tokens, nodes and positions all point at one SourceFile. It is stored
+    # as a reference and the source being compiled takes its place on load,
+    # so entries hold neither the text nor the file name. A reducer rather
+    # than persistent_id keeps the check out of the per object path.
+    def __init__(self, file):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.dispatch_table = {SourceFile: lambda source: (source_reference, ())}
+
+class SourceUnpickler(pickle.Unpickler):
+    def __init__(self, file, source):
+        super().__init__(file)
+        self.source = source
+
+    def find_class(self, module_name, name):
+        if module_name == __name__ and name == 'source_reference': return lambda: self.source
+        return super().find_class(module_name, name)
+
+def without_gc(function, *args):
+    # A tree is hundreds of thousands of small objects and the cyclic
+    # collector would rescan them over and over while they are created
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return function(*args)
+    finally:
+        if enabled: gc.enable()
+
+##################################################
+# COMPILE CACHE
+##################################################
+
+class CompileCache:
+    # Stores the result of each compile stage in directory under a hash of
+    # the source text and the compiler fingerprint, so an edited file or a
+    # changed compiler never sees a stale entry. Entries are files; reading
+    # one touches its modification time and once the directory grows past
+    # max_size bytes the least recently used are removed. With bypass set
+    # nothing is read or written; with refresh set nothing is read, so every
+    # stage runs, and the results are written.
+    def __init__(self, directory=None, max_size=DEFAULT_CACHE_SIZE, bypass=False, refresh=False):
+        self.directory = directory or default_cache_directory()
+        self.max_size = max_size
+        self.bypass = bypass
+        self.refresh = refresh
+        self.fingerprint = compiler_fingerprint()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.stores = 0
+        self.evictions = 0
+        # path -> [size, last use], scanned from the directory on the first store
+        self.entries = None
+        self.total_size = 0
+
+    def get_key(self, text):
+        # The same characters as str and as UTF-8 bytes lex to different
+        # offsets once they go past ASCII, so the two never share entries
+        digest = hashlib.sha256(self.fingerprint.encode())
+        if isinstance(text, str):
+            digest.update(b'str')
+            digest.update(text.encode('utf-8', 'surrogatepass'))
+        else:
+            digest.update(b'bytes')
+            digest.update(text)
+        return digest.hexdigest()
+
+    def get_path(self, key, stage):
+        return os.path.join(self.directory, key[:2], f'{key}.{stage}')
+
+    def load(self, key, stage, source=None):
+        # Returns the stored artifact or None
+        if self.bypass or self.refresh: return None
+        path = self.get_path(key, stage)
+        try:
+            with open(path, 'rb') as file:
+                value = without_gc(SourceUnpickler(file, source).load)
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses[stage] += 1
+            return None
+        except Exception:
+            # A truncated or foreign file is dropped and rebuilt
+            self.misses[stage] += 1
+            self.remove(path)
+            return None
+
+        self.hits[stage] += 1
+        if self.entries is not None and path in self.entries:
+            try:
+                self.entries[path][1] = os.stat(path).st_mtime
+            except FileNotFoundError:
+                # Evicted by another process since it was read
+                self.remove(path)
+        return value
+
+    def store(self, key, stage, value):
+        if self.bypass: return
+        buffer = io.BytesIO()
+        try:
+            without_gc(SourcePickler(buffer).dump, value)
+        except (pickle.PicklingError, RecursionError):
+            # Trees nested too deeply to pickle are just recompiled
+            return
+        data = buffer.getvalue()
+        if len(data) > self.max_size: return
+
+        path = self.get_path(key, stage)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(data)
+        os.replace(temporary, path)
+        self.stores += 1
+
+        if self.entries is None:
+            self.scan()
+        else:
+            try:
+                self.account(path, len(data), os.stat(path).st_mtime)
+            except FileNotFoundError:
+                pass
+        self.evict()
+
+    def scan(self):
+        self.entries = {}
+        self.total_size = 0
+        if not os.path.isdir(self.directory): return
+        # Other processes sharing the directory may evict entries meanwhile
+        for bucket in os.scandir(self.directory):
+            if not bucket.is_dir(): continue
+            try:
+                entries = list(os.scandir(bucket.path))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.name.endswith('.tmp'): continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                self.account(entry.path, stat.st_size, stat.st_mtime)
+
+    def account(self, path, size, last_use):
+        if path in self.entries: self.total_size -= self.entries[path][0]
+        self.entries[path] = [size, last_use]
+        self.total_size += size
+
+    def evict(self):
+        if self.total_size <= self.max_size: return
+        for path, (size, _) in sorted(self.entries.items(), key=lambda item: item[1][1]):
+            if self.total_size <= self.max_size: break
+            self.remove(path)
+            self.evictions += 1
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        if self.entries is not None and path in self.entries:
+            self.total_size -= self.entries.pop(path)[0]
+
+    def clear(self):
+        if self.entries is None: self.scan()
+        for path in list(self.entries): self.remove(path)
+
+    def stats(self):
+        return {
+            'hits': sum(self.hits.values()),
+            'misses': sum(self.misses.values()),
+            'stage_hits': dict(self.hits),
+            'stage_misses': dict(self.misses),
+            'stores': self.stores,
+            'evictions': self.evictions
+        }
+
+    def summary(self):
+        stages = sorted(set(self.hits) | set(self.misses))
+        details = ', '.join(f'{stage} {self.hits[stage]}/{self.misses[stage]}' for stage in stages)
+        stats = self.stats()
+        return f"Cache: {stats['hits']} hits, {stats['misses']} misses ({details or 'no lookups'}), {self.stores} stored, {self.evictions} evicted"
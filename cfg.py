@@ -0,0 +1,163 @@
+from ir import *
+
+##################################################
+# BASIC BLOCK
+##################################################
+
+class BasicBlock:
+    # Instructions start up to but excluding end
+    __slots__ = ('index', 'start', 'end', 'successors', 'predecessors')
+
+    def __init__(self, index, start, end):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.successors = []
+        self.predecessors = []
+
+    def __repr__(self):
+        return f'B{self.index}[{self.start}:{self.end}] -> {[block.index for block in self.successors]}'
+
+##################################################
+# CONTROL FLOW GRAPH
+##################################################
+
+class ControlFlowGraph:
+    # Blocks start at the program start, at labels and function entries and
+    # after jumps and rets. Control that reaches a function entry skips to
+    # after its ret, and a call returns to the next instruction, so calls do
+    # not end blocks.
+    def __init__(self, instructions):
+        self.instructions = instructions
+        self.opcodes = [IR_OPCODES[code] for code in instructions.opcodes]
+        self.blocks = []
+        self.label_blocks = {}
+        self.entries = []
+
+        self.make_blocks()
+        self.link_blocks()
+
+    def make_blocks(self):
+        opcodes, args1 = self.opcodes, self.instructions.args1
+        start = 0
+        for index in range(len(opcodes)):
+            opcode = opcodes[index]
+            if (opcode == IR_LABEL or opcode == IR_FUNC) and index > start:
+                self.add_block(start, index)
+                start = index
+            if opcode == IR_GOTO or opcode == IR_IF_FALSE or opcode == IR_RET:
+                self.add_block(start, index + 1)
+                start = index + 1
+        if start < len(opcodes): self.add_block(start, len(opcodes))
+
+        for block in self.blocks:
+            if opcodes[block.start] == IR_LABEL: self.label_blocks[args1[block.start]] = block
+
+    def add_block(self, start, end):
+        self.blocks.append(BasicBlock(len(self.blocks), start, end))
+
+    def link_blocks(self):
+        opcodes, args1, args2 = self.opcodes, self.instructions.args1, self.instructions.args2
+        block_starts = {block.start: block for block in self.blocks}
+
+        # Where control goes after each function definition
+        after = {}
+        entries = []
+        for index in range(len(opcodes)):
+            if opcodes[index] == IR_FUNC: entries.append(index)
+            elif opcodes[index] == IR_RET: after[entries.pop()] = index + 1
+
+        def get_fallthrough(index):
+            while index in after: index = after[index]
+            return block_starts.get(index)
+
+        if get_fallthrough(0) is not None: self.entries.append(get_fallthrough(0))
+        for block in self.blocks:
+            last = block.end - 1
+            opcode = opcodes[last]
+            if opcodes[block.start] == IR_FUNC: self.entries.append(block)
+
+            if opcode == IR_GOTO:
+                targets = [self.label_blocks[args1[last]]]
+            elif opcode == IR_IF_FALSE:
+                targets = [self.label_blocks[args2[last]], get_fallthrough(block.end)]
+            elif opcode == IR_RET:
+                targets = []
+            else:
+                targets = [get_fallthrough(block.end)]
+
+            for target in targets:
+                if target is None or target in block.successors: continue
+                block.successors.append(target)
+                target.predecessors.append(block)
+
+    def __iter__(self):
+        return iter(self.blocks)
+
+    def __len__(self):
+        return len(self.blocks)
+
+##################################################
+# LIVENESS
+##################################################
+
+class Liveness:
+    # Backward dataflow over the blocks of a ControlFlowGraph. By default the
+    # facts are temporaries; get_uses and get_def can be replaced to track
+    # anything else an instruction reads and writes.
+    def __init__(self, cfg, get_uses=get_temp_uses, get_def=get_temp_def):
+        self.cfg = cfg
+        self.get_uses = get_uses
+        self.get_def = get_def
+        self.live_in = [set() for _ in cfg.blocks]
+        self.live_out = [set() for _ in cfg.blocks]
+
+        self.gen = []
+        self.kill = []
+        for block in cfg.blocks: self.summarize(block)
+        self.solve()
+
+    def summarize(self, block):
+        # gen: read before being written in the block, kill: written in it
+        opcodes, dests, args1, args2 = self.cfg.opcodes, self.cfg.instructions.dests, self.cfg.instructions.args1, self.cfg.instructions.args2
+        gen = set()
+        kill = set()
+        for index in range(block.end - 1, block.start - 1, -1):
+            defined = self.get_def(opcodes[index], dests[index])
+            if defined is not None:
+                kill.add(defined)
+                gen.discard(defined)
+            gen.update(self.get_uses(opcodes[index], args1[index], args2[index]))
+        self.gen.append(gen)
+        self.kill.append(kill)
+
+    def solve(self):
+        pending = list(self.cfg.blocks)
+        queued = [True] * len(self.cfg.blocks)
+        while pending:
+            block = pending.pop()
+            queued[block.index] = False
+
+            live_out = set()
+            for successor in block.successors: live_out |= self.live_in[successor.index]
+            self.live_out[block.index] = live_out
+
+            live_in = (live_out - self.kill[block.index]) | self.gen[block.index]
+            if live_in != self.live_in[block.index]:
+                self.live_in[block.index] = live_in
+                for predecessor in block.predecessors:
+                    if not queued[predecessor.index]:
+                        queued[predecessor.index] = True
+                        pending.append(predecessor)
+
+    def get_live_after(self, block):
+        # (index, facts live just after the instruction) for each instruction
+        # of block, last instruction first
+        opcodes, dests, args1, args2 = self.cfg.opcodes, self.cfg.instructions.dests, self.cfg.instructions.args1, self.cfg.instructions.args2
+        live = set(self.live_out[block.index])
+        for index in range(block.end - 1, block.start - 1, -1):
+            yield index, live
+            live = set(live)
+            defined = self.get_def(opcodes[index], dests[index])
+            if defined is not None: live.discard(defined)
+            live.update(self.get_uses(opcodes[index], args1[index], args2[index]))
@@ -0,0 +1,79 @@
+import argparse, json, os, socket, sys
+
+# Talks to server.py. Kept free of compiler imports so that starting it
+# costs little more than starting Python.
+
+def default_socket_path():
+    return os.environ.get('OURJS_SOCKET') or os.path.join(os.environ.get('TMPDIR', '/tmp'), f'ourjs-{os.getuid()}.sock')
+
+##################################################
+# PROTOCOL
+##################################################
+
+# Requests and responses are JSON objects, one per line. A request is
+#   {"id": any, "op": "compile", "path": "a.ourjs"}  or  {..., "text": "let a = 1"}
+# with optional "file_name", "emit" (tokens, ast or ic), "lexer",
+# "optimization_level", "recover" and "max_errors"; or an "op" of "ping",
+# "stats" or "shutdown". The response carries the same "id" and either
+#   {"ok": true, "output": "..."}
+# or {"ok": false, "errors": [{"name", "details", "file", "line", "column", "message"}], "stopped": bool}
+# where line and column count from 1 and message is the error as run.py prints it.
+
+def encode(message):
+    return (json.dumps(message) + '\n').encode('utf-8')
+
+class CompileClient:
+    # One connection to the server; requests on it are answered in turn
+    def __init__(self, path=None):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path or default_socket_path())
+        self.file = self.socket.makefile('rb')
+        self.next_id = 0
+
+    def request(self, **fields):
+        self.next_id += 1
+        fields['id'] = self.next_id
+        self.socket.sendall(encode(fields))
+        line = self.file.readline()
+        if not line: raise ConnectionError('the compile server closed the connection')
+        return json.loads(line)
+
+    def compile(self, path=None, text=None, **options):
+        if text is not None: return self.request(op='compile', text=text, **options)
+        return self.request(op='compile', path=os.path.abspath(path), **options)
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+def print_response(response):
+    # Prints the output or the errors of a compile response; returns the exit status
+    if response.get('ok'):
+        sys.stdout.write(response.get('output') or '')
+        return 0
+    print('\n\n'.join(error['message'] for error in response['errors']))
+    return 1
+
+if __name__ == '__main__':
+    argumentParser = argparse.ArgumentParser(description='Compile through a running server.py')
+    argumentParser.add_argument('file', nargs='?', help='file to compile (read by the server)')
+    argumentParser.add_argument('--text', help='compile this text instead of a file')
+    argumentParser.add_argument('--emit', default='ic', choices=('tokens', 'ast', 'ic'))
+    argumentParser.add_argument('--optimize', type=int, default=0, help='optimization level')
+    argumentParser.add_argument('--all-errors', action='store_true', help='report every error instead of stopping at the first')
+    argumentParser.add_argument('--max-errors', type=int, default=100)
+    argumentParser.add_argument('--socket', help='server socket (default $OURJS_SOCKET or /tmp/ourjs-UID.sock)')
+    argumentParser.add_argument('--stats', action='store_true', help='print the server statistics')
+    argumentParser.add_argument('--shutdown', action='store_true', help='stop the server')
+    arguments = argumentParser.parse_args()
+
+    client = CompileClient(arguments.socket)
+    if arguments.stats or arguments.shutdown:
+        response = client.request(op='stats' if arguments.stats else 'shutdown')
+        if arguments.stats: print(json.dumps(response['stats'], indent=2))
+        sys.exit(0)
+    if arguments.file is None and arguments.text is None: argumentParser.error('give a file or --text')
+
+    options = {'emit': arguments.emit, 'optimization_level': arguments.optimize}
+    if arguments.all_errors: options.update(recover=True, max_errors=arguments.max_errors)
+    sys.exit(print_response(client.compile(arguments.file, arguments.text, **options)))
@@ -39,6 +39,38 @@ TOKEN_NEWLINE = 'TOKEN_NEWLINE'
 TOKEN_EOF = 'TOKEN_EOF'
 TOKEN_COMMA = 'TOKEN_COMMA'
 
+# Compact codes for the token types, used by TokenStream columns
+TOKEN_TYPES = [
+    TOKEN_INT,
+    TOKEN_FLOAT,
+    TOKEN_STRING,
+    TOKEN_IDENTIFIER,
+    TOKEN_KEYWORD,
+    TOKEN_PLUS,
+    TOKEN_MINUS,
+    TOKEN_MUL,
+    TOKEN_DIV,
+    TOKEN_EQ,
+    TOKEN_LPAREN,
+    TOKEN_RPAREN,
+    TOKEN_EE,
+    TOKEN_NE,
+    TOKEN_LT,
+    TOKEN_GT,
+    TOKEN_LTE,
+    TOKEN_GTE,
+    TOKEN_LCURL,
+    TOKEN_RCURL,
+    TOKEN_NOT,
+    TOKEN_AND,
+    TOKEN_OR,
+    TOKEN_NEWLINE,
+    TOKEN_EOF,
+    TOKEN_COMMA
+]
+
+TOKEN_CODES = {token_type: code for code, token_type in enumerate(TOKEN_TYPES)}
+
 KEYWORDS = [
     'let',
     'if',
@@ -46,4 +78,173 @@ KEYWORDS = [
     'while',
     'for',
     'func'
-]
\ No newline at end of file
+]
+
+##################################################
+# SYMBOLS
+##################################################
+
+# Two character symbols are listed first so they win over their one
+# character prefixes when the table is turned into a pattern.
+SYMBOLS = {
+    '==': TOKEN_EE,
+    '!=': TOKEN_NE,
+    '<=': TOKEN_LTE,
+    '>=': TOKEN_GTE,
+    '&&': TOKEN_AND,
+    '||': TOKEN_OR,
+    '+': TOKEN_PLUS,
+    '-': TOKEN_MINUS,
+    '*': TOKEN_MUL,
+    '/': TOKEN_DIV,
+    '(': TOKEN_LPAREN,
+    ')': TOKEN_RPAREN,
+    '{': TOKEN_LCURL,
+    '}': TOKEN_RCURL,
+    ',': TOKEN_COMMA,
+    '=': TOKEN_EQ,
+    '<': TOKEN_LT,
+    '>': TOKEN_GT,
+    '!': TOKEN_NOT,
+    ';': TOKEN_NEWLINE,
+    '\n': TOKEN_NEWLINE
+}
+
+WHITESPACE = ' \t'
+
+##################################################
+# PRECEDENCE
+##################################################
+
+# Binding power of the binary operators, all left associative. Unary + and -
+# bind tighter than any of them and ! binds looser than the comparisons.
+PRECEDENCE_LOGIC = 1
+PRECEDENCE_COMPARISON = 2
+PRECEDENCE_ARITHMETIC = 3
+PRECEDENCE_TERM = 4
+
+BINARY_PRECEDENCE = {
+    TOKEN_AND: PRECEDENCE_LOGIC,
+    TOKEN_OR: PRECEDENCE_LOGIC,
+    TOKEN_EE: PRECEDENCE_COMPARISON,
+    TOKEN_NE: PRECEDENCE_COMPARISON,
+    TOKEN_LT: PRECEDENCE_COMPARISON,
+    TOKEN_GT: PRECEDENCE_COMPARISON,
+    TOKEN_LTE: PRECEDENCE_COMPARISON,
+    TOKEN_GTE: PRECEDENCE_COMPARISON,
+    TOKEN_PLUS: PRECEDENCE_ARITHMETIC,
+    TOKEN_MINUS: PRECEDENCE_ARITHMETIC,
+    TOKEN_MUL: PRECEDENCE_TERM,
+    TOKEN_DIV: PRECEDENCE_TERM
+}
+
+##################################################
+# INTERMEDIATE CODE
+##################################################
+
+# Operator opcodes are the symbols printed in the textual IC
+IR_ADD = '+'
+IR_SUB = '-'
+IR_MUL = '*'
+IR_DIV = '/'
+IR_MOD = '%'
+IR_EE = '=='
+IR_NE = '!='
+IR_LT = '<'
+IR_GT = '>'
+IR_LTE = '<='
+IR_GTE = '>='
+IR_AND = '&&'
+IR_OR = '||'
+IR_NOT = '!'
+IR_NEG = 'uminus'
+
+IR_CONST = 'const'
+IR_LOAD = 'load'
+IR_STORE = 'store'
+IR_LABEL = 'label'
+IR_FUNC = 'func'
+IR_GOTO = 'goto'
+IR_IF_FALSE = 'iffalse'
+IR_CALL = 'call'
+IR_RET = 'ret'
+
+IR_BINARY_OPS = {
+    IR_ADD, IR_SUB, IR_MUL, IR_DIV, IR_MOD,
+    IR_EE, IR_NE, IR_LT, IR_GT, IR_LTE, IR_GTE,
+    IR_AND, IR_OR
+}
+
+IR_UNARY_OPS = {IR_NOT, IR_NEG}
+
+# Compact codes for the opcodes, used by InstructionList columns
+IR_OPCODES = [
+    IR_CONST,
+    IR_LOAD,
+    IR_STORE,
+    IR_ADD,
+    IR_SUB,
+    IR_MUL,
+    IR_DIV,
+    IR_MOD,
+    IR_EE,
+    IR_NE,
+    IR_LT,
+    IR_GT,
+    IR_LTE,
+    IR_GTE,
+    IR_AND,
+    IR_OR,
+    IR_NOT,
+    IR_NEG,
+    IR_LABEL,
+    IR_FUNC,
+    IR_GOTO,
+    IR_IF_FALSE,
+    IR_CALL,
+    IR_RET
+]
+
+IR_CODES = {opcode: code for code, opcode in enumerate(IR_OPCODES)}
+
+##################################################
+# BYTECODE
+##################################################
+
+# Every instruction is an opcode followed by one int argument
+OP_CONST = 0
+OP_LOAD_LOCAL = 1
+OP_STORE_LOCAL = 2
+OP_LOAD_GLOBAL = 3
+OP_STORE_GLOBAL = 4
+OP_ADD = 5
+OP_SUB = 6
+OP_MUL = 7
+OP_DIV = 8
+OP_EE = 9
+OP_NE = 10
+OP_LT = 11
+OP_GT = 12
+OP_LTE = 13
+OP_GTE = 14
+OP_NOT = 15
+OP_NEG = 16
+OP_JUMP = 17
+OP_JUMP_IF_FALSE = 18
+OP_JUMP_IF_FALSE_OR_POP = 19
+OP_JUMP_IF_TRUE_OR_POP = 20
+OP_POP = 21
+OP_DUP = 22
+OP_CALL = 23
+OP_RETURN = 24
+OP_LOG = 25
+OP_FAIL = 26
+OP_HALT = 27
+
+OP_NAMES = [
+    'CONST', 'LOAD_LOCAL', 'STORE_LOCAL', 'LOAD_GLOBAL', 'STORE_GLOBAL',
+    'ADD', 'SUB', 'MUL', 'DIV', 'EE', 'NE', 'LT', 'GT', 'LTE', 'GTE',
+    'NOT', 'NEG', 'JUMP', 'JUMP_IF_FALSE', 'JUMP_IF_FALSE_OR_POP',
+    'JUMP_IF_TRUE_OR_POP', 'POP', 'DUP', 'CALL', 'RETURN', 'LOG', 'FAIL',
+    'HALT'
+]
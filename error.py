@@ -14,7 +14,7 @@ class Error:
     def as_string(self):
         result = f'{self.error_name} : {self.details}'
         result += f' File {self.pos_start.file_name}, line {self.pos_start.line + 1}'
-        result += '\n\n' + string_with_arrows(self.pos_start.file_txt, self.pos_start, self.pos_end)
+        result += '\n\n' + string_with_arrows(self.pos_start.source, self.pos_start, self.pos_end)
         return result
     
 
@@ -28,4 +28,28 @@ class ExpectedCharError(Error):
 
 class InvalidSyntaxError(Error):
     def __init__(self, pos_start, pos_end, details):
-        super().__init__(pos_start, pos_end, 'Invalid Syntax', details)
\ No newline at end of file
+        super().__init__(pos_start, pos_end, 'Invalid Syntax', details)
+
+class RTError(Error):
+    def __init__(self, pos_start, pos_end, details):
+        super().__init__(pos_start, pos_end, 'Runtime Error', details)
+
+class ErrorList:
+    # Every diagnostic of a recovering compile, in source order. stopped is
+    # set when the compile gave up at its limit and more may follow.
+    def __init__(self, errors, stopped=False):
+        self.errors = sorted(errors, key=lambda error: error.pos_start.index)
+        self.stopped = stopped
+
+    def __len__(self):
+        return len(self.errors)
+
+    def __iter__(self):
+        return iter(self.errors)
+
+    def as_string(self):
+        result = '\n\n'.join(error.as_string() for error in self.errors)
+        count = len(self.errors)
+        result += f"\n\n{count} error{'' if count == 1 else 's'}"
+        if self.stopped: result += ', stopped at the limit'
+        return result
@@ -0,0 +1,320 @@
+from array import array
+from bisect import bisect_left
+from position import *
+from lexer import *
+from ourjs_parser import *
+from bytecode import get_children
+
+##################################################
+# TRACKING PARSER
+##################################################
+
+class TrackingParser(Parser):
+    # A Parser that starts at any token and remembers the furthest token it
+    # has looked at, which is everything a statement's parse depended on
+    def __init__(self, tokens, index=0):
+        self.furthest = 0
+        super().__init__(tokens)
+        if index:
+            self.token_index = index - 1
+            self.advance()
+
+    def update_current_token(self):
+        if self.token_index > self.furthest: self.furthest = self.token_index
+        super().update_current_token()
+
+##################################################
+# SHIFTED ARRAY
+##################################################
+
+class ShiftedArray:
+    # Offsets or indices where every value from shift_from on is stored
+    # shift below its real value. An edit adds to all values after it, and
+    # only the values between the previous edit and this one are rewritten.
+    def __init__(self, values=()):
+        self.values = array('i', values)
+        self.shift_from = len(self.values)
+        self.shift = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if index < 0: index += len(self.values)
+        if index >= self.shift_from: return self.values[index] + self.shift
+        return self.values[index]
+
+    def bisect_left(self, value, lo=0):
+        # For sorted values
+        values, shift_from = self.values, self.shift_from
+        if lo < shift_from:
+            index = bisect_left(values, value, lo, shift_from)
+            if index < shift_from: return index
+            lo = shift_from
+        return bisect_left(values, value - self.shift, lo)
+
+    def move_shift(self, index):
+        # Makes index the first value stored shifted
+        values, shift_from, shift = self.values, self.shift_from, self.shift
+        if index < shift_from:
+            values[index:shift_from] = array('i', [value - shift for value in values[index:shift_from]])
+        elif index > shift_from:
+            values[shift_from:index] = array('i', [value + shift for value in values[shift_from:index]])
+        self.shift_from = index
+
+    def splice(self, start, end, values, delta):
+        # Replaces the values from start up to end with values and adds delta
+        # to the ones after
+        self.move_shift(end)
+        self.values[start:end] = array('i', values)
+        self.shift_from = start + len(values)
+        self.shift += delta
+
+##################################################
+# DOCUMENT
+##################################################
+
+def shift_node(node, delta):
+    # Moves a parsed statement and its tokens delta characters along
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        node.start += delta
+        node.end += delta
+        for name in ('token', 'var_name_token', 'op_token'):
+            token = getattr(node, name, None)
+            if token is not None:
+                token.start += delta
+                token.end += delta
+        for token in getattr(node, 'arg_name_tokens', ()):
+            token.start += delta
+            token.end += delta
+        pending.extend(get_children(node))
+
+class Document:
+    # An editable source kept lexed and parsed. edit() re-lexes from the
+    # first token the edit touches until the new tokens line up with the old
+    # ones again at a newline, and re-parses top level statements from the
+    # first one whose parse looked at a changed token until the parse reaches
+    # the start of an old statement in the unchanged tokens. Statements
+    # before are kept as they are and statements after are reused; their
+    # nodes are only moved to the new offsets when get_ast() asks for the
+    # tree. The result is always the one Parser.parse gives for the whole
+    # text.
+    #
+    # Parser.parse stops at the first statement it cannot parse. The old
+    # statements after it are kept as a cached run, so that the edit fixing
+    # the error can pick them up again instead of parsing to the end.
+    #
+    # After a lexing error the tokens are incomplete, so the next edit lexes
+    # and parses the whole text again.
+    def __init__(self, file_name, text, lexer_engine='regex'):
+        self.source = SourceFile(file_name, text)
+        self.lexer_engine = lexer_engine
+        self.tokens = None
+        self.error = None
+        self.parse_all()
+
+    def make_lexer(self):
+        lexer = LEXERS[self.lexer_engine](self.source.file_name, self.source.text)
+        lexer.source = self.source
+        return lexer
+
+    def parse_all(self):
+        # The first chain_length statements are the parse of the text, the
+        # rest the cached run. Parallel to them: the token each starts at,
+        # the token the parser stood on after it, the furthest token read so
+        # far (never decreasing) and how far its nodes still have to move.
+        self.statements = []
+        self.chain_length = 0
+        self.statement_starts = ShiftedArray()
+        self.statement_stops = ShiftedArray()
+        self.statement_reads = ShiftedArray()
+        self.statement_shifts = ShiftedArray()
+        # How the statements and the cached run ended: (token index, error,
+        # whether every statement parsed)
+        self.end = (0, None, True)
+        self.cached_end = (0, None, True)
+
+        tokens, error = self.make_lexer().make_tokens()
+        if error:
+            self.tokens = None
+            self.error = error
+            return error
+        tokens.starts = ShiftedArray(tokens.starts)
+        tokens.ends = ShiftedArray(tokens.ends)
+        self.tokens = tokens
+
+        parsed = self.parse_statements(0, True, 0)
+        self.splice_statements(0, 0, parsed, 0, 0)
+        self.chain_length = len(self.statements)
+        self.error = self.end[1]
+        return self.error
+
+    def edit(self, offset, removed_length, inserted_text):
+        # Replaces removed_length characters at offset with inserted_text and
+        # returns the lexing or syntax error of the new text, if any
+        source = self.source
+        source.replace(offset, removed_length, inserted_text)
+        if self.tokens is None: return self.parse_all()
+
+        delta = len(inserted_text) - removed_length
+        tokens = self.tokens
+        newline_code = TOKEN_CODES[TOKEN_NEWLINE]
+
+        # Tokens ending at the edit may merge with what is inserted
+        first = tokens.ends.bisect_left(offset)
+        lexer_start = min(tokens.starts[first], offset)
+        edit_end = offset + len(inserted_text)
+
+        relexed = TokenStream(source)
+        resume = None
+        lexer = self.make_lexer()
+        for _ in lexer.lex(relexed, True, lexer_start):
+            # Past the edit, the text after a newline that was also a
+            # newline token before lexes the same as before
+            newline_start = relexed.starts[-1]
+            if newline_start < edit_end: continue
+            old_index = tokens.starts.bisect_left(newline_start - delta, first)
+            if old_index < len(tokens) and tokens.starts[old_index] == newline_start - delta and tokens.types[old_index] == newline_code:
+                resume = old_index + 1
+                break
+        if lexer.error:
+            self.tokens = None
+            self.error = lexer.error
+            return self.error
+
+        # Splice the new tokens over the old ones
+        replaced_end = len(tokens) if resume is None else resume
+        tokens.types[first:replaced_end] = relexed.types
+        tokens.values[first:replaced_end] = relexed.values
+        tokens.starts.splice(first, replaced_end, relexed.starts, delta)
+        tokens.ends.splice(first, replaced_end, relexed.ends, delta)
+        unchanged = first + len(relexed)
+        token_delta = unchanged - replaced_end
+
+        # Statements whose parse only read tokens before the first changed one stay
+        chain_length = self.chain_length
+        statement_count = len(self.statements)
+        kept = min(self.statement_reads.bisect_left(first), chain_length)
+
+        def resync(index, furthest):
+            # The old statement starting at index, once the tokens are the old ones
+            if resume is None or index < unchanged: return None
+            old_index = index - token_delta
+            position = self.statement_starts.bisect_left(old_index, kept)
+            if position < statement_count and self.statement_starts[position] == old_index and self.statement_reads[position] + token_delta >= furthest:
+                return position
+            return None
+
+        end, cached_end = self.end, self.cached_end
+        index = self.statement_stops[kept - 1] if kept else 0
+        furthest = self.statement_reads[kept - 1] if kept else 0
+        parsed = self.parse_statements(index, kept == 0, furthest, resync)
+        reused = parsed[-1]
+        new_count = len(parsed[0])
+
+        if reused is not None and reused < chain_length:
+            # Back on the old statements; their end and the cached run stay
+            self.splice_statements(kept, reused, parsed, token_delta, delta)
+            self.chain_length = chain_length + kept + new_count - reused
+            self.end = self.shift_end(end, token_delta, delta)
+            self.cached_end = self.shift_end(cached_end, token_delta, delta)
+        elif reused is not None:
+            # The cached run continues the statements to its end
+            self.splice_statements(kept, reused, parsed, token_delta, delta)
+            self.chain_length = len(self.statements)
+            self.end = self.shift_end(cached_end, token_delta, delta)
+        else:
+            # Stopped at an error or the end. Old statements past the edit
+            # and past where parsing stopped are cached, either the rest of
+            # the old statements or else the rest of the old cached run.
+            threshold = max(replaced_end, self.end[0] - token_delta)
+            run_start = self.statement_starts.bisect_left(threshold, kept)
+            if run_start < chain_length:
+                self.splice_statements(chain_length, statement_count, ([], [], [], [], None), 0, 0)
+                statement_count = chain_length
+                cached_end = end
+            if run_start < statement_count:
+                self.splice_statements(kept, run_start, parsed, token_delta, delta)
+                self.cached_end = self.shift_end(cached_end, token_delta, delta)
+            else:
+                self.splice_statements(kept, statement_count, parsed, 0, 0)
+            self.chain_length = kept + new_count
+
+        self.error = self.end[1]
+        return self.error
+
+    def shift_end(self, end, token_delta, delta):
+        index, error, complete = end
+        if error:
+            error.pos_start = self.source.get_position(error.pos_start.index + delta)
+            error.pos_end = self.source.get_end_position(error.pos_end.index + delta)
+        return index + token_delta, error, complete
+
+    def parse_statements(self, index, first, furthest, resync=None):
+        # Parses top level statements from the token at index the way
+        # Parser.statements and Parser.parse do. Returns the new statements,
+        # their starts, stops and reads and, when resync finds an old
+        # statement to continue with, its number.
+        parser = TrackingParser(self.tokens, index)
+        nodes, starts, stops, reads = [], [], [], []
+
+        while True:
+            if not first and parser.current_type != TOKEN_NEWLINE: break
+            while parser.current_type == TOKEN_NEWLINE: parser.advance()
+            if not first and not parser.starts_expression(): break
+
+            if resync is not None:
+                reused = resync(parser.token_index, furthest)
+                if reused is not None: return nodes, starts, stops, reads, reused
+
+            start = parser.token_index
+            parser.furthest = start
+            res = parser.expression()
+            if res.error:
+                self.end = (parser.current_index, res.error, False)
+                return nodes, starts, stops, reads, None
+
+            furthest = max(furthest, parser.furthest)
+            nodes.append(res.node)
+            starts.append(start)
+            stops.append(parser.token_index)
+            reads.append(furthest)
+            first = False
+
+        error = None
+        if parser.current_type != TOKEN_EOF:
+            error = InvalidSyntaxError(
+                parser.current_token.pos_start, parser.current_token.pos_end,
+                "Expected '+' , '-', '*' or '/'"
+            )
+        self.end = (parser.current_index, error, True)
+        return nodes, starts, stops, reads, None
+
+    def splice_statements(self, start, end, parsed, token_delta, delta):
+        # Replaces statements start up to end with the parsed ones and moves
+        # the ones after token_delta tokens and delta characters along
+        nodes, starts, stops, reads, _ = parsed
+        self.statements[start:end] = nodes
+        self.statement_starts.splice(start, end, starts, token_delta)
+        self.statement_stops.splice(start, end, stops, token_delta)
+        self.statement_reads.splice(start, end, reads, token_delta)
+        self.statement_shifts.splice(start, end, [0] * len(nodes), delta)
+
+    def get_ast(self):
+        # Returns (ast, error) like main.parse_source, first moving reused
+        # statements to their current offsets
+        if self.tokens is None: return None, self.error
+
+        shifts = self.statement_shifts
+        for index in range(self.chain_length):
+            if shifts[index]: shift_node(self.statements[index], shifts[index])
+        shifts.splice(0, self.chain_length, [0] * self.chain_length, 0)
+
+        res = ParseResult()
+        end_index, _, complete = self.end
+        if complete:
+            res.node = ListNode(self.statements[:self.chain_length], self.tokens.get_start(0), self.tokens.get_end(end_index), self.source)
+        res.error = self.error
+        return res, res.error
@@ -0,0 +1,141 @@
+import cProfile, io, pstats, time
+from bytecode import get_children
+from ir import make_writer
+
+##################################################
+# STAGES
+##################################################
+
+# What main.run reports; a stage may be reported more than once
+STAGE_LEX = 'lex'
+STAGE_PARSE = 'parse'       # streamed, this includes lexing
+STAGE_FOLD = 'fold'
+STAGE_GENERATE = 'ic'
+STAGE_OPTIMIZE = 'optimize'
+STAGE_WRITE = 'write'       # formatting the text emitted; streamed IC is written while generating
+STAGE_LOAD = 'load'         # reading a compile cache entry
+STAGE_STORE = 'store'       # writing one
+
+PROFILE_STAGES = (STAGE_LEX, STAGE_PARSE, STAGE_FOLD, STAGE_GENERATE, STAGE_OPTIMIZE, STAGE_WRITE, STAGE_LOAD, STAGE_STORE)
+
+##################################################
+# OBSERVERS
+##################################################
+
+class Observer:
+    # Told about every stage main.run goes through. counts maps what the
+    # stage handled (characters, tokens, nodes, instructions, temporaries)
+    # to how many of them, when known.
+    def stage_started(self, stage):
+        pass
+
+    def stage_finished(self, stage, seconds, counts):
+        pass
+
+class StageReport(Observer):
+    # Keeps the stages in the order they ran for a per-stage breakdown
+    def __init__(self):
+        self.stages = []
+
+    def stage_finished(self, stage, seconds, counts):
+        self.stages.append((stage, seconds, counts))
+
+    def total(self):
+        return sum(seconds for _, seconds, _ in self.stages)
+
+    def seconds(self):
+        # Stage -> seconds, adding up the stages that ran more than once
+        times = {}
+        for stage, seconds, _ in self.stages: times[stage] = times.get(stage, 0.0) + seconds
+        return times
+
+    def as_string(self):
+        total = self.total() or 1e-9
+        lines = []
+        for stage, seconds, counts in self.stages:
+            details = ', '.join(f'{name} {count}' for name, count in counts.items())
+            lines.append(f'{stage:>9}: {seconds * 1000:10.3f}ms {seconds / total:6.1%}  {details}'.rstrip())
+        lines.append(f'{"total":>9}: {self.total() * 1000:10.3f}ms')
+        return '\n'.join(lines)
+
+class StageCounts(Observer):
+    # Keeps the counts of the last run of every stage
+    def __init__(self):
+        self.counts = {}
+
+    def stage_finished(self, stage, seconds, counts):
+        self.counts[stage] = counts
+
+##################################################
+# INSTRUMENTATION
+##################################################
+
+class Instrumentation:
+    # Passed to main.run to time its stages for observers and to profile
+    # profile_stage with cProfile; profile holds the result afterwards.
+    # get_counts is only called, after the clock has stopped, when
+    # instrumenting with counting set, so counting costs nothing otherwise.
+    enabled = True
+
+    def __init__(self, observers=(), profile_stage=None, counting=True):
+        self.observers = list(observers)
+        self.profile_stage = profile_stage
+        self.counting = counting
+        self.profile = None
+        self.start_times = {}
+
+    def start(self, stage):
+        for observer in self.observers: observer.stage_started(stage)
+        if stage == self.profile_stage:
+            if self.profile is None: self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.start_times[stage] = time.perf_counter()
+
+    def finish(self, stage, get_counts=None):
+        seconds = time.perf_counter() - self.start_times.pop(stage)
+        if stage == self.profile_stage: self.profile.disable()
+        counts = get_counts() if get_counts and self.counting else {}
+        for observer in self.observers: observer.stage_finished(stage, seconds, counts)
+
+    def profile_stats(self, limit=25, sort='cumulative'):
+        if self.profile is None: return f'Stage {self.profile_stage} did not run'
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+class NoInstrumentation:
+    # What main.run uses by default: every call does nothing
+    enabled = False
+
+    def start(self, stage):
+        pass
+
+    def finish(self, stage, get_counts=None):
+        pass
+
+NO_INSTRUMENTATION = NoInstrumentation()
+
+##################################################
+# COUNTING
+##################################################
+
+def count_nodes(root):
+    if root is None: return 0
+    count = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(child for child in get_children(node) if child is not None)
+    return count
+
+class LineCounter:
+    # A sink passing lines on to sink and counting them, for IC that is
+    # written while it is generated
+    def __init__(self, sink):
+        self.write_line = make_writer(sink)
+        self.count = 0
+
+    def write(self, line):
+        self.count += 1
+        self.write_line(line)
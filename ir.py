@@ -0,0 +1,144 @@
+from array import array
+from constants import *
+
+##################################################
+# INSTRUCTION
+##################################################
+
+# Three-address code. Temporaries and labels are ints, variable and
+# function names are strs.
+#   const      dest = arg1 (a number or a string value)
+#   load       dest = variable arg1
+#   store      variable dest = arg1
+#   operators  dest = arg1 op arg2 (arg2 is unused by unary operators)
+#   label      arg1 is the label number
+#   func       arg1 is the function name
+#   goto       arg1 is the target label
+#   iffalse    jump to label arg2 when arg1 is false
+#   call       function arg1 with the tuple of argument temporaries arg2
+#   ret
+
+class Instruction:
+    __slots__ = ('opcode', 'dest', 'arg1', 'arg2')
+
+    def __init__(self, opcode, dest=None, arg1=None, arg2=None):
+        self.opcode = opcode
+        self.dest = dest
+        self.arg1 = arg1
+        self.arg2 = arg2
+
+    def __repr__(self):
+        return format_instruction(self.opcode, self.dest, self.arg1, self.arg2).rstrip('\n')
+
+
+class InstructionList:
+    # Instructions are stored column by column, like TokenStream, so a large
+    # program does not hold one object per instruction
+    def __init__(self):
+        self.opcodes = array('B')
+        self.dests = []
+        self.args1 = []
+        self.args2 = []
+
+    def add(self, opcode, dest=None, arg1=None, arg2=None):
+        self.opcodes.append(IR_CODES[opcode])
+        self.dests.append(dest)
+        self.args1.append(arg1)
+        self.args2.append(arg2)
+
+    def append(self, instruction):
+        self.add(instruction.opcode, instruction.dest, instruction.arg1, instruction.arg2)
+
+    def get_opcode(self, index):
+        return IR_OPCODES[self.opcodes[index]]
+
+    def get_dest(self, index):
+        return self.dests[index]
+
+    def get_arg1(self, index):
+        return self.args1[index]
+
+    def get_arg2(self, index):
+        return self.args2[index]
+
+    def fields(self):
+        # (opcode, dest, arg1, arg2) for every instruction, without views
+        return zip(map(IR_OPCODES.__getitem__, self.opcodes), self.dests, self.args1, self.args2)
+
+    def instruction(self, index):
+        return Instruction(IR_OPCODES[self.opcodes[index]], self.dests[index], self.args1[index], self.args2[index])
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __getitem__(self, index):
+        if index < 0: index += len(self.opcodes)
+        return self.instruction(index)
+
+    def __iter__(self):
+        for index in range(len(self.opcodes)):
+            yield self.instruction(index)
+
+    def __repr__(self):
+        return repr(list(self))
+
+def get_temp_uses(opcode, arg1, arg2):
+    # Temporaries an instruction reads
+    if opcode in IR_BINARY_OPS: return (arg1, arg2)
+    elif opcode in IR_UNARY_OPS or opcode == IR_STORE or opcode == IR_IF_FALSE: return (arg1,)
+    elif opcode == IR_CALL: return arg2
+    return ()
+
+def get_temp_def(opcode, dest):
+    # The temporary an instruction writes, or None
+    if opcode in IR_BINARY_OPS or opcode in IR_UNARY_OPS or opcode == IR_CONST or opcode == IR_LOAD: return dest
+    return None
+
+##################################################
+# PRINTER
+##################################################
+
+def format_instruction(opcode, dest=None, arg1=None, arg2=None):
+    if opcode in IR_BINARY_OPS:
+        return f't{dest} = t{arg1} {opcode} t{arg2}\n'
+    elif opcode == IR_LOAD:
+        return f't{dest} = {arg1}\n'
+    elif opcode == IR_CONST:
+        if isinstance(arg1, str): return f't{dest} = "{arg1}"\n'
+        return f't{dest} = {arg1}\n'
+    elif opcode == IR_STORE:
+        return f'{dest} = t{arg1}\n'
+    elif opcode == IR_NOT:
+        return f't{dest} = !t{arg1}\n'
+    elif opcode == IR_NEG:
+        return f't{dest} = uminus t{arg1}\n'
+    elif opcode == IR_LABEL:
+        return f'L{arg1}:\n'
+    elif opcode == IR_IF_FALSE:
+        return f'if !t{arg1} goto L{arg2}\n'
+    elif opcode == IR_GOTO:
+        return f'goto L{arg1}\n'
+    elif opcode == IR_CALL:
+        args = ', '.join(f't{temp}' for temp in arg2)
+        return f'call {arg1} {args}\n'
+    elif opcode == IR_FUNC:
+        return f'{arg1}:\n'
+    elif opcode == IR_RET:
+        return 'ret\n'
+
+    raise ValueError(f'Unknown opcode {opcode!r}')
+
+def format_instructions(instructions):
+    return ''.join([format_instruction(*fields) for fields in instructions.fields()])
+
+def make_writer(sink):
+    # A text sink is a list, anything with a write method such as a file or
+    # sys.stdout, or a callable taking each line
+    if isinstance(sink, list): return sink.append
+    if hasattr(sink, 'write'): return sink.write
+    return sink
+
+def write_instructions(instructions, sink):
+    write = make_writer(sink)
+    for fields in instructions.fields():
+        write(format_instruction(*fields))
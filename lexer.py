@@ -1,3 +1,6 @@
+import os, re, sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from position import *
 from constants import *
 from error import *
@@ -7,16 +10,22 @@ from error import *
 ##################################################
 
 class Token:
-    def __init__(self, type_, value=None, pos_start=None, pos_end=None):
+    __slots__ = ('type', 'value', 'start', 'end', 'source')
+
+    def __init__(self, type_, value=None, start=None, end=None, source=None):
         self.type = type_
         self.value = value
-        if pos_start:
-            self.pos_start = pos_start.copy()
-            self.pos_end = pos_start.copy()
-            self.pos_end.advance()
-        
-        if pos_end:
-            self.pos_end = pos_end
+        self.start = start
+        self.end = start + 1 if end is None and start is not None else end
+        self.source = source
+
+    @property
+    def pos_start(self):
+        return self.source.get_position(self.start)
+
+    @property
+    def pos_end(self):
+        return self.source.get_end_position(self.end)
     
     def matches(self, type_, value):
         return self.type == type_ and self.value == value
@@ -26,30 +35,185 @@ class Token:
         return self.type
 
 
+##################################################
+# TOKEN STREAM
+##################################################
+
+class TokenStream:
+    def __init__(self, source):
+        self.source = source
+        self.types = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.values = []
+
+    def add(self, type_, value, start, end):
+        self.types.append(TOKEN_CODES[type_])
+        self.values.append(value)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def append(self, token):
+        self.add(token.type, token.value, token.start, token.end)
+
+    def get_type(self, index):
+        if index < len(self.types): return TOKEN_TYPES[self.types[index]]
+        return None
+
+    def get_value(self, index):
+        return self.values[index]
+
+    def get_start(self, index):
+        return self.starts[index]
+
+    def get_end(self, index):
+        return self.ends[index]
+
+    def release(self, index):
+        # A complete stream keeps every token; see TokenBuffer
+        pass
+
+    def token(self, index):
+        return Token(TOKEN_TYPES[self.types[index]], self.values[index], self.starts[index], self.ends[index], self.source)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        if index < 0: index += len(self.types)
+        return self.token(index)
+
+    def __iter__(self):
+        for index in range(len(self.types)):
+            yield self.token(index)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class TokenBuffer(TokenStream):
+    # Pulls tokens from a lexer a line at a time and keeps only the ones of
+    # the top level statement being parsed, as the parser never goes back.
+    # Indices stay absolute; base is the index of the oldest token still held.
+    def __init__(self, lexer):
+        super().__init__(lexer.source)
+        self.lexer = lexer
+        self.base = 0
+        self.pending = lexer.lex(self, True)
+        self.done = False
+
+    def fill(self):
+        if self.done: return False
+        for _ in self.pending:
+            return True
+
+        self.done = True
+        if self.lexer.error:
+            # Stop the parser where the lexer stopped; the error wins afterwards
+            index = self.lexer.error.pos_start.index
+            self.add(TOKEN_EOF, None, index, index + 1)
+        return True
+
+    def release(self, index):
+        count = index - self.base
+        if count < 1024 or count < len(self.types) // 2: return
+        del self.types[:count]
+        del self.starts[:count]
+        del self.ends[:count]
+        del self.values[:count]
+        self.base = index
+
+    def finish(self):
+        # Lex whatever the parser left behind so a later lexing error is still reported
+        while self.fill():
+            self.release(self.base + len(self.types))
+        return self.lexer.error
+
+    def get_type(self, index):
+        index -= self.base
+        while index >= len(self.types):
+            if not self.fill(): return None
+        return TOKEN_TYPES[self.types[index]]
+
+    def get_value(self, index):
+        return self.values[index - self.base]
+
+    def get_start(self, index):
+        return self.starts[index - self.base]
+
+    def get_end(self, index):
+        return self.ends[index - self.base]
+
+    def token(self, index):
+        return super().token(index - self.base)
+
+    def __len__(self):
+        return self.base + len(self.types)
+
+
 ##################################################
 # LEXER
 ##################################################
 
 class Lexer:
     def __init__(self, file_name, text):
+        # Walks characters, so a byte buffer is decoded up front
+        if not isinstance(text, str): text = bytes(text).decode('utf-8')
         self.text = text
-        self.pos = Position(-1, 0, -1, file_name, text)
+        self.source = SourceFile(file_name, text)
+        self.errors = None
+        self.max_errors = None
+        self.index = -1
         self.current_char = None
         self.advance()
       
     def advance(self):
-        self.pos.advance(self.current_char)
-        self.current_char = self.text[self.pos.index] if self.pos.index < len(self.text) else None
+        self.index += 1
+        self.current_char = self.text[self.index] if self.index < len(self.text) else None
+
+    def make_tokens(self, recover=False, max_errors=None):
+        # Returns (tokens, error), or when recovering (tokens, errors) where
+        # errors lists every error the lexer skipped
+        tokens = TokenStream(self.source)
+        if recover: self.collect_errors(max_errors)
+        for _ in self.lex(tokens): pass
+
+        if recover: return tokens, self.errors
+        if self.error: return [], self.error
+        return tokens, None
+
+    def collect_errors(self, max_errors=None):
+        # Makes lex record errors in self.errors and go on past them, until
+        # max_errors have been recorded
+        self.errors = []
+        self.max_errors = max_errors
 
-    def make_tokens(self):
-        tokens = []
+    def recover(self, error):
+        # Returns whether lexing goes on after error. It resumes right after
+        # the offending character, as the regex lexer does.
+        if self.errors is None:
+            self.error = error
+            return False
+        self.errors.append(error)
+        self.index = error.pos_start.index
+        self.advance()
+        return self.max_errors is None or len(self.errors) < self.max_errors
+
+    def lex(self, tokens, yield_lines=False, start=0):
+        # Appends into tokens, pausing after every newline when yield_lines is
+        # set. start must be the offset of a token or of whitespace.
+        self.error = None
+        if start:
+            self.index = start - 1
+            self.advance()
 
         while self.current_char != None:
             if self.current_char in ' \t':
                 self.advance()
             elif self.current_char in ';\n':
-                tokens.append(Token(TOKEN_NEWLINE, pos_start=self.pos))
+                tokens.append(Token(TOKEN_NEWLINE, start=self.index, source=self.source))
                 self.advance()
+                if yield_lines: yield
             elif self.current_char in DIGITS:
                 tokens.append(self.make_number())
             elif self.current_char in LETTERS:
@@ -57,43 +221,49 @@ class Lexer:
             elif self.current_char == '"':
                 tokens.append(self.make_string())
             elif self.current_char == '+':
-                tokens.append(Token(TOKEN_PLUS, pos_start=self.pos))
+                tokens.append(Token(TOKEN_PLUS, start=self.index, source=self.source))
                 self.advance()
             elif self.current_char == '-':
-                tokens.append(Token(TOKEN_MINUS,pos_start=self.pos))
+                tokens.append(Token(TOKEN_MINUS,start=self.index, source=self.source))
                 self.advance()
             elif self.current_char == '*':
-                tokens.append(Token(TOKEN_MUL, pos_start=self.pos))
+                tokens.append(Token(TOKEN_MUL, start=self.index, source=self.source))
                 self.advance()
             elif self.current_char == '/':
-                tokens.append(Token(TOKEN_DIV, pos_start=self.pos))
+                tokens.append(Token(TOKEN_DIV, start=self.index, source=self.source))
                 self.advance()
             elif self.current_char == '(':
-                tokens.append(Token(TOKEN_LPAREN, pos_start=self.pos))
+                tokens.append(Token(TOKEN_LPAREN, start=self.index, source=self.source))
                 self.advance()
             elif self.current_char == ')':
-                tokens.append(Token(TOKEN_RPAREN, pos_start=self.pos))
+                tokens.append(Token(TOKEN_RPAREN, start=self.index, source=self.source))
                 self.advance()
             elif self.current_char == '{':
-                tokens.append(Token(TOKEN_LCURL, pos_start=self.pos))
+                tokens.append(Token(TOKEN_LCURL, start=self.index, source=self.source))
                 self.advance()
             elif self.current_char == '}':
-                tokens.append(Token(TOKEN_RCURL, pos_start=self.pos))
+                tokens.append(Token(TOKEN_RCURL, start=self.index, source=self.source))
                 self.advance()                
             elif self.current_char == ',':
-                tokens.append(Token(TOKEN_COMMA, pos_start=self.pos))
+                tokens.append(Token(TOKEN_COMMA, start=self.index, source=self.source))
                 self.advance()
             elif self.current_char == '!':
                 token, error = self.make_not_equals()
-                if error: return [], error
+                if error:
+                    if self.recover(error): continue
+                    break
                 tokens.append(token)
             elif self.current_char == '&':
                 token, error = self.make_and()
-                if error: return [], error
+                if error:
+                    if self.recover(error): continue
+                    break
                 tokens.append(token)
             elif self.current_char == '|':
                 token, error = self.make_or()
-                if error: return [], error
+                if error:
+                    if self.recover(error): continue
+                    break
                 tokens.append(token)
             elif self.current_char == '=':
                 tokens.append(self.make_equals())
@@ -102,18 +272,19 @@ class Lexer:
             elif self.current_char == '>':
                 tokens.append(self.make_greater_than())
             else:
-                pos_start = self.pos.copy()
+                start = self.index
                 char = self.current_char
                 self.advance()
-                return[], IllegalCharError(pos_start, self.pos, "'" + char + "'")
-            
-        tokens.append(Token(TOKEN_EOF, pos_start=self.pos))
-        return tokens, None
+                if self.recover(IllegalCharError(self.source.get_position(start), self.source.get_position(self.index), "'" + char + "'")): continue
+                break
+
+        if self.error: return
+        tokens.append(Token(TOKEN_EOF, start=self.index, source=self.source))
 
     def make_number(self):
         num_str = ''
         dot_count = 0
-        post_start = self.pos.copy()
+        start = self.index
 
         while self.current_char != None and self.current_char in DIGITS + '.':
             if self.current_char == '.':
@@ -125,13 +296,13 @@ class Lexer:
             self.advance()
 
         if dot_count == 0:
-            return Token(TOKEN_INT, int(num_str), post_start, self.pos)
+            return Token(TOKEN_INT, int(num_str), start, self.index, self.source)
         else:
-            return Token(TOKEN_FLOAT, float(num_str), post_start, self.pos)
+            return Token(TOKEN_FLOAT, float(num_str), start, self.index, self.source)
         
     def make_string(self):
         string = ''
-        pos_start = self.pos.copy()
+        start = self.index
         escape_character = False
         self.advance()
 
@@ -152,91 +323,321 @@ class Lexer:
             escape_character = False
 
         self.advance()
-        return Token(TOKEN_STRING, string, pos_start, self.pos)
+        return Token(TOKEN_STRING, string, start, self.index, self.source)
     
     def make_identifier(self):
         id_str = ''
-        pos_start = self.pos.copy()
+        start = self.index
 
         while self.current_char != None and self.current_char in LETTERS_DIGITS + '_':
             id_str += self.current_char
             self.advance()
 
         token_type = TOKEN_KEYWORD if id_str in KEYWORDS else TOKEN_IDENTIFIER
-        return Token(token_type, id_str, pos_start, self.pos)
+        return Token(token_type, id_str, start, self.index, self.source)
 
     def make_or(self):
-        pos_start = self.pos.copy()
+        start = self.index
         self.advance()
 
         if self.current_char == '|':
             self.advance()
-            return Token(TOKEN_OR, pos_start=pos_start, pos_end=self.pos), None
+            return Token(TOKEN_OR, start=start, end=self.index, source=self.source), None
 
         self.advance()
-        return None, ExpectedCharError(pos_start, self.pos, "'|' (after '|')")
+        return None, ExpectedCharError(self.source.get_position(start), self.source.get_position(self.index), "'|' (after '|')")
     
     def make_and(self):
-        pos_start = self.pos.copy()
+        start = self.index
         self.advance()
 
         if self.current_char == '&':
             self.advance()
-            return Token(TOKEN_AND, pos_start=pos_start, pos_end=self.pos), None
+            return Token(TOKEN_AND, start=start, end=self.index, source=self.source), None
 
         self.advance()
-        return None, ExpectedCharError(pos_start, self.pos, "'&' (after '&')")
+        return None, ExpectedCharError(self.source.get_position(start), self.source.get_position(self.index), "'&' (after '&')")
 
     def make_not_equals(self):
-        pos_start = self.pos.copy()
+        start = self.index
         self.advance()
 
         if self.current_char == '=':
             self.advance()
-            return Token(TOKEN_NE, pos_start=pos_start, pos_end=self.pos), None
+            return Token(TOKEN_NE, start=start, end=self.index, source=self.source), None
 
-        return Token(TOKEN_NOT, pos_start=pos_start, pos_end=self.pos), None
+        return Token(TOKEN_NOT, start=start, end=self.index, source=self.source), None
         
     def make_equals(self):
         token_type = TOKEN_EQ
-        pos_start = self.pos.copy()
+        start = self.index
         self.advance()
 
         if self.current_char == '=':
             self.advance()
             token_type = TOKEN_EE
 
-        return Token(token_type, pos_start=pos_start, pos_end=self.pos)
+        return Token(token_type, start=start, end=self.index, source=self.source)
     
     def make_less_than(self):
         token_type = TOKEN_EQ
-        pos_start = self.pos.copy()
+        start = self.index
         self.advance()
 
         if self.current_char == '=':
             self.advance()
             token_type = TOKEN_EE
 
-        return Token(token_type, pos_start=pos_start, pos_end=self.pos)
+        return Token(token_type, start=start, end=self.index, source=self.source)
     
     def make_less_than(self):
         token_type = TOKEN_LT
-        pos_start = self.pos.copy()
+        start = self.index
         self.advance()
 
         if self.current_char == '=':
             self.advance()
             token_type = TOKEN_LTE
 
-        return Token(token_type, pos_start=pos_start, pos_end=self.pos)
+        return Token(token_type, start=start, end=self.index, source=self.source)
     
     def make_greater_than(self):
         token_type = TOKEN_GT
-        pos_start = self.pos.copy()
+        start = self.index
         self.advance()
 
         if self.current_char == '=':
             self.advance()
             token_type = TOKEN_GTE
 
-        return Token(token_type, pos_start=pos_start, pos_end=self.pos)
+        return Token(token_type, start=start, end=self.index, source=self.source)
+
+
+##################################################
+# REGEX LEXER
+##################################################
+
+TOKEN_PATTERN = (
+    f'(?P<WHITESPACE>[{re.escape(WHITESPACE)}]+)'
+    f'|(?P<NUMBER>[{DIGITS}]+(?:\\.[{DIGITS}]*)?)'
+    f'|(?P<IDENTIFIER>[{LETTERS}][{LETTERS_DIGITS}_]*)'
+    '|(?P<STRING>"[^"]*"?)'
+    f'|(?P<SYMBOL>{"|".join(re.escape(symbol) for symbol in SYMBOLS)})'
+    '|(?P<EXPECTED>[&|])'
+)
+
+MASTER_PATTERN = re.compile(TOKEN_PATTERN + '|(?P<ILLEGAL>.)', re.DOTALL)
+
+# Over UTF-8 bytes an illegal character may span several bytes
+BYTES_MASTER_PATTERN = re.compile((TOKEN_PATTERN + '|(?P<ILLEGAL>[\\xc0-\\xff][\\x80-\\xbf]*|.)').encode(), re.DOTALL)
+
+class RegexLexer:
+    # Lexes a str, or a bytes-like buffer of UTF-8 such as an mmap. Buffers are
+    # scanned in place and only identifiers, literals and error text are decoded.
+    def __init__(self, file_name, text):
+        self.text = text
+        self.source = SourceFile(file_name, text)
+        self.errors = None
+        self.max_errors = None
+
+    def make_tokens(self, recover=False, max_errors=None):
+        # See Lexer.make_tokens
+        tokens = TokenStream(self.source)
+        if recover: self.collect_errors(max_errors)
+        for _ in self.lex(tokens): pass
+
+        if recover: return tokens, self.errors
+        if self.error: return [], self.error
+        return tokens, None
+
+    def collect_errors(self, max_errors=None):
+        self.errors = []
+        self.max_errors = max_errors
+
+    def recover(self, error):
+        # Returns whether lexing goes on after error
+        if self.errors is None:
+            self.error = error
+            return False
+        self.errors.append(error)
+        return self.max_errors is None or len(self.errors) < self.max_errors
+
+    def decode(self, lexeme):
+        if self.source.is_str: return lexeme
+        return lexeme.decode('utf-8')
+
+    def lex(self, tokens, yield_lines=False, start=0):
+        # Appends into tokens, pausing after every newline when yield_lines is
+        # set. start must be the offset of a token or of whitespace.
+        self.error = None
+        text = self.text
+        source = self.source
+        eof_index = len(text)
+
+        if source.is_str:
+            pattern = MASTER_PATTERN
+            quote, backslash, dot = '"', '\\', '.'
+        else:
+            pattern = BYTES_MASTER_PATTERN
+            quote, backslash, dot = b'"', b'\\', b'.'
+        decode = self.decode
+
+        add_type = tokens.types.append
+        add_value = tokens.values.append
+        add_start = tokens.starts.append
+        add_end = tokens.ends.append
+        symbol_codes = {(symbol if source.is_str else symbol.encode()): TOKEN_CODES[token_type] for symbol, token_type in SYMBOLS.items()}
+        newline_code = TOKEN_CODES[TOKEN_NEWLINE]
+        keyword_code = TOKEN_CODES[TOKEN_KEYWORD]
+        identifier_code = TOKEN_CODES[TOKEN_IDENTIFIER]
+        int_code = TOKEN_CODES[TOKEN_INT]
+        float_code = TOKEN_CODES[TOKEN_FLOAT]
+        string_code = TOKEN_CODES[TOKEN_STRING]
+        # Raw identifier lexeme -> (type code, interned name)
+        names = {}
+
+        for match in pattern.finditer(text, start):
+            kind = match.lastgroup
+
+            if kind == 'WHITESPACE':
+                continue
+
+            start = match.start()
+            end = match.end()
+
+            if kind == 'SYMBOL':
+                code = symbol_codes[match.group()]
+                add_type(code)
+                add_value(None)
+                if code == newline_code and yield_lines:
+                    add_start(start)
+                    add_end(end)
+                    yield
+                    continue
+            elif kind == 'IDENTIFIER':
+                lexeme = match.group()
+                name = names.get(lexeme)
+                if name is None:
+                    value = sys.intern(decode(lexeme))
+                    name = names[lexeme] = (keyword_code if value in KEYWORDS else identifier_code, value)
+                add_type(name[0])
+                add_value(name[1])
+            elif kind == 'NUMBER':
+                lexeme = match.group()
+                if dot in lexeme:
+                    add_type(float_code)
+                    add_value(float(lexeme))
+                else:
+                    add_type(int_code)
+                    add_value(int(lexeme))
+            elif kind == 'STRING':
+                lexeme = match.group()
+                if len(lexeme) > 1 and lexeme[-1:] == quote:
+                    body = lexeme[1:-1]
+                else:
+                    # Unterminated strings run to the end of the file and the
+                    # closing advance still steps one past it.
+                    body = lexeme[1:]
+                    end += 1
+                    eof_index = end
+                add_type(string_code)
+                add_value(decode(body.replace(backslash, lexeme[:0])))
+            elif kind == 'EXPECTED':
+                char = decode(match.group())
+                if self.recover(ExpectedCharError(source.get_position(start), source.get_position(start + 2), f"'{char}' (after '{char}')")): continue
+                eof_index = end
+                break
+            else:
+                char = source.get_text(start, end)
+                if self.recover(IllegalCharError(source.get_position(start), source.get_position(end), "'" + char + "'")): continue
+                eof_index = end
+                break
+
+            add_start(start)
+            add_end(end)
+
+        if self.error: return
+        tokens.add(TOKEN_EOF, None, eof_index, eof_index + 1)
+
+
+##################################################
+# PARALLEL LEXER
+##################################################
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+def split_source(text, chunk_size):
+    # Yields (offset, chunk) pieces of text of about chunk_size, each ending
+    # just after a newline. A newline inside a string is not a boundary, so a
+    # piece that would end inside one runs on to the first newline after the
+    # string closes. Every '"' opens or closes a string, as a backslash
+    # escapes nothing, so counting them tells whether a cut is inside one.
+    if isinstance(text, str): quote, newline = '"', '\n'
+    else: quote, newline = b'"', b'\n'
+    start = 0
+    while start < len(text):
+        end = text.find(newline, start + chunk_size) + 1 or len(text)
+        chunk = text[start:end]
+        inside = chunk.count(quote) % 2 == 1
+        while inside and end < len(text):
+            close = text.find(quote, end)
+            end = (text.find(newline, close + 1) + 1 or len(text)) if close >= 0 else len(text)
+            rest = text[len(chunk) + start:end]
+            inside = rest.count(quote) % 2 == 0
+            chunk += rest
+        yield start, chunk
+        start = end
+
+def lex_chunk(task):
+    # Lexes one piece in a worker. Returns its columns with offsets into the
+    # whole text, without the EOF unless it is the last piece, or the first
+    # error as (class, start, end, details) to be rebuilt on the whole text.
+    offset, chunk, last = task
+    tokens, error = RegexLexer('<chunk>', chunk).make_tokens()
+    if error: return None, (type(error), error.pos_start.index + offset, error.pos_end.index + offset, error.details)
+    count = len(tokens) if last else len(tokens) - 1
+    starts = array('I', [start + offset for start in tokens.starts[:count]])
+    ends = array('I', [end + offset for end in tokens.ends[:count]])
+    return (tokens.types[:count], starts, ends, tokens.values[:count]), None
+
+class ParallelLexer(RegexLexer):
+    # Lexes a large text as newline separated pieces in a process pool and
+    # stitches the tokens together, giving exactly what RegexLexer gives,
+    # including which error is reported. Texts smaller than two chunks, a
+    # single worker or a recovering lex stay on RegexLexer; so does lex,
+    # which streaming and incremental parsing use.
+    def __init__(self, file_name, text, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        super().__init__(file_name, text)
+        self.workers = workers or (len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+
+    def make_tokens(self, recover=False, max_errors=None):
+        if recover or self.workers < 2 or len(self.text) < 2 * self.chunk_size:
+            return super().make_tokens(recover, max_errors)
+
+        pieces = list(split_source(self.text, self.chunk_size))
+        tasks = [(offset, chunk, index == len(pieces) - 1) for index, (offset, chunk) in enumerate(pieces)]
+        del pieces
+        tokens = TokenStream(self.source)
+        with ProcessPoolExecutor(min(self.workers, len(tasks))) as executor:
+            # Pieces come back in order, so the first error met is the first in the text
+            for columns, error in executor.map(lex_chunk, tasks):
+                if error:
+                    error_class, start, end, details = error
+                    self.error = error_class(self.source.get_position(start), self.source.get_position(end), details)
+                    executor.shutdown(cancel_futures=True)
+                    return [], self.error
+                types, starts, ends, values = columns
+                tokens.types.extend(types)
+                tokens.starts.extend(starts)
+                tokens.ends.extend(ends)
+                tokens.values.extend(values)
+        self.error = None
+        return tokens, None
+
+
+LEXERS = {
+    'classic': Lexer,
+    'regex': RegexLexer,
+    'parallel': ParallelLexer
+}
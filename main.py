@@ -1,14 +1,25 @@
+import mmap, os
 from string_with_arrows import *
 from error import *
 from position import *
 from constants import *
 from lexer import *
 from ourjs_parser import *
+from ir import *
+from optimizer import *
+from vm import *
+from pybackend import *
+from cache import *
+from instrument import *
 
 class IntermediateCodeGenerator:
-    def __init__(self, ast):
+    # Nodes emit instructions field by field into an InstructionList and the
+    # textual IC is printed from it into the sink (see ir.make_writer).
+    def __init__(self, ast, sink=None):
         self.temp_counter = 0
         self.ast = ast
+        self.sink = sink
+        self.emit = None
 
     def get_next_temp(self):
         self.temp_counter = self.temp_counter + 1
@@ -17,37 +28,300 @@ class IntermediateCodeGenerator:
     def get_current_temp(self):
         return self.temp_counter - 1
 
+    def emit_all(self, instructions):
+        for fields in instructions.fields():
+            self.emit(*fields)
+
+    def capture(self, node):
+        # Emits node into a list instead of the sink, for code placed later
+        emit = self.emit
+        instructions = InstructionList()
+        self.emit = instructions.add
+        node.emit_ic(self)
+        self.emit = emit
+        return instructions
+
+    def generate_instructions(self):
+        instructions = InstructionList()
+        self.emit = instructions.add
+        if self.ast != None: self.ast.emit_ic(self)
+        return instructions
+
+    def write_intermediate_code(self):
+        if self.ast == None: return
+        write = make_writer(self.sink)
+        self.emit = lambda *fields: write(format_instruction(*fields))
+        self.ast.emit_ic(self)
+
     def generate_intermediate_code(self):
-        if self.ast == None: return ''
-        return self.ast.get_ic(self.get_next_temp, self.get_current_temp)
+        return format_instructions(self.generate_instructions())
         
 
 ##################################################
 # RUN
 ##################################################
 
-def run(file_name, text):
+def map_source(file_name):
+    # A read-only map lets the regex lexer scan the file without building a str
+    with open(file_name, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0: return b''
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def parse_source(file_name, text=None, lexer_engine='classic', streaming=False, recover=False, max_errors=None,
+                 instrument=NO_INSTRUMENTATION):
+    # Lexes and parses; returns (ast, error) where ast is a ParseResult. When
+    # recovering, error is an ErrorList of every error up to max_errors.
+    if text is None: text = map_source(file_name)
+
     # Generate Tokens
-    lexer = Lexer(file_name, text)
-    tokens, error = lexer.make_tokens()
+    lexer = LEXERS[lexer_engine](file_name, text)
+    if recover: return parse_recovering(lexer, streaming, max_errors, instrument)
 
-    if error : return None , error
+    if streaming:
+        # Lex on demand while parsing; a lexing error still takes precedence
+        instrument.start(STAGE_PARSE)
+        tokens = TokenBuffer(lexer)
+        ast = Parser(tokens).parse()
+        error = tokens.finish()
+        instrument.finish(STAGE_PARSE, lambda: {'characters': len(text), 'tokens': len(tokens), 'nodes': count_nodes(ast.node)})
+        if error : return None , error
+    else:
+        instrument.start(STAGE_LEX)
+        tokens, error = lexer.make_tokens()
+        instrument.finish(STAGE_LEX, lambda: {'characters': len(text), 'tokens': len(tokens)})
 
-    # print(tokens)
-    # Generate AST
-    parser  = Parser(tokens)
-    ast = parser.parse()
+        if error : return None , error
 
-    if ast.error:
-        return None, ast.error
-    
-    print('_______ABSTRACT SYNTAX TREE____________\n')
+        # print(tokens)
+        # Generate AST
+        instrument.start(STAGE_PARSE)
+        parser  = Parser(tokens)
+        ast = parser.parse()
+        instrument.finish(STAGE_PARSE, lambda: {'nodes': count_nodes(ast.node)})
+
+    return ast, ast.error
+
+def parse_recovering(lexer, streaming, max_errors, instrument=NO_INSTRUMENTATION):
+    # The lexer skips illegal characters and the parser whole statements, so
+    # one pass finds every error. Streamed, the parser cannot tell how many
+    # the lexer will find, so the two only share max_errors afterwards.
+    if streaming:
+        instrument.start(STAGE_PARSE)
+        lexer.collect_errors(max_errors)
+        tokens = TokenBuffer(lexer)
+        parser = Parser(tokens, True, max_errors, lexer.errors)
+        ast = parser.parse()
+        tokens.finish()
+        lex_errors = lexer.errors
+        instrument.finish(STAGE_PARSE, lambda: {'characters': len(lexer.text), 'tokens': len(tokens), 'nodes': count_nodes(ast.node)})
+    else:
+        instrument.start(STAGE_LEX)
+        tokens, lex_errors = lexer.make_tokens(True, max_errors)
+        instrument.finish(STAGE_LEX, lambda: {'characters': len(lexer.text), 'tokens': len(tokens)})
+        if max_errors is not None and len(lex_errors) >= max_errors:
+            return None, ErrorList(lex_errors, True)
+        instrument.start(STAGE_PARSE)
+        parser = Parser(tokens, True, None if max_errors is None else max_errors - len(lex_errors), lex_errors)
+        ast = parser.parse()
+        instrument.finish(STAGE_PARSE, lambda: {'nodes': count_nodes(ast.node)})
+
+    errors = ErrorList(lex_errors + parser.errors)
+    if not errors: return ast, None
+    if max_errors is not None and len(errors) >= max_errors:
+        del errors.errors[max_errors:]
+        errors.stopped = True
+    return ast, errors
+
+def cache_source(file_name, text, lexer_engine, cache):
+    # The cache key of the text and the SourceFile its entries are loaded into
+    if text is None: text = map_source(file_name)
+    # The classic lexer works on str, so its entries are keyed by the decoded text
+    if lexer_engine == 'classic' and not isinstance(text, str): text = bytes(text).decode('utf-8')
+    return cache.get_key(text), SourceFile(file_name, text)
+
+def load_cached(cache, key, stage, source=None, instrument=NO_INSTRUMENTATION):
+    instrument.start(STAGE_LOAD)
+    value = cache.load(key, stage, source)
+    instrument.finish(STAGE_LOAD, lambda: {f'{stage} hits': int(value is not None)})
+    return value
+
+def store_cached(cache, key, stage, value, instrument=NO_INSTRUMENTATION):
+    instrument.start(STAGE_STORE)
+    cache.store(key, stage, value)
+    instrument.finish(STAGE_STORE)
+
+def load_tokens(key, source, lexer_engine, cache, instrument=NO_INSTRUMENTATION):
+    # (tokens, error) for source, from the cache or lexed and stored
+    lexed = load_cached(cache, key, STAGE_TOKENS, source, instrument)
+    if lexed is None:
+        instrument.start(STAGE_LEX)
+        lexer = LEXERS[lexer_engine](source.file_name, source.text)
+        lexer.source = source
+        lexed = lexer.make_tokens()
+        instrument.finish(STAGE_LEX, lambda: {'characters': len(source.text), 'tokens': len(lexed[0])})
+        store_cached(cache, key, STAGE_TOKENS, lexed, instrument)
+    return lexed
+
+def lex_cached(file_name, text, lexer_engine, cache, instrument=NO_INSTRUMENTATION):
+    return load_tokens(*cache_source(file_name, text, lexer_engine, cache), lexer_engine, cache, instrument)
+
+def parse_cached(file_name, text, lexer_engine, cache, instrument=NO_INSTRUMENTATION):
+    # Like parse_source, but the tokens and the AST of a text seen before
+    # come from the cache. Returns (ast, error, key). The cache stores the
+    # whole token stream, so there is no streaming mode.
+    key, source = cache_source(file_name, text, lexer_engine, cache)
+
+    ast = load_cached(cache, key, STAGE_AST, source, instrument)
+    if ast is not None: return ast, ast.error, key
+
+    tokens, error = load_tokens(key, source, lexer_engine, cache, instrument)
+    if error: return None, error, key
+
+    instrument.start(STAGE_PARSE)
+    ast = Parser(tokens).parse()
+    instrument.finish(STAGE_PARSE, lambda: {'nodes': count_nodes(ast.node)})
+    store_cached(cache, key, STAGE_AST, ast, instrument)
+    return ast, ast.error, key
+
+def generate_cached(node, key, cache, output, optimization_level, instrument=NO_INSTRUMENTATION):
+    # The IC lines for node, loaded from or stored in the cache per optimization level
+    stage = f'{STAGE_IC}{optimization_level}'
+    lines = load_cached(cache, key, stage, None, instrument)
+    if lines is None:
+        instructions = generate_ic(IntermediateCodeGenerator(node), instrument)
+        if optimization_level > 0: instructions = optimize_ic(instructions, optimization_level, instrument)
+        instrument.start(STAGE_WRITE)
+        lines = [format_instruction(*fields) for fields in instructions.fields()]
+        instrument.finish(STAGE_WRITE)
+        store_cached(cache, key, stage, lines, instrument)
+
+    return write_text(lines, output, instrument)
+
+def generate_ic(generator, instrument=NO_INSTRUMENTATION):
+    instrument.start(STAGE_GENERATE)
+    instructions = generator.generate_instructions()
+    instrument.finish(STAGE_GENERATE, lambda: {'instructions': len(instructions), 'temporaries': generator.temp_counter})
+    return instructions
+
+def optimize_ic(instructions, optimization_level, instrument=NO_INSTRUMENTATION):
+    instrument.start(STAGE_OPTIMIZE)
+    optimized = optimize(instructions, optimization_level)
+    instrument.finish(STAGE_OPTIMIZE, lambda: {'instructions': len(instructions), 'optimized': len(optimized)})
+    return optimized
+
+def write_text(lines, output, instrument=NO_INSTRUMENTATION):
+    # Returns lines joined, or writes them to the output sink and returns None
+    instrument.start(STAGE_WRITE)
+    if output is None:
+        text = ''.join(lines)
+    else:
+        text = None
+        write = make_writer(output)
+        for line in lines: write(line)
+    instrument.finish(STAGE_WRITE)
+    return text
+
+def lex_source(file_name, text=None, lexer_engine='classic', recover=False, max_errors=None, instrument=NO_INSTRUMENTATION):
+    # Lexes only; returns (tokens, error), see parse_source
+    if text is None: text = map_source(file_name)
+    lexer = LEXERS[lexer_engine](file_name, text)
+    instrument.start(STAGE_LEX)
+    tokens, errors = lexer.make_tokens(recover, max_errors)
+    instrument.finish(STAGE_LEX, lambda: {'characters': len(text), 'tokens': len(tokens)})
+    if not recover or not errors: return tokens, errors or None
+    return tokens, ErrorList(errors, max_errors is not None and len(errors) >= max_errors)
+
+# What main.run can stop after and emit
+EMIT_STAGES = (STAGE_TOKENS, STAGE_AST, STAGE_IC)
+
+def run(file_name, text=None, lexer_engine='classic', streaming=False, output=None, optimization_level=0, cache=None,
+        recover=False, max_errors=None, emit=STAGE_IC, instrument=NO_INSTRUMENTATION):
+    # Without text, the source is read from file_name. emit is the stage to
+    # stop after: STAGE_TOKENS gives a token per line, STAGE_AST the tree
+    # and STAGE_IC the intermediate code. With an output sink the text is
+    # written there instead of being returned. An optimization_level of 1
+    # or more optimizes the IC (and folds the tree) first. With a
+    # CompileCache, stages already run on the same text are loaded from it
+    # instead. With recover set the error returned is an ErrorList of all
+    # errors in the source, up to max_errors. An Instrumentation is told
+    # about every stage as it runs.
+    if emit not in EMIT_STAGES: raise ValueError(f"Cannot emit '{emit}', expected one of {', '.join(EMIT_STAGES)}")
+    use_cache = cache is not None and not cache.bypass
+
+    if emit == STAGE_TOKENS:
+        if use_cache:
+            tokens, error = lex_cached(file_name, text, lexer_engine, cache, instrument)
+            if error and recover: tokens, error = lex_source(file_name, text, lexer_engine, True, max_errors, instrument)
+        else:
+            tokens, error = lex_source(file_name, text, lexer_engine, recover, max_errors, instrument)
+        if error: return None, error
+        return write_text((f'{token}\n' for token in tokens), output, instrument), None
+
+    key = None
+    if use_cache:
+        ast, error, key = parse_cached(file_name, text, lexer_engine, cache, instrument)
+        # Only the first error is cached; the rest take a recovering pass
+        if error and recover: ast, error = parse_source(file_name, text, lexer_engine, streaming, True, max_errors, instrument)
+    else:
+        ast, error = parse_source(file_name, text, lexer_engine, streaming, recover, max_errors, instrument)
+
+    if error:
+        return None, error
+
+    if optimization_level > 0:
+        instrument.start(STAGE_FOLD)
+        ast.node = fold_ast(ast.node)
+        instrument.finish(STAGE_FOLD, lambda: {'nodes': count_nodes(ast.node)})
     
-    print(ast.node)
+    # A generator, so the tree is formatted within the write stage
+    if emit == STAGE_AST: return write_text((f'{node}\n' for node in [ast.node]), output, instrument), None
 
-    print('\n_______INTERMEDIATE CODE____________\n')
+    if key is not None: return generate_cached(ast.node, key, cache, output, optimization_level, instrument), ast.error
 
     # Intermediate Code Generator
-    intermediateCodeGenerator = IntermediateCodeGenerator(ast.node)
+    intermediateCodeGenerator = IntermediateCodeGenerator(ast.node, output)
+
+    if optimization_level > 0:
+        instructions = generate_ic(intermediateCodeGenerator, instrument)
+        optimized = optimize_ic(instructions, optimization_level, instrument)
+
+        if output is not None:
+            instrument.start(STAGE_WRITE)
+            write_instructions(optimized, output)
+            instrument.finish(STAGE_WRITE)
+            return None, ast.error
+        instrument.start(STAGE_WRITE)
+        text = format_instructions(optimized)
+        instrument.finish(STAGE_WRITE)
+        return text, ast.error
+
+    if output is not None:
+        # The IC is written as it is generated, so there is no write stage
+        # Lines are only counted when someone is listening
+        get_counts = None
+        if instrument.enabled:
+            intermediateCodeGenerator.sink = counter = LineCounter(output)
+            get_counts = lambda: {'instructions': counter.count, 'temporaries': intermediateCodeGenerator.temp_counter}
+        instrument.start(STAGE_GENERATE)
+        intermediateCodeGenerator.write_intermediate_code()
+        instrument.finish(STAGE_GENERATE, get_counts)
+        return None, ast.error
+
+    instructions = generate_ic(intermediateCodeGenerator, instrument)
+    instrument.start(STAGE_WRITE)
+    text = format_instructions(instructions)
+    instrument.finish(STAGE_WRITE)
+    return text, ast.error
+
+def execute(file_name, text=None, lexer_engine='regex', optimization_level=0, output=None, backend='vm'):
+    # Compiles to bytecode and runs it on the VM, or with backend='python'
+    # to a Python code object; log() writes to output.
+    # Returns (value of the last statement, error).
+    ast, error = parse_source(file_name, text, lexer_engine)
+    if error: return None, error
 
-    return intermediateCodeGenerator.generate_intermediate_code(), ast.error
\ No newline at end of file
+    node = fold_ast(ast.node) if optimization_level > 0 else ast.node
+    if backend == 'python':
+        return run_code(PythonCompiler(file_name).compile(node), node.source, output)
+    bytecode = BytecodeCompiler().compile(node)
+    return VM(bytecode, output).run()
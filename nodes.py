@@ -1,273 +1,423 @@
 from lexer import *
+from ir import *
 
 ##################################################
 # NODES
 ##################################################
 
-class NumberNode:
+# Marks a node's steps as finished; None may be a part
+DONE = object()
+
+class Node:
+    # Nodes with children describe emitting and formatting as generators,
+    # emit_steps and repr_parts, that yield each child in turn. emit_ic and
+    # __repr__ run those from a stack instead of recursing, so trees as
+    # deep as the parser builds (see Parser.parse_expression) compile.
+    # Nodes without children define emit_ic and __repr__ directly, with
+    # emit_steps the same as emit_ic.
+    __slots__ = ('start', 'end', 'source')
+
+    def emit_ic(self, ic):
+        stack = [self.emit_steps(ic)]
+        push = stack.append
+        pop = stack.pop
+        while stack:
+            child = next(stack[-1], DONE)
+            if child is DONE:
+                pop()
+                continue
+            steps = child.emit_steps(ic)
+            if steps is not None: push(steps)
+
+    def __repr__(self):
+        parts = []
+        stack = [self.repr_parts()]
+        while stack:
+            part = next(stack[-1], DONE)
+            if part is DONE:
+                stack.pop()
+            elif isinstance(part, Node):
+                child_parts = part.repr_parts()
+                if isinstance(child_parts, str): parts.append(child_parts)
+                else: stack.append(child_parts)
+            else:
+                parts.append(str(part))
+        return ''.join(parts)
+
+    def repr_parts(self):
+        return repr(self)
+
+    @property
+    def pos_start(self):
+        return self.source.get_position(self.start)
+
+    @property
+    def pos_end(self):
+        return self.source.get_end_position(self.end)
+
+class NumberNode(Node):
+    __slots__ = ('token',)
+
     def __init__(self, token):
         self.token = token
-        self.pos_start = self.token.pos_start
-        self.pos_end = self.token.pos_end
+        self.start = self.token.start
+        self.end = self.token.end
+        self.source = self.token.source
     
     def __repr__(self):
         return f'{self.token}'
 
-    def get_ic(self, get_next_temp, get_current_temp):
-      return f't{get_next_temp()} = {self.token.value}\n'
-    
-class StringNode:
+    def emit_ic(self, ic):
+      ic.emit(IR_CONST, ic.get_next_temp(), self.token.value)
+
+    emit_steps = emit_ic
+
+class StringNode(Node):
+    __slots__ = ('token',)
+
     def __init__(self, token):
         self.token = token
-        self.pos_start = self.token.pos_start
-        self.pos_end = self.token.pos_end
+        self.start = self.token.start
+        self.end = self.token.end
+        self.source = self.token.source
     
     def __repr__(self):
         return f'{self.token}'
 
-    def get_ic(self, get_next_temp, get_current_temp):
-      return f't{get_next_temp()} = "{self.token.value}"\n'
-    
-class VarAccessNode:
+    def emit_ic(self, ic):
+      ic.emit(IR_CONST, ic.get_next_temp(), self.token.value)
+
+    emit_steps = emit_ic
+
+class VarAccessNode(Node):
+    __slots__ = ('var_name_token',)
+
     def __init__(self, var_name_token):
         self.var_name_token = var_name_token
 
-        self.pos_start = self.var_name_token.pos_start
-        self.pos_end = self.var_name_token.pos_end
+        self.start = self.var_name_token.start
+        self.end = self.var_name_token.end
+        self.source = self.var_name_token.source
 
     def __repr__(self):
         return f'{self.var_name_token}'
 
-    def get_ic(self, get_next_temp, get_current_temp):
-      return f't{get_next_temp()} = {self.var_name_token.value}\n'
+    def emit_ic(self, ic):
+      ic.emit(IR_LOAD, ic.get_next_temp(), self.var_name_token.value)
+
+    emit_steps = emit_ic
+
+class VarAssignNode(Node):
+    __slots__ = ('var_name_token', 'value_node')
+    # Keyword tokens only feed __repr__, so they live on the class
+    eq_token = Token(TOKEN_EQ)
 
-class VarAssignNode:
     def __init__(self, var_name_token, value_node):
         self.var_name_token = var_name_token
         self.value_node = value_node
 
-        self.pos_start = self.var_name_token.pos_start
-        self.pos_end = self.var_name_token.pos_end
+        self.start = self.var_name_token.start
+        self.end = self.var_name_token.end
+        self.source = self.var_name_token.source
     
-    def __repr__(self):
-        return f'({self.var_name_token} {Token(TOKEN_EQ)} {self.value_node})'
-
-    def get_ic(self, get_next_temp, get_current_temp):
-      return f'{self.value_node.get_ic(get_next_temp, get_current_temp)}{self.var_name_token.value} = t{get_current_temp()}\n'
+    def repr_parts(self):
+        yield f'({self.var_name_token} {self.eq_token} '
+        yield self.value_node
+        yield ')'
+
+    def emit_steps(self, ic):
+      yield self.value_node
+      ic.emit(IR_STORE, self.var_name_token.value, ic.get_current_temp())
     
-class BinOpNode:
+class BinOpNode(Node):
+    __slots__ = ('left_node', 'op_token', 'right_node')
+
     def __init__(self, left_node, op_token, right_node):
         self.left_node = left_node 
         self.op_token = op_token 
         self.right_node = right_node 
-        self.pos_start = self.left_node.pos_start
-        self.pos_end = self.right_node.pos_end
+        self.start = self.left_node.start
+        self.end = self.right_node.end
+        self.source = self.left_node.source
     
-    def __repr__(self):
-        return f'({self.left_node}, {self.op_token}, {self.right_node})'
-
-    def get_ic(self, get_next_temp, get_current_temp):
-      left_ic = self.left_node.get_ic(get_next_temp, get_current_temp)
-      left_ic_temp = get_current_temp()
-      right_ic = self.right_node.get_ic(get_next_temp, get_current_temp)
-      right_ic_temp = get_current_temp()
+    def repr_parts(self):
+        yield '('
+        yield self.left_node
+        yield f', {self.op_token}, '
+        yield self.right_node
+        yield ')'
+
+    def emit_steps(self, ic):
+      yield self.left_node
+      left_ic_temp = ic.get_current_temp()
+      yield self.right_node
+      right_ic_temp = ic.get_current_temp()
       op = self.get_op_symbol()
-      return f'{left_ic}{right_ic}t{get_next_temp()} = t{left_ic_temp} {op} t{right_ic_temp}\n'
+      ic.emit(op, ic.get_next_temp(), left_ic_temp, right_ic_temp)
 
     def get_op_symbol(self):
       if (self.op_token.type == TOKEN_MINUS):
-        return '-'
+        return IR_SUB
       elif(self.op_token.type == TOKEN_PLUS):
-        return '+'
+        return IR_ADD
       elif(self.op_token.type == TOKEN_DIV):
-        return '/'
+        return IR_DIV
       elif(self.op_token.type == TOKEN_MUL):
-        return '*'
+        return IR_MUL
       elif(self.op_token.type == TOKEN_EE):
-        return '=='
+        return IR_EE
       elif(self.op_token.type == TOKEN_GT):
-        return '>'
+        return IR_GT
       elif(self.op_token.type == TOKEN_GTE):
-        return '>='
+        return IR_GTE
       elif(self.op_token.type == TOKEN_LT):
-        return '<'
+        return IR_LT
       elif(self.op_token.type == TOKEN_LTE):
-        return '<='
+        return IR_LTE
       elif(self.op_token.type == TOKEN_NE):
-        return '!='
+        return IR_NE
       elif(self.op_token.type == TOKEN_AND):
-        return '&&'
+        return IR_AND
       elif(self.op_token.type == TOKEN_OR):
-        return '||'
+        return IR_OR
       else:
-        return '%'
+        return IR_MOD
+
+class UnaryOpNode(Node):
+    __slots__ = ('op_token', 'node')
 
-class UnaryOpNode:
     def __init__(self, op_token, node):    
         self.op_token = op_token
         self.node = node
-        self.pos_start = self.op_token.pos_start
-        self.pos_end = self.node.pos_end
+        self.start = self.op_token.start
+        self.end = self.node.end
+        self.source = self.op_token.source
     
-    def __repr__(self):
-        return f'({self.op_token}, {self.node})'
-
-    def get_ic(self, get_next_temp, get_current_temp):
-      node_ic = self.node.get_ic(get_next_temp, get_current_temp)
-      node_ic_temp = get_current_temp()
+    def repr_parts(self):
+        yield f'({self.op_token}, '
+        yield self.node
+        yield ')'
+
+    def emit_steps(self, ic):
+      yield self.node
+      node_ic_temp = ic.get_current_temp()
       if self.op_token.type == TOKEN_PLUS:
-        return f'{node_ic}'
+        return
       elif self.op_token.type == TOKEN_NOT:
-        return f'{node_ic}t{get_next_temp()} = !t{node_ic_temp}\n'
+        ic.emit(IR_NOT, ic.get_next_temp(), node_ic_temp)
       else: 
-        return f'{node_ic}t{get_next_temp()} = uminus t{node_ic_temp}\n'
+        ic.emit(IR_NEG, ic.get_next_temp(), node_ic_temp)
     
-class IfNode:
+class IfNode(Node):
+    __slots__ = ('cases', 'else_case')
+    if_token = Token(TOKEN_KEYWORD, 'if')
+    else_token = Token(TOKEN_KEYWORD, 'else')
+
     def __init__(self, cases, else_case):
       self.cases = cases
-      self.if_token = Token(TOKEN_KEYWORD, 'if')
-      self.else_token = Token(TOKEN_KEYWORD, 'else')
       self.else_case = else_case
         
-      self.pos_start = self.cases[0][0].pos_start
-      self.pos_end = (self.else_case or self.cases[len(self.cases) - 1][0]).pos_end
+      self.start = self.cases[0][0].start
+      self.end = (self.else_case or self.cases[len(self.cases) - 1][0]).end
+      self.source = self.cases[0][0].source
       
-    def __repr__(self):
-      if self.else_case: 
-        return f'({self.if_token} {TOKEN_LCURL} {self.cases[0]} {TOKEN_RCURL} {self.else_token}  {TOKEN_LCURL} {self.else_case} {TOKEN_RCURL})'
-      return f'({self.if_token} {TOKEN_LCURL} {self.cases[0]} {TOKEN_RCURL})'
-
-    def get_ic(self, get_next_temp, get_current_temp):
-      comp_ic = self.cases[0][0].get_ic(get_next_temp, get_current_temp)
-      comp_ic_temp = get_current_temp()
-      label1 = get_next_temp()
-      body_ic = self.cases[0][1].get_ic(get_next_temp, get_current_temp)
-      return f'{comp_ic}if !t{comp_ic_temp} goto L{label1}\n{body_ic}L{label1}:\n'
-
-class ForNode:
+    def repr_parts(self):
+      # The first case prints as the tuple it is
+      condition, body = self.cases[0]
+      yield f'({self.if_token} {TOKEN_LCURL} ('
+      yield condition
+      yield ', '
+      yield body
+      yield f') {TOKEN_RCURL}'
+      if self.else_case:
+        yield f' {self.else_token}  {TOKEN_LCURL} '
+        yield self.else_case
+        yield f' {TOKEN_RCURL}'
+      yield ')'
+
+    def emit_steps(self, ic):
+      yield self.cases[0][0]
+      comp_ic_temp = ic.get_current_temp()
+      label1 = ic.get_next_temp()
+      ic.emit(IR_IF_FALSE, None, comp_ic_temp, label1)
+      yield self.cases[0][1]
+      ic.emit(IR_LABEL, None, label1)
+
+class ForNode(Node):
+    __slots__ = ('expr_node', 'comp_expr_node', 'arith_expr_node', 'body_node')
+    for_token = Token(TOKEN_KEYWORD, 'for')
+
     def __init__(self, expr_node, comp_expr_node, arith_expr_node, body_node):
-        self.for_token = Token(TOKEN_KEYWORD, 'for')
         self.expr_node = expr_node
         self.comp_expr_node = comp_expr_node
         self.arith_expr_node = arith_expr_node
         self.body_node = body_node
         
-        self.pos_start = self.expr_node.pos_start
-        self.pos_end = self.body_node.pos_end
+        self.start = self.expr_node.start
+        self.end = self.body_node.end
+        self.source = self.expr_node.source
         
-    def __repr__(self):
-        return f'({self.for_token} {TOKEN_LPAREN} {self.expr_node} {TOKEN_COMMA} {self.comp_expr_node} {TOKEN_COMMA} {self.arith_expr_node} {TOKEN_RPAREN} {TOKEN_LCURL} {self.body_node} {TOKEN_RCURL})'     
+    def repr_parts(self):
+        yield f'({self.for_token} {TOKEN_LPAREN} '
+        yield self.expr_node
+        yield f' {TOKEN_COMMA} '
+        yield self.comp_expr_node
+        yield f' {TOKEN_COMMA} '
+        yield self.arith_expr_node
+        yield f' {TOKEN_RPAREN} {TOKEN_LCURL} '
+        yield self.body_node
+        yield f' {TOKEN_RCURL})'
     
-    def get_ic(self, get_next_temp, get_current_temp):
-      var_ic = self.expr_node.get_ic(get_next_temp, get_current_temp)
+    def emit_steps(self, ic):
+      yield self.expr_node
       var_ic_token_name = self.expr_node.var_name_token.value
-      comp_ic = self.comp_expr_node.get_ic(get_next_temp, get_current_temp)
-      comp_ic_temp = get_current_temp()
-      arith_ic = self.arith_expr_node.get_ic(get_next_temp, get_current_temp)
-      arith_ic_temp = get_current_temp()
-      label1 = get_next_temp()
-      label2 = get_next_temp()
-      body_ic = self.body_node.get_ic(get_next_temp, get_current_temp)
-
-      
-      return f'{var_ic}L{label1}:\n{comp_ic}if !t{comp_ic_temp} goto L{label2}\n{body_ic}{arith_ic}{var_ic_token_name} = t{arith_ic_temp}\ngoto L{label1}\nL{label2}:\n'
+      # The labels are numbered after both expressions but the condition is
+      # placed after the first label and the step after the body, so both
+      # expressions are held back until then
+      comp_ic = ic.capture(self.comp_expr_node)
+      comp_ic_temp = ic.get_current_temp()
+      arith_ic = ic.capture(self.arith_expr_node)
+      arith_ic_temp = ic.get_current_temp()
+      label1 = ic.get_next_temp()
+      label2 = ic.get_next_temp()
+
+      ic.emit(IR_LABEL, None, label1)
+      ic.emit_all(comp_ic)
+      ic.emit(IR_IF_FALSE, None, comp_ic_temp, label2)
+      yield self.body_node
+      ic.emit_all(arith_ic)
+      ic.emit(IR_STORE, var_ic_token_name, arith_ic_temp)
+      ic.emit(IR_GOTO, None, label1)
+      ic.emit(IR_LABEL, None, label2)
         
-class WhileNode:
+class WhileNode(Node):
+    __slots__ = ('condition_node', 'body_node')
+    while_token = Token(TOKEN_KEYWORD, 'while')
+
     def __init__(self, condition_node, body_node):
-        self.while_token = Token(TOKEN_KEYWORD, 'while')
         self.condition_node = condition_node
         self.body_node = body_node
         
-        self.pos_start = self.condition_node.pos_start
-        self.pos_end = self.body_node.pos_end
-
-    def __repr__(self):
-        return f'({self.while_token} {TOKEN_LPAREN} {self.condition_node} {TOKEN_RPAREN} {TOKEN_LCURL} {self.body_node} {TOKEN_RCURL})'   
+        self.start = self.condition_node.start
+        self.end = self.body_node.end
+        self.source = self.condition_node.source
+
+    def repr_parts(self):
+        yield f'({self.while_token} {TOKEN_LPAREN} '
+        yield self.condition_node
+        yield f' {TOKEN_RPAREN} {TOKEN_LCURL} '
+        yield self.body_node
+        yield f' {TOKEN_RCURL})'
     
-    def get_ic(self, get_next_temp, get_current_temp):
-      comp_ic = self.condition_node.get_ic(get_next_temp, get_current_temp)
-      comp_ic_temp = get_current_temp()
-      label1 = get_next_temp()
-      label2 = get_next_temp()
-      body_ic = self.body_node.get_ic(get_next_temp, get_current_temp)
-      return f'{comp_ic}L{label2}:\nif !t{comp_ic_temp} goto L{label1}\n{body_ic}goto L{label2}\nL{label1}:\n'  
+    def emit_steps(self, ic):
+      yield self.condition_node
+      comp_ic_temp = ic.get_current_temp()
+      label1 = ic.get_next_temp()
+      label2 = ic.get_next_temp()
+      ic.emit(IR_LABEL, None, label2)
+      ic.emit(IR_IF_FALSE, None, comp_ic_temp, label1)
+      yield self.body_node
+      ic.emit(IR_GOTO, None, label2)
+      ic.emit(IR_LABEL, None, label1)
     
-class FuncDefNode:
+class FuncDefNode(Node):
+    __slots__ = ('var_name_token', 'arg_name_tokens', 'body_node')
+    func_token = Token(TOKEN_KEYWORD, 'func')
+
     def __init__(self, var_name_token, arg_name_tokens, body_node):
-        self.func_token = Token(TOKEN_KEYWORD, 'func')
         self.var_name_token = var_name_token
         self.arg_name_tokens = arg_name_tokens
         self.body_node = body_node
 
         if len(self.arg_name_tokens) > 0:
-            self.pos_start = self.arg_name_tokens[0].pos_start
+            self.start = self.arg_name_tokens[0].start
         else:
-            self.pos_start = self.body_node.pos_end
+            self.start = self.body_node.end
+        self.end = self.body_node.end
+        self.source = self.body_node.source
 
-    def __repr__(self):
-        return f'({self.func_token} {self.var_name_token} {TOKEN_LPAREN} {self.arg_name_tokens} {TOKEN_RPAREN} {TOKEN_LCURL} {self.body_node} {TOKEN_RCURL})'
+    def repr_parts(self):
+        yield f'({self.func_token} {self.var_name_token} {TOKEN_LPAREN} {self.arg_name_tokens} {TOKEN_RPAREN} {TOKEN_LCURL} '
+        yield self.body_node
+        yield f' {TOKEN_RCURL})'
+
+    def emit_steps(self, ic):
+      ic.emit(IR_FUNC, None, self.var_name_token.value)
+      yield self.body_node
+      ic.emit(IR_RET)
 
-    def get_ic(self, get_next_temp, get_current_temp):
-      return f'{self.var_name_token.value}:\n{self.body_node.get_ic(get_next_temp, get_current_temp)}ret\n'
+class CallNode(Node):
+    __slots__ = ('node_to_call', 'arg_nodes')
 
-class CallNode:
     def __init__(self, node_to_call,arg_nodes):
         self.node_to_call = node_to_call
         self.arg_nodes = arg_nodes
 
-        self.pos_start = self.node_to_call.pos_start
+        self.start = self.node_to_call.start
+        self.source = self.node_to_call.source
 
         if len(self.arg_nodes) > 0:
-            self.pos_end = self.arg_nodes[len(self.arg_nodes) - 1].pos_end
+            self.end = self.arg_nodes[len(self.arg_nodes) - 1].end
         else:
-            self.pos_end = self.node_to_call.pos_end
+            self.end = self.node_to_call.end
+
+    def repr_parts(self):
+        yield '('
+        yield self.node_to_call
+        yield f' {TOKEN_LPAREN} '
+        for index, arg_node in enumerate(self.arg_nodes):
+            if index > 0: yield f'{TOKEN_COMMA} '
+            yield arg_node
+        yield f' {TOKEN_RPAREN})'
+
+    def emit_steps(self, ic):
+      arg_nodes_temps = []
+      for arg_node in self.arg_nodes:
+        yield arg_node
+        arg_nodes_temps.append(ic.get_current_temp())
+      ic.emit(IR_CALL, None, self.node_to_call.var_name_token.value, tuple(arg_nodes_temps))
+
+class ErrorNode(Node):
+    # Stands for a statement the parser skipped while recovering from error
+    __slots__ = ('error',)
+
+    def __init__(self, error, start, end, source):
+        self.error = error
+
+        self.start = start
+        self.end = end
+        self.source = source
 
     def __repr__(self):
-        arg_name_string = ""
-        for arg_node in self.arg_nodes:
-            if arg_name_string == "":
-                arg_name_string += f'{arg_node}'
-            else:
-                arg_name_string += f'{TOKEN_COMMA} {arg_node}'
-        return f'({self.node_to_call} {TOKEN_LPAREN} {arg_name_string} {TOKEN_RPAREN})'
+        return 'ERROR'
 
-    def get_ic(self, get_next_temp, get_current_temp):
-      arg_nodes_temps = ''
-      arg_nodes_ic = ''
-      for arg_node in self.arg_nodes:
-        arg_nodes_ic += arg_node.get_ic(get_next_temp, get_current_temp)
-        arg_node_temp = get_current_temp()
-        if arg_nodes_temps == '':
-          arg_nodes_temps += f't{arg_node_temp}'
-        else:
-          arg_nodes_temps += f', t{arg_node_temp}'
-      return f'{arg_nodes_ic}call {self.node_to_call.var_name_token.value} {arg_nodes_temps}\n'
+    def emit_ic(self, ic):
+      raise ValueError(f'Cannot generate code for a statement with errors: {self.error.details}')
 
-class ListNode:
-    def __init__(self, element_nodes, pos_start, pos_end):
-        self.element_nodes = element_nodes
+    emit_steps = emit_ic
 
-        self.pos_start = pos_start
-        self.pos_end = pos_end
-    
-    def to_string(self, nodes_list):
-        size = len(nodes_list)
-        if size <= 0:
-            return ""
-        elif size == 1:
-            return f'{nodes_list[0]}'
-        else:
-            node = nodes_list[0]
-            nodes_list.pop(0)
-            return f'({node} {self.to_string(nodes_list)})'
+class ListNode(Node):
+    __slots__ = ('element_nodes',)
 
-    def __repr__(self):
-        return self.to_string(self.element_nodes.copy())
+    def __init__(self, element_nodes, start, end, source):
+        self.element_nodes = element_nodes
 
-    def get_ic(self, get_next_temp, get_current_temp):
-      ic_statements = ''
+        self.start = start
+        self.end = end
+        self.source = source
+    
+    def repr_parts(self):
+        # Nested pairs, (a (b c)) for three elements
+        last = len(self.element_nodes) - 1
+        for node in self.element_nodes[:last]:
+            yield '('
+            yield node
+            yield ' '
+        if last >= 0: yield self.element_nodes[last]
+        yield ')' * last
+
+    def emit_steps(self, ic):
       for node in self.element_nodes:
-        ic_statements += node.get_ic(get_next_temp, get_current_temp)
-      return ic_statements
+        yield node
 
 
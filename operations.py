@@ -0,0 +1,106 @@
+import math
+from constants import *
+
+##################################################
+# OPERATIONS
+##################################################
+
+# Values are ints, floats and strs. Every operation returns None when its
+# operands do not support it, so callers can refuse to fold or report an
+# error instead of guessing at a coercion.
+
+def is_number(value):
+    return type(value) in (int, float)
+
+def is_true(value):
+    return value != 0 and value != ''
+
+def add(left, right):
+    if is_number(left) and is_number(right): return left + right
+    if type(left) == str and type(right) == str: return left + right
+    return None
+
+def subtract(left, right):
+    if is_number(left) and is_number(right): return left - right
+    return None
+
+def multiply(left, right):
+    if is_number(left) and is_number(right): return left * right
+    return None
+
+def divide(left, right):
+    if not (is_number(left) and is_number(right)) or right == 0: return None
+    if type(left) == int and type(right) == int and left % right == 0: return left // right
+    return left / right
+
+def modulo(left, right):
+    # The sign follows the dividend, as in JavaScript
+    if not (is_number(left) and is_number(right)) or right == 0: return None
+    result = abs(left) % abs(right)
+    return -result if left < 0 else result
+
+def same_kind(left, right):
+    return (is_number(left) and is_number(right)) or (type(left) == str and type(right) == str)
+
+def equal(left, right):
+    return 1 if same_kind(left, right) and left == right else 0
+
+def not_equal(left, right):
+    return 0 if same_kind(left, right) and left == right else 1
+
+def less_than(left, right):
+    if same_kind(left, right): return 1 if left < right else 0
+    return None
+
+def greater_than(left, right):
+    if same_kind(left, right): return 1 if left > right else 0
+    return None
+
+def less_than_or_equal(left, right):
+    if same_kind(left, right): return 1 if left <= right else 0
+    return None
+
+def greater_than_or_equal(left, right):
+    if same_kind(left, right): return 1 if left >= right else 0
+    return None
+
+def logical_and(left, right):
+    return right if is_true(left) else left
+
+def logical_or(left, right):
+    return left if is_true(left) else right
+
+def logical_not(value):
+    return 0 if is_true(value) else 1
+
+def negate(value):
+    if is_number(value): return -value
+    return None
+
+def to_string(value):
+    # Numbers print the way JavaScript prints them
+    if type(value) == float:
+        if math.isinf(value): return 'Infinity' if value > 0 else '-Infinity'
+        if value.is_integer(): return str(int(value))
+    return str(value)
+
+BINARY_OPERATIONS = {
+    IR_ADD: add,
+    IR_SUB: subtract,
+    IR_MUL: multiply,
+    IR_DIV: divide,
+    IR_MOD: modulo,
+    IR_EE: equal,
+    IR_NE: not_equal,
+    IR_LT: less_than,
+    IR_GT: greater_than,
+    IR_LTE: less_than_or_equal,
+    IR_GTE: greater_than_or_equal,
+    IR_AND: logical_and,
+    IR_OR: logical_or
+}
+
+UNARY_OPERATIONS = {
+    IR_NOT: logical_not,
+    IR_NEG: negate
+}
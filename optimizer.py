@@ -0,0 +1,568 @@
+import heapq, math
+from nodes import *
+from ir import *
+from cfg import *
+from operations import *
+
+##################################################
+# OPTIMIZER
+##################################################
+
+# Opcodes whose only effect is writing their destination temp
+PURE_OPS = IR_BINARY_OPS | IR_UNARY_OPS | {IR_CONST, IR_LOAD}
+
+def get_function_stores(opcodes, dests):
+    # Variables a call might assign: everything stored inside a function
+    stores = set()
+    depth = 0
+    for index in range(len(opcodes)):
+        opcode = opcodes[index]
+        if opcode == IR_FUNC: depth += 1
+        elif opcode == IR_RET: depth -= 1
+        elif opcode == IR_STORE and depth > 0: stores.add(dests[index])
+    return stores
+
+class Optimizer:
+    # Works on copies of the InstructionList columns. Removed instructions
+    # get a None opcode until the list is rebuilt.
+    def __init__(self, instructions):
+        self.opcodes = [IR_OPCODES[code] for code in instructions.opcodes]
+        self.dests = list(instructions.dests)
+        self.args1 = list(instructions.args1)
+        self.args2 = list(instructions.args2)
+
+    def set(self, index, opcode, dest=None, arg1=None, arg2=None):
+        self.opcodes[index] = opcode
+        self.dests[index] = dest
+        self.args1[index] = arg1
+        self.args2[index] = arg2
+
+    def remove(self, index):
+        self.opcodes[index] = None
+
+    def get_instructions(self):
+        instructions = InstructionList()
+        for fields in zip(self.opcodes, self.dests, self.args1, self.args2):
+            if fields[0] is not None: instructions.add(*fields)
+        return instructions
+
+    def get_temp_uses(self, index):
+        return get_temp_uses(self.opcodes[index], self.args1[index], self.args2[index])
+
+    ###################################
+
+    def get_function_ends(self):
+        # Index of the ret closing each function, keyed by the function entry
+        ends = {}
+        entries = []
+        for index in range(len(self.opcodes)):
+            if self.opcodes[index] == IR_FUNC: entries.append(index)
+            elif self.opcodes[index] == IR_RET: ends[entries.pop()] = index
+        return ends
+
+    def propagate_constants(self):
+        # Temps are assigned exactly once, so a constant temp is constant
+        # everywhere. Variables are tracked until the next label or jump.
+        # A function body starts with nothing known and control that reaches
+        # its entry skips to after its ret.
+        opcodes, dests, args1, args2 = self.opcodes, self.dests, self.args1, self.args2
+        function_stores = get_function_stores(opcodes, dests)
+        temps = {}
+        variables = {}
+        outer = []
+
+        for index in range(len(opcodes)):
+            opcode = opcodes[index]
+
+            if opcode == IR_CONST:
+                temps[dests[index]] = args1[index]
+            elif opcode == IR_LOAD:
+                if args1[index] in variables:
+                    value = variables[args1[index]]
+                    self.set(index, IR_CONST, dests[index], value)
+                    temps[dests[index]] = value
+            elif opcode == IR_STORE:
+                if args1[index] in temps: variables[dests[index]] = temps[args1[index]]
+                else: variables.pop(dests[index], None)
+            elif opcode in IR_BINARY_OPS:
+                if args1[index] in temps and args2[index] in temps:
+                    value = BINARY_OPERATIONS[opcode](temps[args1[index]], temps[args2[index]])
+                    if is_foldable(value):
+                        self.set(index, IR_CONST, dests[index], value)
+                        temps[dests[index]] = value
+            elif opcode in IR_UNARY_OPS:
+                if args1[index] in temps:
+                    value = UNARY_OPERATIONS[opcode](temps[args1[index]])
+                    if is_foldable(value):
+                        self.set(index, IR_CONST, dests[index], value)
+                        temps[dests[index]] = value
+            elif opcode == IR_IF_FALSE:
+                if args1[index] in temps:
+                    if is_true(temps[args1[index]]):
+                        self.remove(index)
+                    else:
+                        self.set(index, IR_GOTO, None, args2[index])
+                        variables.clear()
+            elif opcode == IR_CALL:
+                for name in function_stores: variables.pop(name, None)
+            elif opcode == IR_FUNC:
+                outer.append(variables)
+                variables = {}
+            elif opcode == IR_RET:
+                variables = outer.pop()
+                for name in function_stores: variables.pop(name, None)
+            elif opcode is not None:
+                variables.clear()
+
+    def remove_unreachable_code(self):
+        # Follows control flow from the program start and every function
+        # entry. Labels nothing jumps to are dropped as well.
+        opcodes, args1, args2 = self.opcodes, self.args1, self.args2
+        size = len(opcodes)
+        function_ends = self.get_function_ends()
+        labels = {}
+        targets = set()
+        for index in range(size):
+            if opcodes[index] == IR_LABEL: labels[args1[index]] = index
+            elif opcodes[index] == IR_GOTO: targets.add(args1[index])
+            elif opcodes[index] == IR_IF_FALSE: targets.add(args2[index])
+
+        reached = [False] * size
+        pending = [0] + [index + 1 for index in function_ends]
+        while pending:
+            index = pending.pop()
+            while index < size and not reached[index]:
+                reached[index] = True
+                opcode = opcodes[index]
+                if opcode == IR_GOTO:
+                    pending.append(labels[args1[index]])
+                    break
+                elif opcode == IR_IF_FALSE:
+                    pending.append(labels[args2[index]])
+                elif opcode == IR_FUNC:
+                    index = function_ends[index]
+                elif opcode == IR_RET:
+                    break
+                index += 1
+
+        last = None
+        for index in range(size):
+            opcode = opcodes[index]
+            if opcode is None: continue
+
+            if not reached[index] and opcode != IR_FUNC and opcode != IR_RET:
+                self.remove(index)
+                continue
+            if opcode == IR_LABEL:
+                if args1[index] not in targets:
+                    self.remove(index)
+                    continue
+                # A jump straight to the next instruction is dropped
+                if last is not None and opcodes[last] in (IR_GOTO, IR_IF_FALSE):
+                    target = args1[last] if opcodes[last] == IR_GOTO else args2[last]
+                    if target == args1[index]: self.remove(last)
+            last = index
+
+    def remove_dead_stores(self):
+        # A store is dead if its variable is never loaded, or if the variable
+        # is stored again before anything could observe it
+        opcodes, dests, args1 = self.opcodes, self.dests, self.args1
+        loaded = {args1[index] for index in range(len(opcodes)) if opcodes[index] == IR_LOAD}
+        pending = {}
+
+        for index in range(len(opcodes)):
+            opcode = opcodes[index]
+            if opcode == IR_STORE:
+                if dests[index] not in loaded:
+                    self.remove(index)
+                    continue
+                if dests[index] in pending: self.remove(pending[dests[index]])
+                pending[dests[index]] = index
+            elif opcode == IR_LOAD:
+                pending.pop(args1[index], None)
+            elif opcode is not None and opcode not in PURE_OPS:
+                pending.clear()
+
+    def remove_dead_temps(self):
+        opcodes, dests = self.opcodes, self.dests
+        uses = {}
+        definitions = {}
+        for index in range(len(opcodes)):
+            if opcodes[index] in PURE_OPS: definitions[dests[index]] = index
+            for temp in self.get_temp_uses(index):
+                uses[temp] = uses.get(temp, 0) + 1
+
+        pending = [index for temp, index in definitions.items() if temp not in uses]
+        while pending:
+            index = pending.pop()
+            operands = self.get_temp_uses(index)
+            self.remove(index)
+            for temp in operands:
+                uses[temp] -= 1
+                if uses[temp] == 0 and temp in definitions: pending.append(definitions[temp])
+
+    def remove_dead_code(self):
+        self.remove_unreachable_code()
+        self.remove_dead_stores()
+        self.remove_dead_temps()
+
+    def count(self):
+        return len(self.opcodes) - self.opcodes.count(None)
+
+##################################################
+# AST FOLDING
+##################################################
+
+# Operators that give a number whenever they succeed
+NUMERIC_OPS = {IR_SUB, IR_MUL, IR_DIV, IR_MOD, IR_EE, IR_NE, IR_LT, IR_GT, IR_LTE, IR_GTE}
+BOOLEAN_OPS = {IR_EE, IR_NE, IR_LT, IR_GT, IR_LTE, IR_GTE}
+
+def get_literal(node):
+    if isinstance(node, (NumberNode, StringNode)): return node.token.value
+    return None
+
+def make_literal(value, node):
+    # The literal spans the source of the expression it replaces
+    if type(value) == str:
+        return StringNode(Token(TOKEN_STRING, value, node.start, node.end, node.source))
+    type_ = TOKEN_INT if type(value) == int else TOKEN_FLOAT
+    return NumberNode(Token(type_, value, node.start, node.end, node.source))
+
+def is_numeric(node):
+    # True when node can only evaluate to a number
+    if isinstance(node, NumberNode): return True
+    if isinstance(node, BinOpNode):
+        op = node.get_op_symbol()
+        if op in NUMERIC_OPS: return True
+        return op in (IR_ADD, IR_AND, IR_OR) and is_numeric(node.left_node) and is_numeric(node.right_node)
+    if isinstance(node, UnaryOpNode):
+        return node.op_token.type != TOKEN_PLUS or is_numeric(node.node)
+    return False
+
+def is_boolean(node):
+    # True when node can only evaluate to 1 or 0
+    if isinstance(node, NumberNode): return node.token.value in (0, 1) and type(node.token.value) == int
+    if isinstance(node, BinOpNode): return node.get_op_symbol() in BOOLEAN_OPS
+    if isinstance(node, UnaryOpNode): return node.op_token.type == TOKEN_NOT
+    return False
+
+def is_pure(node):
+    # Both operands of && and || are always evaluated, so one can only be
+    # dropped when evaluating it cannot call anything
+    if isinstance(node, (NumberNode, StringNode, VarAccessNode)): return True
+    if isinstance(node, BinOpNode): return is_pure(node.left_node) and is_pure(node.right_node)
+    if isinstance(node, UnaryOpNode): return is_pure(node.node)
+    return False
+
+def is_int(value, number):
+    return type(value) == int and value == number
+
+class ASTFolder:
+    # Rewrites the tree in place, replacing operator subtrees over literals
+    # with literals and dropping operations that cannot change the value.
+    # Identities such as x*1 only apply when x is known to be a number, as
+    # they would otherwise hide a type error.
+    #
+    # The fold_ methods are generators that yield each child to fold, are
+    # sent it folded and return the folded node. fold runs them from a
+    # stack instead of recursing, so trees as deep as the parser builds fold.
+    def fold(self, node):
+        stack = []
+        folded = None
+        while True:
+            if node is not DONE:
+                method = getattr(self, f'fold_{type(node).__name__}', None)
+                if method is None:
+                    folded = node
+                else:
+                    stack.append(method(node))
+                    folded = None
+            if not stack: return folded
+            try:
+                node = stack[-1].send(folded)
+            except StopIteration as stop:
+                stack.pop()
+                node = DONE
+                folded = stop.value
+
+    def fold_condition(self, node):
+        # Only truthiness matters here, so !!x is as good as x
+        node = yield node
+        while isinstance(node, UnaryOpNode) and node.op_token.type == TOKEN_NOT \
+                and isinstance(node.node, UnaryOpNode) and node.node.op_token.type == TOKEN_NOT:
+            node = node.node.node
+        return node
+
+    def fold_VarAssignNode(self, node):
+        node.value_node = yield node.value_node
+        return node
+
+    def fold_BinOpNode(self, node):
+        left = node.left_node = yield node.left_node
+        right = node.right_node = yield node.right_node
+        left_value = get_literal(left)
+        right_value = get_literal(right)
+        op = node.get_op_symbol()
+
+        if left_value is not None and right_value is not None:
+            value = BINARY_OPERATIONS[op](left_value, right_value)
+            if is_foldable(value): return make_literal(value, node)
+            return node
+
+        if op == IR_AND or op == IR_OR:
+            # A literal left operand decides which operand is the result
+            if left_value is not None:
+                if is_true(left_value) == (op == IR_AND): return right
+                if is_pure(right): return left
+        elif op == IR_ADD:
+            if is_int(right_value, 0) and is_numeric(left): return left
+            if is_int(left_value, 0) and is_numeric(right): return right
+        elif op == IR_SUB:
+            if is_int(right_value, 0) and is_numeric(left): return left
+        elif op == IR_MUL:
+            if is_int(right_value, 1) and is_numeric(left): return left
+            if is_int(left_value, 1) and is_numeric(right): return right
+        elif op == IR_DIV:
+            if is_int(right_value, 1) and is_numeric(left): return left
+        return node
+
+    def fold_UnaryOpNode(self, node):
+        inner = node.node = yield node.node
+        op_type = node.op_token.type
+        # Unary plus emits no code of its own
+        if op_type == TOKEN_PLUS: return inner
+
+        value = get_literal(inner)
+        if value is not None:
+            value = UNARY_OPERATIONS[IR_NOT if op_type == TOKEN_NOT else IR_NEG](value)
+            if is_foldable(value): return make_literal(value, node)
+            return node
+
+        if isinstance(inner, UnaryOpNode) and inner.op_token.type == op_type:
+            if op_type == TOKEN_NOT and is_boolean(inner.node): return inner.node
+            if op_type != TOKEN_NOT and is_numeric(inner.node): return inner.node
+        return node
+
+    def fold_IfNode(self, node):
+        cases = []
+        for condition, body in node.cases:
+            condition = yield from self.fold_condition(condition)
+            cases.append((condition, (yield body)))
+        node.cases = cases
+        if node.else_case: node.else_case = yield node.else_case
+        return node
+
+    def fold_ForNode(self, node):
+        node.expr_node = yield node.expr_node
+        node.comp_expr_node = yield from self.fold_condition(node.comp_expr_node)
+        node.arith_expr_node = yield node.arith_expr_node
+        node.body_node = yield node.body_node
+        return node
+
+    def fold_WhileNode(self, node):
+        node.condition_node = yield from self.fold_condition(node.condition_node)
+        node.body_node = yield node.body_node
+        return node
+
+    def fold_FuncDefNode(self, node):
+        node.body_node = yield node.body_node
+        return node
+
+    def fold_CallNode(self, node):
+        arg_nodes = []
+        for arg_node in node.arg_nodes: arg_nodes.append((yield arg_node))
+        node.arg_nodes = arg_nodes
+        return node
+
+    def fold_ListNode(self, node):
+        element_nodes = []
+        for element_node in node.element_nodes: element_nodes.append((yield element_node))
+        node.element_nodes = element_nodes
+        return node
+
+def fold_ast(node):
+    if node == None: return node
+    return ASTFolder().fold(node)
+
+##################################################
+# OPTIMIZE
+##################################################
+
+def is_foldable(value):
+    # Results that the IC cannot print as a literal are left to run time
+    if value is None: return False
+    if type(value) == float: return math.isfinite(value)
+    return True
+
+def optimize(instructions, optimization_level=1):
+    # 1: constant propagation and dead-code elimination; main.run also folds
+    #    the AST with fold_ast at this level
+    # 2: also numbers values within blocks, then renumbers temps and labels
+    #    compactly
+    if optimization_level <= 0: return instructions
+    optimizer = Optimizer(instructions)
+
+    # Folding a branch can merge blocks and expose more constants, so
+    # repeat until nothing changes
+    count = None
+    while count != optimizer.count():
+        count = optimizer.count()
+        optimizer.propagate_constants()
+        optimizer.remove_dead_code()
+
+    instructions = optimizer.get_instructions()
+    if optimization_level >= 2:
+        # Forwarded loads can leave stores and temps without uses
+        optimizer = Optimizer(number_values(instructions))
+        optimizer.remove_dead_code()
+        instructions = renumber_temps(optimizer.get_instructions())
+    return instructions
+
+##################################################
+# VALUE NUMBERING
+##################################################
+
+# Operators whose operands can be swapped without changing the result
+COMMUTATIVE_OPS = {IR_MUL, IR_EE, IR_NE}
+
+def number_values(instructions):
+    # Local value numbering. Within each basic block an instruction that
+    # computes a value already held by an earlier temp is dropped and its
+    # temp replaced by the earlier one. Temps are assigned once, so the
+    # replacement holds everywhere the dropped temp was used. A store makes
+    # the stored temp the value of later loads of that variable, and a call
+    # forgets the loads of every variable a function might assign.
+    cfg = ControlFlowGraph(instructions)
+    opcodes, dests, args1, args2 = cfg.opcodes, instructions.dests, instructions.args1, instructions.args2
+    function_stores = get_function_stores(opcodes, dests)
+    replaced = {}
+    dropped = set()
+
+    for block in cfg:
+        values = {}
+        loads = {}
+        for index in range(block.start, block.end):
+            opcode = opcodes[index]
+
+            if opcode == IR_CONST:
+                key = (opcode, type(args1[index]), repr(args1[index]))
+            elif opcode in IR_BINARY_OPS:
+                left = replaced.get(args1[index], args1[index])
+                right = replaced.get(args2[index], args2[index])
+                if opcode in COMMUTATIVE_OPS and right < left: left, right = right, left
+                key = (opcode, left, right)
+            elif opcode in IR_UNARY_OPS:
+                key = (opcode, replaced.get(args1[index], args1[index]))
+            elif opcode == IR_LOAD:
+                if args1[index] in loads:
+                    replaced[dests[index]] = loads[args1[index]]
+                    dropped.add(index)
+                else:
+                    loads[args1[index]] = dests[index]
+                continue
+            elif opcode == IR_STORE:
+                loads[dests[index]] = replaced.get(args1[index], args1[index])
+                continue
+            elif opcode == IR_CALL:
+                for name in function_stores: loads.pop(name, None)
+                continue
+            else:
+                continue
+
+            if key in values:
+                replaced[dests[index]] = values[key]
+                dropped.add(index)
+            else:
+                values[key] = dests[index]
+
+    numbered = InstructionList()
+    for index, (opcode, dest, arg1, arg2) in enumerate(instructions.fields()):
+        if index in dropped: continue
+        if opcode in IR_BINARY_OPS:
+            arg1 = replaced.get(arg1, arg1)
+            arg2 = replaced.get(arg2, arg2)
+        elif opcode in IR_UNARY_OPS or opcode == IR_STORE or opcode == IR_IF_FALSE:
+            arg1 = replaced.get(arg1, arg1)
+        elif opcode == IR_CALL:
+            arg2 = tuple(replaced.get(temp, temp) for temp in arg2)
+        numbered.add(opcode, dest, arg1, arg2)
+
+    return numbered
+
+##################################################
+# RENUMBERING
+##################################################
+
+def renumber_temps(instructions):
+    # Linear scan over live intervals: a temp's interval spans every point
+    # where liveness says it is live, and its number is recycled once the
+    # interval ends. Temps still live after a call keep a number of their
+    # own, since the called function's temps may be numbered like anything
+    # else. Labels are numbered separately, in order.
+    cfg = ControlFlowGraph(instructions)
+    liveness = Liveness(cfg)
+    starts = {}
+    ends = {}
+    pinned = set()
+
+    def extend(temp, index):
+        if temp not in starts or index < starts[temp]: starts[temp] = index
+        if temp not in ends or index > ends[temp]: ends[temp] = index
+
+    for block in cfg:
+        for temp in liveness.live_in[block.index]: extend(temp, block.start)
+        for temp in liveness.live_out[block.index]: extend(temp, block.end - 1)
+        for index, live in liveness.get_live_after(block):
+            opcode = cfg.opcodes[index]
+            defined = get_temp_def(opcode, instructions.dests[index])
+            if defined is not None: extend(defined, index)
+            for temp in get_temp_uses(opcode, instructions.args1[index], instructions.args2[index]): extend(temp, index)
+            if opcode == IR_CALL: pinned |= live
+
+    numbers = {}
+    free = []
+    active = []
+    count = 0
+    for temp in sorted(starts, key=starts.__getitem__):
+        if temp in pinned: continue
+        start = starts[temp]
+        while active and active[0][0] < start:
+            heapq.heappush(free, heapq.heappop(active)[1])
+        if free:
+            number = heapq.heappop(free)
+        else:
+            number = count
+            count += 1
+        numbers[temp] = number
+        heapq.heappush(active, (ends[temp], number))
+    for temp in sorted(pinned):
+        numbers[temp] = count
+        count += 1
+
+    labels = {}
+    for opcode, dest, arg1, arg2 in instructions.fields():
+        if opcode == IR_LABEL: labels[arg1] = len(labels)
+
+    renumbered = InstructionList()
+    for opcode, dest, arg1, arg2 in instructions.fields():
+        if opcode == IR_LABEL or opcode == IR_GOTO:
+            arg1 = labels[arg1]
+        elif opcode == IR_IF_FALSE:
+            arg1 = numbers[arg1]
+            arg2 = labels[arg2]
+        elif opcode == IR_CALL:
+            arg2 = tuple(numbers[temp] for temp in arg2)
+        elif opcode == IR_STORE:
+            arg1 = numbers[arg1]
+        elif opcode in IR_BINARY_OPS:
+            dest = numbers[dest]
+            arg1 = numbers[arg1]
+            arg2 = numbers[arg2]
+        elif opcode in IR_UNARY_OPS:
+            dest = numbers[dest]
+            arg1 = numbers[arg1]
+        elif opcode == IR_CONST or opcode == IR_LOAD:
+            dest = numbers[dest]
+        renumbered.add(opcode, dest, arg1, arg2)
+
+    return renumbered
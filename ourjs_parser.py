@@ -1,3 +1,4 @@
+from bisect import bisect_left
 from constants import *
 from nodes import *
 
@@ -13,7 +14,6 @@ class ParseResult:
         self.error = None
         self.node = None
         self.advance_count = 0
-        self.to_reverse_count = 0
         self.ast = None
                 
     def register_advancement(self):
@@ -24,12 +24,6 @@ class ParseResult:
             if res.error: self.error = res.error
             return res.node
 
-    def try_register(self, res):
-        if res.error:
-            self.to_reverse_count = res.advance_count
-            return None
-        return self.register(res)
-    
     def success(self, node):
             self.node = node
             return self
@@ -39,42 +33,94 @@ class ParseResult:
                 self.error = error
             return self
 
+##################################################
+# EXPRESSION CONTEXTS
+##################################################
+
+# What an ExpressionContext is parsing
+CONTEXT_ENTRY = 0       # the expression the parser was asked for
+CONTEXT_PAREN = 1       # an expression in parentheses
+CONTEXT_ARGUMENT = 2    # an argument of a call
+CONTEXT_NOT = 3         # the comparison after !
+
+# What may come before the atom of the next operand
+POSITION_EXPRESSION = 0     # let, ! or unary + and -
+POSITION_COMPARISON = 1     # ! or unary + and -
+POSITION_FACTOR = 2         # unary + and -
+
+class ExpressionContext:
+    # An expression, or the comparison after !, being parsed by
+    # Parser.parse_expression. Binary operators of level and above are
+    # part of it and the ones on the stack above operator_base are its own.
+    # expression_start and comparison_start are the token indices at which
+    # the expression and the comparison being parsed began, or None for a
+    # let or a !; let_names are the lets it is the value of.
+    __slots__ = ('kind', 'level', 'operator_base', 'expression_start', 'comparison_start', 'let_names', 'data')
+
+    def __init__(self, kind, level, operator_base, expression_start=None, data=None):
+        self.kind = kind
+        self.level = level
+        self.operator_base = operator_base
+        self.expression_start = expression_start
+        self.comparison_start = None
+        self.let_names = None
+        self.data = data
+
 ##################################################
 # PARSER
 ##################################################
 
 class Parser:
-    def __init__(self, tokens):
+    def __init__(self, tokens, recover=False, max_errors=None, lex_errors=()):
+        # A recovering parser records each error in self.errors, skips the
+        # statement it is in and goes on, stopping once it has max_errors.
+        # lex_errors are those the lexer reported, in order; a statement
+        # that fails after one of them is skipped without another error.
         self.tokens = tokens
         self.token_index = -1
+        self.current_index = 0
+        self.statements_depth = 0
+        self.errors = [] if recover else None
+        self.max_errors = max_errors
+        self.lex_errors = lex_errors
         self.advance()
 
     def advance(self):
         self.token_index += 1
         self.update_current_token()
-        return self.current_token
-    
-    def reverse(self, amount=1):
-        self.token_index -= amount
-        self.update_current_token()
-        return self.current_token
     
     def update_current_token(self):
-        if self.token_index < len(self.tokens):
-                    self.current_token = self.tokens[self.token_index]
+        token_type = self.tokens.get_type(self.token_index)
+        if token_type is not None:
+                    self.current_index = self.token_index
+                    self.current_type = token_type
+
+    @property
+    def current_token(self):
+        # Token objects are only built when a node or an error needs one
+        return self.tokens.token(self.current_index)
+
+    def current_matches(self, type_, value):
+        return self.current_type == type_ and self.tokens.get_value(self.current_index) == value
+
+    def starts_expression(self):
+        # Whether the current token is in the FIRST set of an expression
+        if self.current_type == TOKEN_KEYWORD: return self.tokens.get_value(self.current_index) in EXPRESSION_START_KEYWORDS
+        return self.current_type in EXPRESSION_START_TYPES
     
     def parse(self):
         res = self.statements()
-        if not res.error and self.current_token.type is not TOKEN_EOF:
-            return res.failure(
-                InvalidSyntaxError(
-                self.current_token.pos_start, self.current_token.pos_end,
-                "Expected '+' , '-', '*' or '/'"
-                )
-            )
+        if not res.error and self.current_type != TOKEN_EOF:
+            return res.failure(self.leftover_error())
     
         return res
 
+    def leftover_error(self):
+        return InvalidSyntaxError(
+            self.current_token.pos_start, self.current_token.pos_end,
+            "Expected '+' , '-', '*' or '/'"
+        )
+
     def intermediate_code(self):
         if self.ast == None:
             self.parse()
@@ -87,47 +133,116 @@ class Parser:
     def statements(self):
         res = ParseResult()
         statements = []
-        pos_start = self.current_token.pos_start.copy()
+        start = self.tokens.get_start(self.current_index)
+        self.statements_depth += 1
+        # What is left after a top level statement would end the parse, so
+        # a recovering parser reports it and carries on instead
+        recover_leftovers = self.errors is not None and self.statements_depth == 1
 
-        while self.current_token.type == TOKEN_NEWLINE:
+        while self.current_type == TOKEN_NEWLINE:
             res.register_advancement()
             self.advance()
 
-        statement = res.register(self.expression())
-        if res.error: return res
-        statements.append(statement)
-
-        more_statements = True
+        statement_start = self.tokens.get_start(self.current_index)
+        if not self.statement(res, statements):
+            self.statements_depth -= 1
+            return res
 
         while True:
-            newline_count = 0
-            while self.current_token.type == TOKEN_NEWLINE:
+            if self.statements_depth == 1:
+                # Finished top level statements are never looked at again
+                self.tokens.release(self.token_index)
+            if recover_leftovers and self.current_type not in (TOKEN_NEWLINE, TOKEN_EOF):
+                if not self.recover(res, statements, self.current_index, self.leftover_error(), statement_start):
+                    self.statements_depth -= 1
+                    return res
+            if self.current_type != TOKEN_NEWLINE: break
+            while self.current_type == TOKEN_NEWLINE:
                 res.register_advancement()
                 self.advance()
-                newline_count += 1
-            if newline_count == 0:
-                more_statements = False
-            
-            if not more_statements: break
-            statement = res.try_register(self.expression())
-            if not statement:
-                self.reverse(res.to_reverse_count)
-                more_statements = False
-                continue
-            statements.append(statement)
 
+            # Another statement follows only if its first token can start one
+            if not self.starts_expression():
+                if recover_leftovers: continue
+                break
+            statement_start = self.tokens.get_start(self.current_index)
+            if not self.statement(res, statements):
+                self.statements_depth -= 1
+                return res
+
+        self.statements_depth -= 1
         return res.success(ListNode(
         statements,
-        pos_start,
-        self.current_token.pos_end.copy()
+        start,
+        self.tokens.get_end(self.current_index),
+        self.tokens.source
         ))
 
+    def statement(self, res, statements):
+        # Parses one statement into statements; returns False if the parse stops
+        start_index = self.current_index
+        statement = res.register(self.expression())
+        if res.error:
+            return self.errors is not None and self.recover(res, statements, start_index, res.error)
+        statements.append(statement)
+        return True
+
+    def recover(self, res, statements, start_index, error, statement_start=None):
+        # Records error, skips what is left of the statement that began at
+        # start_index and puts an ErrorNode in its place. Returns False,
+        # leaving error on res, once max_errors have been recorded. An error
+        # the lexer caused is not recorded, see follows_lex_error.
+        # A block that stopped at max_errors has recorded error already
+        if self.max_errors is not None and len(self.errors) >= self.max_errors: return False
+        if statement_start is None: statement_start = self.tokens.get_start(start_index)
+        if not self.follows_lex_error(statement_start, error):
+            self.errors.append(error)
+            if self.max_errors is not None and len(self.errors) >= self.max_errors:
+                res.error = error
+                return False
+
+        res.error = None
+        self.synchronize(res, start_index)
+        end_index = max(start_index, self.current_index - 1)
+        statements.append(ErrorNode(error, self.tokens.get_start(start_index), self.tokens.get_end(end_index), self.tokens.source))
+        return True
+
+    def follows_lex_error(self, statement_start, error):
+        # Whether the lexer skipped characters between the start of the
+        # statement and the end of the token the parse failed at; those are
+        # what broke the statement, so it is reported once. The lexer has
+        # reported them before making that token, so a streaming lexer that
+        # has not read further yet gives the same answer.
+        index = bisect_left(self.lex_errors, statement_start, key=lambda lex_error: lex_error.pos_start.index)
+        return index < len(self.lex_errors) and self.lex_errors[index].pos_start.index < error.pos_end.index
+
+    def synchronize(self, res, start_index):
+        # Advances to the NEWLINE or '}' that ends the statement begun at
+        # start_index, counting the blocks it has opened so far. A '}' that
+        # closes nothing ends a block's statements but is skipped at the top
+        # level, where no block is waiting for it.
+        depth = 0
+        for index in range(start_index, self.current_index):
+            token_type = self.tokens.get_type(index)
+            if token_type == TOKEN_LCURL: depth += 1
+            elif token_type == TOKEN_RCURL: depth -= 1
+
+        while self.current_type != TOKEN_EOF:
+            if self.current_type == TOKEN_NEWLINE and depth == 0: break
+            if self.current_type == TOKEN_LCURL:
+                depth += 1
+            elif self.current_type == TOKEN_RCURL:
+                if depth == 0 and self.statements_depth > 1: break
+                depth = max(depth - 1, 0)
+            res.register_advancement()
+            self.advance()
+
     def if_expr(self):
         res = ParseResult()
         cases = []
         else_case = None
         
-        if not self.current_token.matches(TOKEN_KEYWORD, 'if'):
+        if not self.current_matches(TOKEN_KEYWORD, 'if'):
             return res.failure(InvalidSyntaxError(
 				self.current_token.pos_start, self.current_token.pos_end,
 				f"Expected 'if'"
@@ -136,7 +251,7 @@ class Parser:
         res.register_advancement()
         self.advance()
 
-        if self.current_token.type != TOKEN_LPAREN:
+        if self.current_type != TOKEN_LPAREN:
             return res.failure(InvalidSyntaxError(
                 self.current_token.pos_start, self.current_token.pos_end,
                 f"Expected opening {'('}"
@@ -149,7 +264,7 @@ class Parser:
         if res.error: return res
         
 
-        if self.current_token.type != TOKEN_RPAREN:
+        if self.current_type != TOKEN_RPAREN:
             return res.failure(InvalidSyntaxError(
                 self.current_token.pos_start, self.current_token.pos_end,
                 f"Expected opening ')'"
@@ -159,7 +274,7 @@ class Parser:
         self.advance()
 
         
-        if self.current_token.type != TOKEN_LCURL:
+        if self.current_type != TOKEN_LCURL:
             return res.failure(InvalidSyntaxError(
 				self.current_token.pos_start, self.current_token.pos_end,
 				f"Expected opening {'{'}"
@@ -172,7 +287,7 @@ class Parser:
         if res.error: return res
         cases.append((condition, statements))
         
-        if self.current_token.type != TOKEN_RCURL:
+        if self.current_type != TOKEN_RCURL:
             return res.failure(InvalidSyntaxError(
 				self.current_token.pos_start, self.current_token.pos_end,
 				f"Expected opening {'}'}"
@@ -181,11 +296,11 @@ class Parser:
         res.register_advancement()
         self.advance()
             
-        if self.current_token.matches(TOKEN_KEYWORD, 'else'):
+        if self.current_matches(TOKEN_KEYWORD, 'else'):
             res.register_advancement()
             self.advance()
             
-            if self.current_token.type != TOKEN_LCURL:
+            if self.current_type != TOKEN_LCURL:
                 return res.failure(InvalidSyntaxError(
 					self.current_token.pos_start, self.current_token.pos_end,
 					f"Expected opening {'{'}"
@@ -196,7 +311,7 @@ class Parser:
             else_case = res.register(self.statements())
             if res.error: return res
             
-            if self.current_token.type != TOKEN_RCURL:
+            if self.current_type != TOKEN_RCURL:
                 return res.failure(InvalidSyntaxError(
 					self.current_token.pos_start, self.current_token.pos_end,
 					f"Expected opening {'}'}"
@@ -210,7 +325,7 @@ class Parser:
     def for_expr(self):
         res = ParseResult()
         
-        if not self.current_token.matches(TOKEN_KEYWORD, 'for'):
+        if not self.current_matches(TOKEN_KEYWORD, 'for'):
             return res.failure(InvalidSyntaxError(
 				self.current_token.pos_start, self.current_token.pos_end,
 				f"Expected {'for'}"
@@ -219,7 +334,7 @@ class Parser:
         res.register_advancement()
         self.advance()
 		
-        if self.current_token.type != TOKEN_LPAREN:
+        if self.current_type != TOKEN_LPAREN:
             return res.failure(InvalidSyntaxError(
                 self.current_token.pos_start, self.current_token.pos_end,
                 f"Expected opening {'('}"
@@ -231,7 +346,7 @@ class Parser:
         expression = res.register(self.expression())
         if res.error: return res
         
-        if self.current_token.type != TOKEN_COMMA:
+        if self.current_type != TOKEN_COMMA:
             return res.failure(InvalidSyntaxError(
 				self.current_token.pos_start, self.current_token.pos_end,
 				f"Expected comma {','}"
@@ -243,7 +358,7 @@ class Parser:
         comparative_expression = res.register(self.comp_expression())  
         if res.error: return res
 
-        if self.current_token.type != TOKEN_COMMA:
+        if self.current_type != TOKEN_COMMA:
             return res.failure(InvalidSyntaxError(
 				self.current_token.pos_start, self.current_token.pos_end,
 				f"Expected character {','}"
@@ -255,7 +370,7 @@ class Parser:
         arithmetic_expression = res.register(self.arith_expression())  
         if res.error: return res
         
-        if self.current_token.type != TOKEN_RPAREN:
+        if self.current_type != TOKEN_RPAREN:
             return res.failure(InvalidSyntaxError(
                 self.current_token.pos_start, self.current_token.pos_end,
                 "Expected closing ')'"
@@ -264,7 +379,7 @@ class Parser:
         res.register_advancement()
         self.advance()
         
-        if self.current_token.type != TOKEN_LCURL:
+        if self.current_type != TOKEN_LCURL:
                 return res.failure(InvalidSyntaxError(
 					self.current_token.pos_start, self.current_token.pos_end,
 					f"Expected opening {'{'}"
@@ -276,7 +391,7 @@ class Parser:
         body = res.register(self.statements())
         if  res.error: return res
             
-        if self.current_token.type != TOKEN_RCURL:
+        if self.current_type != TOKEN_RCURL:
                 return res.failure(InvalidSyntaxError(
 					self.current_token.pos_start, self.current_token.pos_end,
 					f"Expected closing {'}'}"
@@ -289,7 +404,7 @@ class Parser:
     def while_expr(self):
         res = ParseResult()
         
-        if not self.current_token.matches(TOKEN_KEYWORD, 'while'):
+        if not self.current_matches(TOKEN_KEYWORD, 'while'):
             return res.failure(InvalidSyntaxError(
 				self.current_token.pos_start, self.current_token.pos_end,
 				f"Expected {'while'}"
@@ -298,7 +413,7 @@ class Parser:
         res.register_advancement()
         self.advance()
         
-        if self.current_token.type != TOKEN_LPAREN:
+        if self.current_type != TOKEN_LPAREN:
             return res.failure(InvalidSyntaxError(
                 self.current_token.pos_start, self.current_token.pos_end,
                 f"Expected opening {'('}"
@@ -310,7 +425,7 @@ class Parser:
         condition = res.register(self.expression())
         if res.error: return res
         
-        if self.current_token.type != TOKEN_RPAREN:
+        if self.current_type != TOKEN_RPAREN:
             return res.failure(InvalidSyntaxError(
                 self.current_token.pos_start, self.current_token.pos_end,
                 f"Expected closing {')'}"
@@ -319,7 +434,7 @@ class Parser:
         res.register_advancement()
         self.advance()
         
-        if self.current_token.type != TOKEN_LCURL:
+        if self.current_type != TOKEN_LCURL:
                 return res.failure(InvalidSyntaxError(
 					self.current_token.pos_start, self.current_token.pos_end,
 					f"Expected opening {'{'}"
@@ -331,7 +446,7 @@ class Parser:
         body = res.register(self.statements())
         if  res.error: return res
             
-        if self.current_token.type != TOKEN_RCURL:
+        if self.current_type != TOKEN_RCURL:
                 return res.failure(InvalidSyntaxError(
 					self.current_token.pos_start, self.current_token.pos_end,
 					f"Expected closing {'}'}"
@@ -341,193 +456,186 @@ class Parser:
         
         return res.success(WhileNode(condition, body))
         
-    def call(self):
-        res = ParseResult()
-        atom = res.register(self.atom())
-        if res.error: return res
-
-        if self.current_token.type == TOKEN_LPAREN:
-            res.register_advancement()
-            self.advance()
-            arg_nodes = []
-
-            if self.current_token.type == TOKEN_RPAREN:
-                res.register_advancement()
-                self.advance()
-            else:
-                arg_nodes.append(res.register(self.expression()))
-                if res.error:
-                    return res.failure(InvalidSyntaxError(
-                        self.current_token.pos_start, self.current_token.pos_end,
-                        "Expected ')', 'let', 'if', 'for', 'while', 'func', int, float, identifier,  '+', '-', '(' or 'NOT'"
-                    ))
-                
-                while self.current_token.type == TOKEN_COMMA:
-                    res.register_advancement()
-                    self.advance()
-
-                    arg_nodes.append(res.register(self.expression()))
-                    if res.error: return res
-
-                if self.current_token.type != TOKEN_RPAREN:
-                    return res.failure(InvalidSyntaxError(
-                        self.current_token.pos_start, self.current_token.pos_end,
-                        f"Expected ',' or ')'"
-                    ))
-                
-                res.register_advancement()
-                self.advance()
-            return res.success(CallNode(atom, arg_nodes))
-        return res.success(atom)
-
-    def atom(self):
-            res = ParseResult()
-            token = self.current_token
-
-            if token.type == TOKEN_IDENTIFIER:
-                res.register_advancement
-                self.advance()
-                return res.success(VarAccessNode(token))
-
-            elif  token.type in (TOKEN_INT, TOKEN_FLOAT):
-                res.register_advancement
-                self.advance()
-                return res.success(NumberNode(token))
-            
-            elif  token.type in (TOKEN_STRING):
-                res.register_advancement
-                self.advance()
-                return res.success(StringNode(token))
-            
-            elif token.type == TOKEN_LPAREN:
-                res.register_advancement
-                self.advance()
-                expr = res.register(self.expression())
-                if res.error : return res
-                if self.current_token.type == TOKEN_RPAREN:
-                        res.register_advancement
-                        self.advance()
-                        return res.success(expr)
-                else:
-                    return res.failure(
-                        InvalidSyntaxError(
-                            self.current_token.pos_start, self.current_token.pos_end,
-                            f"Expected {')'}"
-                        )
-                    )
-            
-            elif token.matches(TOKEN_KEYWORD, 'if'):
-                if_expr = res.register(self.if_expr())
-                if res.error: return res
-                return res.success(if_expr)
-            
-            elif token.matches(TOKEN_KEYWORD, 'for'):
-                 for_expr = res.register(self.for_expr())
-                 if res.error: return res
-                 return res.success(for_expr)
-            
-            elif token.matches(TOKEN_KEYWORD, 'while'):
-                while_expr = res.register(self.while_expr())
-                if res.error: return res
-                return res.success(while_expr)
-            
-            elif token.matches(TOKEN_KEYWORD, 'func'):
-                func_def = res.register(self.func_def())
-                if res.error: return res
-                return res.success(func_def)
-            
-            return res.failure(
-                InvalidSyntaxError(token.pos_start, token.pos_end, "Expected number, identifier, 'if', 'for', 'while', 'func'")
-            )
-    
-    def factor(self):
-            res = ParseResult()
-            token = self.current_token
+    def expression(self):
+        return self.parse_expression(PRECEDENCE_LOGIC)
 
-            if token.type in  (TOKEN_PLUS, TOKEN_MINUS):
-                res.register_advancement
-                self.advance()
-                factor = res.register(self.factor())
-                if res.error: return res
-                return res.success(UnaryOpNode(token, factor))
-            
-            return self.call()
+    def comp_expression(self):
+        return self.parse_expression(PRECEDENCE_COMPARISON)
 
-    def term(self):
-            return self.binary_op(self.factor, (TOKEN_MUL, TOKEN_DIV))
-    
     def arith_expression(self):
-        return self.binary_op(self.term, (TOKEN_PLUS, TOKEN_MINUS))
-    
-    def comp_expression(self):
+        return self.parse_expression(PRECEDENCE_ARITHMETIC)
+
+    def parse_expression(self, level):
+        # Parses the operators of level and above by precedence climbing over
+        # explicit stacks, so parentheses, calls and unary chains nest as
+        # deep as memory allows. The trees are the ones a method per
+        # precedence level (expression -> comp_expression ->
+        # arith_expression -> term -> factor -> call -> atom) would build.
         res = ParseResult()
+        entry_index = self.token_index
+        # Left operands waiting for their right one, and their operators as
+        # (token, precedence) with None for unary + and -
+        operands = []
+        operators = []
+        contexts = []
+        context = ExpressionContext(CONTEXT_ENTRY, level, 0, entry_index if level == PRECEDENCE_LOGIC else None)
+        if level == PRECEDENCE_LOGIC: position = POSITION_EXPRESSION
+        elif level == PRECEDENCE_COMPARISON: position = POSITION_COMPARISON
+        else: position = POSITION_FACTOR
 
-        if self.current_token.type == TOKEN_NOT:
-            op_token = self.current_token
-            res.register_advancement()
-            self.advance()
-
-            node = res.register(self.comp_expression())
-            if res.error: return res
-            return res.success(UnaryOpNode(op_token,node))
-        
-        node = res.register(self.binary_op(self.arith_expression, (TOKEN_EE, TOKEN_NE, TOKEN_LT, TOKEN_GT, TOKEN_LTE, TOKEN_GTE)))
-
-        if res.error:
-            return res.failure(InvalidSyntaxError(
-                self.current_token.pos_start, self.current_token.pos_end,
-                "Expected int, float, identifier, '+', '-', '(' or '!'"
-            ))
-        
-        return res.success(node)
-
-
-    def expression(self):
-            res = ParseResult()
+        while True:
+            # Whatever may come before the next atom
+            while True:
+                token_type = self.current_type
+                if position == POSITION_EXPRESSION and token_type == TOKEN_KEYWORD and self.current_matches(TOKEN_KEYWORD, 'let'):
+                    # The value is a new expression and the lets wrap it
+                    context.expression_start = None
+                    self.advance()
+                    if self.current_type != TOKEN_IDENTIFIER:
+                        return self.expression_failure(res, entry_index, contexts, context, "Expected identifier")
+                    if context.let_names is None: context.let_names = []
+                    context.let_names.append(self.current_token)
+                    self.advance()
+                    if self.current_type != TOKEN_EQ:
+                        return self.expression_failure(res, entry_index, contexts, context, "Expected '='")
+                    self.advance()
+                    context.expression_start = self.token_index
+                    continue
+
+                if position != POSITION_FACTOR:
+                    if token_type == TOKEN_NOT:
+                        # ! takes a whole comparison
+                        context.comparison_start = None
+                        op_token = self.current_token
+                        self.advance()
+                        contexts.append(context)
+                        context = ExpressionContext(CONTEXT_NOT, PRECEDENCE_COMPARISON, len(operators), None, op_token)
+                        position = POSITION_COMPARISON
+                        continue
+                    context.comparison_start = self.token_index
+                    position = POSITION_FACTOR
+
+                if token_type == TOKEN_PLUS or token_type == TOKEN_MINUS:
+                    operators.append((self.current_token, None))
+                    self.advance()
+                    continue
+                break
 
-            if self.current_token.matches(TOKEN_KEYWORD, 'let'):
-                res.register_advancement
+            # The atom
+            if token_type == TOKEN_IDENTIFIER:
+                node = VarAccessNode(self.current_token)
                 self.advance()
-
-                if self.current_token.type != TOKEN_IDENTIFIER:
-                    return res.failure(InvalidSyntaxError(
-                        self.current_token.pos_start, self.current_token.pos_end,
-                        "Expected identifier"
-                    ))
-                
-                var_name = self.current_token
-                res.register_advancement
+            elif token_type == TOKEN_INT or token_type == TOKEN_FLOAT:
+                node = NumberNode(self.current_token)
                 self.advance()
-
-                if self.current_token.type != TOKEN_EQ:
-                    return res.failure(InvalidSyntaxError(
-                        self.current_token.pos_start, self.current_token.pos_end,
-                        "Expected '='"
-                    ))
-                
-                res.register_advancement
+            elif token_type == TOKEN_STRING:
+                node = StringNode(self.current_token)
                 self.advance()
-                expression = res.register(self.expression())
-                if res.error: return res
-                return res.success(VarAssignNode(var_name, expression))
-
-            node = res.register(self.binary_op(
-                self.comp_expression, 
-                ((TOKEN_AND), (TOKEN_OR))
-                ))
-
-            if res.error: 
-                return res.failure(InvalidSyntaxError(
-                    self.current_token.pos_start, self.current_token.pos_end,
-                    "Expected let, if, for, while, func, number or identifier"
-                ))
+            elif token_type == TOKEN_LPAREN:
+                self.advance()
+                contexts.append(context)
+                context = ExpressionContext(CONTEXT_PAREN, PRECEDENCE_LOGIC, len(operators), self.token_index)
+                position = POSITION_EXPRESSION
+                continue
+            else:
+                block_parser = BLOCK_PARSERS.get(self.tokens.get_value(self.current_index)) if token_type == TOKEN_KEYWORD else None
+                if block_parser is None:
+                    return self.expression_failure(res, entry_index, contexts, context, "Expected number, identifier, 'if', 'for', 'while', 'func'")
+                block = block_parser(self)
+                if block.error:
+                    res.advance_count = self.token_index - entry_index
+                    return res.failure(block.error)
+                node = block.node
+
+            # node is an atom, which may be called once, and then operators
+            # and the ends of contexts follow until another operand is needed
+            callable_node = True
+            while True:
+                if callable_node and self.current_type == TOKEN_LPAREN:
+                    self.advance()
+                    if self.current_type != TOKEN_RPAREN:
+                        contexts.append(context)
+                        context = ExpressionContext(CONTEXT_ARGUMENT, PRECEDENCE_LOGIC, len(operators), self.token_index, (node, []))
+                        position = POSITION_EXPRESSION
+                        break
+                    self.advance()
+                    node = CallNode(node, [])
+                callable_node = False
+
+                operator_base = context.operator_base
+                while len(operators) > operator_base and operators[-1][1] is None:
+                    node = UnaryOpNode(operators.pop()[0], node)
+
+                precedence = BINARY_PRECEDENCE.get(self.current_type)
+                if precedence is not None and precedence >= context.level:
+                    while len(operators) > operator_base and operators[-1][1] >= precedence:
+                        node = BinOpNode(operands.pop(), operators.pop()[0], node)
+                    operands.append(node)
+                    operators.append((self.current_token, precedence))
+                    self.advance()
+                    position = POSITION_COMPARISON if precedence == PRECEDENCE_LOGIC else POSITION_FACTOR
+                    break
+
+                # The context is complete
+                while len(operators) > operator_base:
+                    node = BinOpNode(operands.pop(), operators.pop()[0], node)
+                if context.let_names is not None:
+                    for var_name in reversed(context.let_names):
+                        node = VarAssignNode(var_name, node)
+
+                kind = context.kind
+                if kind == CONTEXT_ENTRY:
+                    res.advance_count = self.token_index - entry_index
+                    return res.success(node)
+
+                if kind == CONTEXT_NOT:
+                    node = UnaryOpNode(context.data, node)
+                    context = contexts.pop()
+
+                elif kind == CONTEXT_PAREN:
+                    context = contexts.pop()
+                    if self.current_type != TOKEN_RPAREN:
+                        return self.expression_failure(res, entry_index, contexts, context, "Expected ')'")
+                    self.advance()
+                    callable_node = True
 
-            return res.success(node)
+                else:
+                    callee, arg_nodes = context.data
+                    arg_nodes.append(node)
+                    if self.current_type == TOKEN_COMMA:
+                        self.advance()
+                        context = ExpressionContext(CONTEXT_ARGUMENT, PRECEDENCE_LOGIC, len(operators), self.token_index, context.data)
+                        position = POSITION_EXPRESSION
+                        break
+                    context = contexts.pop()
+                    if self.current_type != TOKEN_RPAREN:
+                        return self.expression_failure(res, entry_index, contexts, context, "Expected ',' or ')'")
+                    self.advance()
+                    node = CallNode(callee, arg_nodes)
+
+    def expression_failure(self, res, entry_index, contexts, context, details):
+        # An expression or comparison that stops before taking any token
+        # reports what it expected itself; the outermost of those starting
+        # at the current token wins. The error is only built once its
+        # message is settled.
+        index = self.token_index
+        for open_context in contexts + [context]:
+            if open_context.expression_start == index:
+                details = "Expected let, if, for, while, func, number or identifier"
+                break
+            if open_context.comparison_start == index:
+                details = "Expected int, float, identifier, '+', '-', '(' or '!'"
+                break
+        res.advance_count = index - entry_index
+        return res.failure(InvalidSyntaxError(
+            self.current_token.pos_start, self.current_token.pos_end,
+            details
+        ))
 
     def func_def(self):
         res = ParseResult()
 
-        if not self.current_token.matches(TOKEN_KEYWORD, 'func'):
+        if not self.current_matches(TOKEN_KEYWORD, 'func'):
             return res.failure(InvalidSyntaxError(
                 self.current_token.pos_start, self.current_token.pos_end,
                 f"Expected 'func'"
@@ -536,11 +644,11 @@ class Parser:
         res.register_advancement()
         self.advance()
 
-        if self.current_token.type == TOKEN_IDENTIFIER:
+        if self.current_type == TOKEN_IDENTIFIER:
             var_name_token = self.current_token
             res.register_advancement()
             self.advance()
-            if self.current_token.type != TOKEN_LPAREN:
+            if self.current_type != TOKEN_LPAREN:
                 return res.failure(InvalidSyntaxError(
                     self.current_token.pos_start, self.current_token.pos_end,
                     f"Expected '('"
@@ -555,16 +663,16 @@ class Parser:
         self.advance()
         arg_name_tokens = []
 
-        if self.current_token.type == TOKEN_IDENTIFIER:
+        if self.current_type == TOKEN_IDENTIFIER:
             arg_name_tokens.append(self.current_token)
             res.register_advancement()
             self.advance()
 
-            while self.current_token.type == TOKEN_COMMA:
+            while self.current_type == TOKEN_COMMA:
                 res.register_advancement()
                 self.advance()
 
-                if self.current_token.type != TOKEN_IDENTIFIER:
+                if self.current_type != TOKEN_IDENTIFIER:
                     return res.failure(InvalidSyntaxError(
                         self.current_token.pos_start, self.current_token.pos_end,
                         f"Expected identifier"
@@ -573,14 +681,14 @@ class Parser:
                 res.register_advancement()
                 self.advance()
 
-            if self.current_token.type != TOKEN_RPAREN:
+            if self.current_type != TOKEN_RPAREN:
                 return res.failure(InvalidSyntaxError(
                     self.current_token.pos_start, self.current_token.pos_end,
                     f"Expected ',' or ')'"
                 ))
             
         else:
-            if self.current_token.type != TOKEN_RPAREN:
+            if self.current_type != TOKEN_RPAREN:
                 return res.failure(InvalidSyntaxError(
                     self.current_token.pos_start, self.current_token.pos_end,
                     f"Expected identifier or ')'"
@@ -589,7 +697,7 @@ class Parser:
         res.register_advancement()
         self.advance()
 
-        if self.current_token.type != TOKEN_LCURL:
+        if self.current_type != TOKEN_LCURL:
             return res.failure(InvalidSyntaxError(
                 self.current_token.pos_start, self.current_token.pos_end,
                 f"Expected {'{'}"
@@ -600,7 +708,7 @@ class Parser:
         node_to_return = res.register(self.statements())
         if res.error: return res
 
-        if self.current_token.type != TOKEN_RCURL:
+        if self.current_type != TOKEN_RCURL:
             return res.failure(InvalidSyntaxError(
 				self.current_token.pos_start, self.current_token.pos_end,
 				f"Expected closing {'}'}"
@@ -614,20 +722,18 @@ class Parser:
             arg_name_tokens,
             node_to_return
         ))
-    
-    def binary_op(self, func_a, ops, func_b=None):
 
-        if func_b == None:
-            func_b = func_a
-
-        res = ParseResult()
-        left = res.register(func_a())
-        if res.error: return res
-        while self.current_token.type in ops:
-            op_token = self.current_token
-            res.register_advancement
-            self.advance()
-            right = res.register(func_b())
-            if res.error: return res
-            left = BinOpNode(left, op_token, right)
-        return res.success(left)
+# Blocks that may stand in place of an atom
+BLOCK_PARSERS = {
+    'if': Parser.if_expr,
+    'for': Parser.for_expr,
+    'while': Parser.while_expr,
+    'func': Parser.func_def
+}
+
+# FIRST set of an expression, and so of a statement
+EXPRESSION_START_TYPES = {
+    TOKEN_INT, TOKEN_FLOAT, TOKEN_STRING, TOKEN_IDENTIFIER,
+    TOKEN_LPAREN, TOKEN_NOT, TOKEN_PLUS, TOKEN_MINUS
+}
+EXPRESSION_START_KEYWORDS = {'let'} | set(BLOCK_PARSERS)
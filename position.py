@@ -1,24 +1,105 @@
+from bisect import bisect_right
+
+##################################################
+# SOURCE FILE
+##################################################
+
+class SourceFile:
+    # text is either a str or a bytes-like buffer (bytes, mmap) of UTF-8;
+    # offsets index into it directly and columns are reported in characters
+    def __init__(self, file_name, text):
+        self.file_name = file_name
+        self.text = text
+        self.is_str = isinstance(text, str)
+        self.newline = '\n' if self.is_str else b'\n'
+        self.line_starts = None
+
+    def get_line_starts(self):
+        # Only error reporting needs lines, so the table is built on first use
+        if self.line_starts is None:
+            line_starts = [0]
+            text = self.text
+            newline = self.newline
+            index = text.find(newline)
+            while index >= 0:
+                line_starts.append(index + 1)
+                index = text.find(newline, index + 1)
+            self.line_starts = line_starts
+        return self.line_starts
+
+    def replace(self, start, length, text):
+        # Replaces length characters at start, updating the line table if
+        # it has been built
+        delta = len(text) - length
+        self.text = self.text[:start] + text + self.text[start + length:]
+        if self.line_starts is None: return
+
+        line_starts = self.line_starts
+        first = bisect_right(line_starts, start)
+        last = bisect_right(line_starts, start + length)
+        inserted = []
+        index = text.find(self.newline)
+        while index >= 0:
+            inserted.append(start + index + 1)
+            index = text.find(self.newline, index + 1)
+        self.line_starts = line_starts[:first] + inserted + [line_start + delta for line_start in line_starts[last:]]
+
+    def get_line(self, index):
+        return max(bisect_right(self.get_line_starts(), index) - 1, 0)
+
+    def get_line_start(self, index):
+        return self.get_line_starts()[self.get_line(index)]
+
+    def get_line_end(self, index):
+        # Index of the newline ending the line that holds index, or the end of the text
+        line_starts = self.get_line_starts()
+        line = self.get_line(index)
+        if line + 1 < len(line_starts):
+            return line_starts[line + 1] - 1
+        return len(self.text)
+
+    def get_text(self, start, end):
+        if self.is_str: return self.text[start:end]
+        return self.text[start:end].decode('utf-8', 'replace')
+
+    def get_column(self, line_start, index):
+        if self.is_str: return index - line_start
+        end = min(index, len(self.text))
+        return len(self.get_text(line_start, end)) + index - end
+
+    def get_position(self, index):
+        line = self.get_line(index)
+        return Position(index, line, self.get_column(self.get_line_starts()[line], index), self)
+
+    def get_end_position(self, index):
+        # A span ending just past a newline still ends on the line it closes
+        if 0 < index <= len(self.text) and self.text[index - 1:index] == self.newline:
+            position = self.get_position(index - 1)
+            position.index += 1
+            position.col += 1
+            return position
+        return self.get_position(index)
+
 ##################################################
 # POSITION
 ##################################################
 
 class Position:
-    def __init__(self, index, line, col, file_name, file_txt):
+    __slots__ = ('index', 'line', 'col', 'source')
+
+    def __init__(self, index, line, col, source):
         self.index = index
         self.line = line
         self.col = col
-        self.file_name= file_name
-        self.file_txt = file_txt
-
-    def advance(self, current_char=None):
-        self.index += 1
-        self.col += 1
+        self.source = source
 
-        if current_char == '\n':
-            self.line += 1
-            self.col = 0
+    @property
+    def file_name(self):
+        return self.source.file_name
 
-        return self
+    @property
+    def file_txt(self):
+        return self.source.text
 
     def copy(self):
-        return Position(self.index, self.line, self.col, self.file_name, self.file_txt)
\ No newline at end of file
+        return Position(self.index, self.line, self.col, self.source)
@@ -0,0 +1,339 @@
+import ast, importlib.util, marshal, sys
+from error import *
+from operations import *
+from bytecode import get_children
+from nodes import *
+
+##################################################
+# PYTHON BACKEND
+##################################################
+
+# Generated names get a prefix so OurJS names cannot clash with Python
+# keywords, builtins or the runtime helpers below
+VARIABLE_PREFIX = 'v_'
+FUNCTION_PREFIX = 'f_'
+
+class PythonCompiler:
+    # Translates the AST into a Python module with the same semantics as the
+    # bytecode VM: every node has a value, functions are hoisted, names a
+    # function assigns are its locals (Python's own rule), && and ||
+    # short-circuit. Operations whose Python meaning differs from OurJS go
+    # through runtime helpers. Every generated node carries the line and
+    # columns of the OurJS node it came from, so tracebacks and runtime
+    # errors point into the .ourjs file.
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.source = None
+        self.temp_counter = 0
+        self.functions = {}
+
+    def compile(self, node):
+        self.source = node.source
+        self.collect_functions(node)
+
+        body = [self.compile_function(function_node) for function_node in self.functions.values()]
+        body.extend(self.statements(node, '_result'))
+        module = ast.Module(body=body, type_ignores=[])
+        ast.fix_missing_locations(module)
+        return compile(module, self.file_name, 'exec')
+
+    ###################################
+
+    def collect_functions(self, root):
+        # Later definitions of a name win, as in the VM
+        pending = [root]
+        while pending:
+            node = pending.pop()
+            if isinstance(node, FuncDefNode):
+                self.functions.pop(node.var_name_token.value, None)
+                self.functions[node.var_name_token.value] = node
+            pending.extend(reversed(get_children(node)))
+
+    def at(self, py_node, node):
+        source = self.source
+        start_line = source.get_line(node.start)
+        end = max(node.end, node.start + 1)
+        end_line = source.get_line(end - 1)
+        py_node.lineno = start_line + 1
+        py_node.col_offset = node.start - source.get_line_starts()[start_line]
+        py_node.end_lineno = end_line + 1
+        py_node.end_col_offset = end - source.get_line_starts()[end_line]
+        return py_node
+
+    def new_temp(self):
+        self.temp_counter += 1
+        return f'_t{self.temp_counter}'
+
+    def load(self, name, node):
+        return self.at(ast.Name(id=name, ctx=ast.Load()), node)
+
+    def assign(self, name, value, node):
+        return self.at(ast.Assign(targets=[self.at(ast.Name(id=name, ctx=ast.Store()), node)], value=value), node)
+
+    def constant(self, value, node):
+        return self.at(ast.Constant(value=value), node)
+
+    def helper(self, name, args, node):
+        return self.at(ast.Call(func=self.load(name, node), args=args, keywords=[]), node)
+
+    def compile_function(self, node):
+        arg_names = [VARIABLE_PREFIX + token.value for token in node.arg_name_tokens]
+        body = self.statements(node.body_node, '_return')
+        body.append(self.at(ast.Return(value=self.load('_return', node)), node))
+        return self.at(ast.FunctionDef(
+            name=FUNCTION_PREFIX + node.var_name_token.value,
+            args=ast.arguments(posonlyargs=[], args=[ast.arg(arg=name) for name in arg_names], kwonlyargs=[], kw_defaults=[], defaults=[]),
+            body=body,
+            decorator_list=[]
+        ), node)
+
+    ###################################
+
+    def statements(self, node, target):
+        # Python statements running node. With a target name, the value of
+        # node is assigned to it.
+        if isinstance(node, ListNode):
+            if not node.element_nodes:
+                return [self.assign(target, self.constant(0, node), node)] if target else []
+            body = []
+            for element_node in node.element_nodes[:-1]: body.extend(self.statements(element_node, None))
+            body.extend(self.statements(node.element_nodes[-1], target))
+            return body
+
+        if isinstance(node, VarAssignNode):
+            body, value = self.expression(node.value_node)
+            name = VARIABLE_PREFIX + node.var_name_token.value
+            body.append(self.assign(name, value, node))
+            if target: body.append(self.assign(target, self.load(name, node), node))
+            return body
+
+        if isinstance(node, IfNode):
+            orelse = self.statements(node.else_case, target) if node.else_case else []
+            if not node.else_case and target: orelse = [self.assign(target, self.constant(0, node), node)]
+            for condition, case_body in reversed(node.cases):
+                body, test = self.expression(condition)
+                branch = self.statements(case_body, target) or [self.at(ast.Pass(), case_body)]
+                body.append(self.at(ast.If(test=test, body=branch, orelse=orelse), node))
+                orelse = body
+            return orelse
+
+        if isinstance(node, (WhileNode, ForNode)):
+            body = self.loop(node)
+            if target: body.append(self.assign(target, self.constant(0, node), node))
+            return body
+
+        if isinstance(node, FuncDefNode):
+            # Hoisted to the top of the module
+            return [self.assign(target, self.constant(0, node), node)] if target else []
+
+        body, value = self.expression(node)
+        if target: body.append(self.assign(target, value, node))
+        else: body.append(self.at(ast.Expr(value=value), node))
+        return body
+
+    def loop(self, node):
+        body = []
+        if isinstance(node, ForNode):
+            body.extend(self.statements(node.expr_node, None))
+            condition_node = node.comp_expr_node
+        else:
+            condition_node = node.condition_node
+
+        condition_body, test = self.expression(condition_node)
+        loop_body = self.statements(node.body_node, None)
+        if isinstance(node, ForNode):
+            step_body, step = self.expression(node.arith_expr_node)
+            loop_body.extend(step_body)
+            loop_body.append(self.assign(VARIABLE_PREFIX + node.expr_node.var_name_token.value, step, node.arith_expr_node))
+
+        if condition_body:
+            # while True: <condition>; if not condition: break; ...
+            exit_test = self.at(ast.UnaryOp(op=ast.Not(), operand=test), condition_node)
+            loop_body = condition_body + [self.at(ast.If(test=exit_test, body=[self.at(ast.Break(), condition_node)], orelse=[]), condition_node)] + loop_body
+            test = self.constant(True, condition_node)
+
+        body.append(self.at(ast.While(test=test, body=loop_body or [self.at(ast.Pass(), node)], orelse=[]), node))
+        return body
+
+    ###################################
+
+    def expression(self, node):
+        # (statements to run first, Python expression for the value)
+        if isinstance(node, (NumberNode, StringNode)):
+            return [], self.constant(node.token.value, node)
+
+        if isinstance(node, VarAccessNode):
+            return [], self.load(VARIABLE_PREFIX + node.var_name_token.value, node)
+
+        if isinstance(node, VarAssignNode):
+            body, value = self.expression(node.value_node)
+            target = self.at(ast.Name(id=VARIABLE_PREFIX + node.var_name_token.value, ctx=ast.Store()), node)
+            return body, self.at(ast.NamedExpr(target=target, value=value), node)
+
+        if isinstance(node, BinOpNode):
+            return self.binary_operation(node)
+
+        if isinstance(node, UnaryOpNode):
+            body, operand = self.expression(node.node)
+            op_type = node.op_token.type
+            if op_type == TOKEN_PLUS: return body, operand
+            if op_type == TOKEN_MINUS: return body, self.at(ast.UnaryOp(op=ast.USub(), operand=operand), node)
+            return body, self.at(ast.IfExp(test=operand, body=self.constant(0, node), orelse=self.constant(1, node)), node)
+
+        if isinstance(node, CallNode):
+            return self.call(node)
+
+        # if, loops and function definitions run as statements into a temp
+        temp = self.new_temp()
+        return self.statements(node, temp), self.load(temp, node)
+
+    def sequence(self, nodes):
+        # Evaluates nodes left to right. When a later node needs statements,
+        # the values before it are saved in temps first.
+        body = []
+        values = []
+        for node in nodes:
+            node_body, value = self.expression(node)
+            if node_body:
+                for index, earlier in enumerate(values):
+                    if isinstance(earlier, ast.Constant): continue
+                    temp = self.new_temp()
+                    body.append(self.assign(temp, earlier, node))
+                    values[index] = self.load(temp, node)
+                body.extend(node_body)
+            values.append(value)
+        return body, values
+
+    def binary_operation(self, node):
+        op_type = node.op_token.type
+
+        if op_type == TOKEN_AND or op_type == TOKEN_OR:
+            left_body, left = self.expression(node.left_node)
+            right_body, right = self.expression(node.right_node)
+            if not right_body:
+                op = ast.And() if op_type == TOKEN_AND else ast.Or()
+                return left_body, self.at(ast.BoolOp(op=op, values=[left, right]), node)
+            # The right side needs statements, so only run them when needed
+            temp = self.new_temp()
+            test = self.load(temp, node)
+            if op_type == TOKEN_OR: test = self.at(ast.UnaryOp(op=ast.Not(), operand=test), node)
+            body = left_body + [self.assign(temp, left, node)]
+            body.append(self.at(ast.If(test=test, body=right_body + [self.assign(temp, right, node)], orelse=[]), node))
+            return body, self.load(temp, node)
+
+        body, (left, right) = self.sequence([node.left_node, node.right_node])
+        if op_type == TOKEN_PLUS:
+            return body, self.at(ast.BinOp(left=left, op=ast.Add(), right=right), node)
+        if op_type == TOKEN_MINUS:
+            return body, self.at(ast.BinOp(left=left, op=ast.Sub(), right=right), node)
+        if op_type == TOKEN_MUL:
+            return body, self.helper('_mul', [left, right], node)
+        if op_type == TOKEN_DIV:
+            return body, self.helper('_div', [left, right], node)
+
+        # Comparisons give 1 or 0 rather than Python bools. Python's == on
+        # ints, floats and strs already matches operations.equal.
+        op = {TOKEN_EE: ast.Eq, TOKEN_NE: ast.NotEq, TOKEN_LT: ast.Lt, TOKEN_GT: ast.Gt, TOKEN_LTE: ast.LtE, TOKEN_GTE: ast.GtE}[op_type]()
+        test = self.at(ast.Compare(left=left, ops=[op], comparators=[right]), node)
+        return body, self.at(ast.IfExp(test=test, body=self.constant(1, node), orelse=self.constant(0, node)), node)
+
+    def call(self, node):
+        body, args = self.sequence(node.arg_nodes)
+        name = node.node_to_call.var_name_token.value if isinstance(node.node_to_call, VarAccessNode) else None
+
+        if name in self.functions:
+            arg_count = len(self.functions[name].arg_name_tokens)
+            if arg_count == len(args):
+                return body, self.at(ast.Call(func=self.load(FUNCTION_PREFIX + name, node), args=args, keywords=[]), node)
+            details = f"'{name}' takes {arg_count} arguments but {len(args)} were given"
+        elif name == 'log':
+            return body, self.helper('_log', args, node)
+        elif name is None:
+            details = 'Only named functions can be called'
+        else:
+            details = f"'{name}' is not a function"
+        return body, self.helper('_fail', args + [self.constant(details, node)], node)
+
+##################################################
+# RUNTIME
+##################################################
+
+class OurJSFailure(Exception):
+    pass
+
+def _fail(*args):
+    raise OurJSFailure(args[-1])
+
+def _mul(left, right):
+    if type(left) == str or type(right) == str: raise TypeError('*')
+    return left * right
+
+def _div(left, right):
+    value = divide(left, right)
+    if value is None:
+        if is_number(left) and is_number(right): raise ZeroDivisionError()
+        raise TypeError('/')
+    return value
+
+def make_globals(output):
+    write = output.write
+
+    def _log(*args):
+        write(' '.join(map(to_string, args)) + '\n')
+        return 0
+
+    return {'__builtins__': {}, '_log': _log, '_fail': _fail, '_mul': _mul, '_div': _div}
+
+def get_error_span(code, source, traceback, depth=0):
+    # Source offsets of the instruction running in the generated code frame
+    # depth levels above the innermost one in the traceback
+    frame_tracebacks = []
+    while traceback is not None:
+        if traceback.tb_frame.f_code.co_filename == code.co_filename: frame_tracebacks.append(traceback)
+        traceback = traceback.tb_next
+    if not frame_tracebacks: return 0, 0
+    frame_traceback = frame_tracebacks[max(len(frame_tracebacks) - 1 - depth, 0)]
+
+    line_starts = source.get_line_starts()
+    line = frame_traceback.tb_lineno - 1
+    if hasattr(frame_traceback.tb_frame.f_code, 'co_positions'):
+        positions = list(frame_traceback.tb_frame.f_code.co_positions())
+        start_line, end_line, start_col, end_col = positions[frame_traceback.tb_lasti // 2]
+        if None not in (start_line, end_line, start_col, end_col):
+            return line_starts[start_line - 1] + start_col, line_starts[end_line - 1] + end_col
+    return line_starts[line], source.get_line_end(line_starts[line])
+
+def describe_exception(exception):
+    if isinstance(exception, OurJSFailure): return exception.args[0]
+    if isinstance(exception, ZeroDivisionError): return 'Division by zero'
+    if isinstance(exception, RecursionError): return 'Maximum call depth exceeded'
+    if isinstance(exception, NameError):
+        name = getattr(exception, 'name', None) or str(exception).split("'")[1]
+        return f"'{name[len(VARIABLE_PREFIX):]}' is not defined"
+    return 'Illegal operation'
+
+def run_code(code, source, output=None):
+    # Runs a compiled module; returns (value of the program, error)
+    namespace = make_globals(output if output is not None else sys.stdout)
+    try:
+        exec(code, namespace)
+    except (OurJSFailure, ArithmeticError, TypeError, NameError, RecursionError) as exception:
+        # Python notices deep recursion at whatever the innermost call does
+        # first, so report the call one level up, as the VM does
+        depth = 1 if isinstance(exception, RecursionError) else 0
+        start, end = get_error_span(code, source, exception.__traceback__, depth)
+        return None, RTError(source.get_position(start), source.get_end_position(end), describe_exception(exception))
+    return namespace['_result'], None
+
+##################################################
+# CACHING
+##################################################
+
+def dump_code(code):
+    # marshal output is only valid for the Python version that wrote it
+    return importlib.util.MAGIC_NUMBER + marshal.dumps(code)
+
+def load_code(data):
+    magic = importlib.util.MAGIC_NUMBER
+    if data[:len(magic)] != magic: return None
+    return marshal.loads(data[len(magic):])
@@ -1,20 +1,65 @@
-import main , time
+import argparse , batch , main , os , sys , time
 
-def runParser() :
-    fileName = 'sample.ourjs'
-    text = ""
-    with open(fileName, 'r') as file:
-        text = file.read()
-
-    if text.strip() == "" : return
-    result, error = main.run(fileName, text)
+def runParser(fileName, lexer, optimizationLevel, cache, recover, maxErrors, emit, outputName, instrument) :
+    if os.path.getsize(fileName) == 0 : return
+    output = open(outputName, 'w') if outputName else None
+    try :
+        result, error = main.run(fileName, lexer_engine=lexer, optimization_level=optimizationLevel, cache=cache, recover=recover, max_errors=maxErrors,
+                                 emit=emit, output=output, instrument=instrument)
+    finally :
+        if output : output.close()
 
     if error: print(error.as_string())
-    else: print(result)
+    elif result is not None: sys.stdout.write(result)
+
+argumentParser = argparse.ArgumentParser(description='Compile an OurJS file to intermediate code')
+argumentParser.add_argument('files', nargs='*', default=['sample.ourjs'], help='files, directories or globs')
+argumentParser.add_argument('--emit', choices=main.EMIT_STAGES, default=main.STAGE_IC, help='stage to stop after and print (default: ic)')
+argumentParser.add_argument('-o', '--output', help='write what is emitted to this file instead of stdout')
+argumentParser.add_argument('--optimize', type=int, default=0, help='optimization level; 1 or more folds the tree and optimizes the IC')
+argumentParser.add_argument('--lexer', choices=sorted(main.LEXERS), default='regex', help='lexer to use; parallel splits large files across processes')
+argumentParser.add_argument('--out', help='compile every file in parallel, writing its IC below this directory')
+argumentParser.add_argument('--jobs', type=int, help='worker processes for --out (default: available cores)')
+argumentParser.add_argument('--no-cache', action='store_true', help='neither read nor write the compile cache')
+argumentParser.add_argument('--cache-dir', help='cache directory (default $OURJS_CACHE_DIR or ~/.cache/ourjs)')
+argumentParser.add_argument('--cache-size', type=int, default=main.DEFAULT_CACHE_SIZE, help='cache size limit in bytes')
+argumentParser.add_argument('--all-errors', action='store_true', help='report every error instead of stopping at the first')
+argumentParser.add_argument('--max-errors', type=int, default=100, help='errors reported with --all-errors before giving up')
+argumentParser.add_argument('--stages', action='store_true', help='print the time and counts of every stage instead of the total')
+argumentParser.add_argument('--profile', choices=main.PROFILE_STAGES, help='profile one stage with cProfile and print the hottest functions')
+argumentParser.add_argument('--cache-stats', action='store_true', help='print cache hits and misses')
+arguments = argumentParser.parse_args()
+
+if arguments.out:
+    # The batch prints its own stage times, and each file has its own output
+    for flag, given in (('-o', arguments.output), ('--stages', arguments.stages), ('--profile', arguments.profile),
+                        ('--cache-stats', arguments.cache_stats)):
+        if given: argumentParser.error(f'{flag} cannot be used with --out')
+    cacheOptions = None if arguments.no_cache else (arguments.cache_dir, arguments.cache_size)
+    sys.exit(0 if batch.run_batch(arguments.files, arguments.out, arguments.jobs, arguments.lexer, arguments.optimize,
+                                  arguments.emit, cacheOptions, arguments.all_errors, arguments.max_errors) else 1)
+elif arguments.jobs:
+    argumentParser.error('--jobs needs --out')
+if len(arguments.files) > 1 or not os.path.isfile(arguments.files[0]):
+    argumentParser.error('compiling several files, directories or globs needs --out')
+
+report = main.StageReport()
+counts = main.StageCounts()
+instrument = main.NO_INSTRUMENTATION
+if arguments.stages or arguments.profile or arguments.optimize > 0:
+    instrument = main.Instrumentation([report, counts], arguments.profile)
 
 start_time = time.time()
-runParser()
+# Stages loaded from the cache would not run to be timed or profiled
+cache = main.CompileCache(arguments.cache_dir, arguments.cache_size, arguments.no_cache, arguments.stages or bool(arguments.profile))
+runParser(arguments.files[0], arguments.lexer, arguments.optimize, cache, arguments.all_errors, arguments.max_errors, arguments.emit, arguments.output, instrument)
 #Calculate Run Time
 finish_time = time.time()
 total_run_time = finish_time - start_time
-print("\nTotal Run Time is:", total_run_time, "seconds")
\ No newline at end of file
+# Reports go to stderr so stdout holds only what was emitted
+optimized = counts.counts.get(main.STAGE_OPTIMIZE)
+if optimized: print(f"Optimized {optimized['instructions']} instructions into {optimized['optimized']}", file=sys.stderr)
+if arguments.stages: print('\n' + report.as_string(), file=sys.stderr)
+else: print("\nTotal Run Time is:", total_run_time, "seconds", file=sys.stderr)
+if arguments.profile: print('\n' + instrument.profile_stats(), file=sys.stderr)
+if arguments.cache_stats: print(cache.summary(), file=sys.stderr)
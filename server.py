@@ -0,0 +1,266 @@
+import argparse, asyncio, errno, hashlib, json, os, socket, stat, sys, threading, time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import batch, main
+from client import default_socket_path, encode
+
+# The fields of a compile request that change its response
+OPTION_FIELDS = ('file_name', 'emit', 'lexer', 'optimization_level', 'recover', 'max_errors')
+
+DEFAULT_RESULTS = 256
+
+# Sources come in a single line, so lines may be as long as a program
+MAX_REQUEST_SIZE = 1 << 30
+
+##################################################
+# WORKER
+##################################################
+
+def warm_up():
+    # Run once per worker so the first request does not pay for the imports
+    return os.getpid()
+
+def describe_error(error):
+    return {
+        'name': error.error_name,
+        'details': error.details,
+        'file': error.pos_start.file_name,
+        'line': error.pos_start.line + 1,
+        'column': error.pos_start.col + 1,
+        'message': error.as_string()
+    }
+
+def compile_request(request):
+    # Compiles one request in a worker; errors of every kind become a response
+    try:
+        file_name = request.get('path') or request.get('file_name') or '<request>'
+        result, error = main.run(
+            file_name, request.get('text'), request.get('lexer', 'regex'),
+            optimization_level=request.get('optimization_level', 0),
+            recover=request.get('recover', False), max_errors=request.get('max_errors'),
+            emit=request.get('emit', main.STAGE_IC)
+        )
+    except Exception as exception:
+        return failure(f'{type(exception).__name__} : {exception}', type(exception).__name__)
+
+    if error:
+        errors = error if isinstance(error, main.ErrorList) else [error]
+        return {'ok': False, 'errors': [describe_error(each) for each in errors], 'stopped': getattr(error, 'stopped', False)}
+    return {'ok': True, 'output': result}
+
+def failure(message, name='Request Error'):
+    return {'ok': False, 'errors': [{'name': name, 'details': message, 'file': None, 'line': None, 'column': None, 'message': message}], 'stopped': False}
+
+##################################################
+# SERVER
+##################################################
+
+class CompileServer:
+    # Answers compile requests (see client.py for the protocol) from a pool
+    # of worker processes that stay warm between requests. The last
+    # max_results responses are kept, keyed by the source text or the path
+    # and modification time of the file, together with the options.
+    def __init__(self, workers=None, max_results=DEFAULT_RESULTS):
+        self.workers = workers or batch.get_worker_count()
+        self.max_results = max_results
+        self.results = OrderedDict()
+        # key -> future of a compile in progress
+        self.compiling = {}
+        self.executor = None
+        self.stopping = None
+        # Handler task -> (reader, writer) of every open connection
+        self.connections = {}
+        self.start_time = time.time()
+        self.stats = {'requests': 0, 'compiled': 0, 'result_hits': 0, 'connections': 0}
+
+    async def start(self):
+        self.stopping = asyncio.Event()
+        self.executor = ProcessPoolExecutor(self.workers)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, warm_up) for _ in range(self.workers)))
+
+    async def stop(self):
+        # Ending the input of a connection ends its handler once its requests
+        # are answered; a pipe does not see its writer closed
+        for reader, writer in list(self.connections.values()):
+            reader.feed_eof()
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        if self.executor is not None: self.executor.shutdown()
+
+    def get_key(self, request):
+        digest = hashlib.sha256(json.dumps([request.get(field) for field in OPTION_FIELDS]).encode())
+        if request.get('text') is not None:
+            digest.update(b'text')
+            digest.update(request['text'].encode('utf-8', 'surrogatepass'))
+        else:
+            stat = os.stat(request['path'])
+            digest.update(f"path {os.path.abspath(request['path'])} {stat.st_mtime_ns} {stat.st_size}".encode())
+        return digest.hexdigest()
+
+    async def handle_request(self, request):
+        self.stats['requests'] += 1
+        op = request.get('op', 'compile')
+        if op == 'ping': return {'ok': True}
+        if op == 'stats': return {'ok': True, 'stats': self.get_stats()}
+        if op == 'shutdown':
+            self.stopping.set()
+            return {'ok': True}
+        if op != 'compile': return failure(f"Unknown op '{op}'")
+        if request.get('text') is None and request.get('path') is None: return failure("A compile request needs 'text' or 'path'")
+
+        try:
+            key = self.get_key(request)
+        except OSError as exception:
+            return failure(f'{exception.strerror} : {request["path"]}', type(exception).__name__)
+
+        response = self.results.get(key)
+        if response is not None:
+            self.results.move_to_end(key)
+            self.stats['result_hits'] += 1
+            return response
+
+        # The same request arriving while it compiles waits for that compile
+        compiling = self.compiling.get(key)
+        if compiling is not None:
+            self.stats['result_hits'] += 1
+            return await compiling
+
+        compiling = self.compiling[key] = asyncio.get_running_loop().run_in_executor(self.executor, compile_request, request)
+        try:
+            response = await compiling
+        finally:
+            del self.compiling[key]
+        self.stats['compiled'] += 1
+        self.results[key] = response
+        while len(self.results) > self.max_results: self.results.popitem(last=False)
+        return response
+
+    async def respond(self, request, writer, lock):
+        try:
+            response = await self.handle_request(request)
+        except Exception as exception:
+            response = failure(f'{type(exception).__name__} : {exception}', type(exception).__name__)
+        async with lock:
+            writer.write(encode(dict(response, id=request.get('id'))))
+            await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        # Requests on a connection run concurrently; responses carry their id
+        self.stats['connections'] += 1
+        self.connections[asyncio.current_task()] = (reader, writer)
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while not self.stopping.is_set():
+                line = await reader.readline()
+                if not line: break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict): raise ValueError('a request must be an object')
+                except ValueError as exception:
+                    task = asyncio.ensure_future(self.respond_with(failure(f'Invalid request: {exception}'), writer, lock))
+                else:
+                    task = asyncio.ensure_future(self.respond(request, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks: await asyncio.gather(*tasks)
+        except (ConnectionError, asyncio.LimitOverrunError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self.connections[asyncio.current_task()]
+            writer.close()
+
+    async def respond_with(self, response, writer, lock):
+        async with lock:
+            writer.write(encode(dict(response, id=None)))
+            await writer.drain()
+
+    def get_stats(self):
+        return dict(self.stats, workers=self.workers, results=len(self.results), uptime=time.time() - self.start_time)
+
+    async def serve_unix(self, path):
+        claim_socket_path(path)
+        await self.start()
+        # Created owner-only, so no other user can connect in between
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self.handle_connection, path, limit=MAX_REQUEST_SIZE)
+        finally:
+            os.umask(umask)
+        try:
+            await self.stopping.wait()
+        finally:
+            server.close()
+            if os.path.exists(path): os.unlink(path)
+            await self.stop()
+
+    async def serve_stdio(self):
+        # Reads requests from stdin and answers on stdout until either ends
+        await self.start()
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=MAX_REQUEST_SIZE)
+
+        def read_stdin():
+            # A thread, as stdin may be a file, which asyncio cannot watch.
+            # Reading the descriptor takes no lock the exit could wait for.
+            while True:
+                data = os.read(sys.stdin.fileno(), 1 << 16)
+                if not data: break
+                loop.call_soon_threadsafe(reader.feed_data, data)
+            loop.call_soon_threadsafe(reader.feed_eof)
+
+        threading.Thread(target=read_stdin, daemon=True).start()
+        connection = asyncio.ensure_future(self.handle_connection(reader, StdoutWriter()))
+        try:
+            await asyncio.wait([connection, asyncio.ensure_future(self.stopping.wait())], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            await self.stop()
+
+def claim_socket_path(path):
+    # Removes the socket of a server that has gone; raises OSError if a
+    # server still answers on path or path is not a socket
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode): raise FileExistsError(errno.EEXIST, 'Not a socket', path)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(errno.EADDRINUSE, 'A compile server is already listening', path)
+
+class StdoutWriter:
+    # The part of asyncio.StreamWriter the server uses, writing to stdout
+    def write(self, data):
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+if __name__ == '__main__':
+    argumentParser = argparse.ArgumentParser(description='Serve compile requests from warm worker processes')
+    argumentParser.add_argument('--socket', help='Unix socket to listen on (default $OURJS_SOCKET or /tmp/ourjs-UID.sock)')
+    argumentParser.add_argument('--stdio', action='store_true', help='answer requests on stdin and stdout instead')
+    argumentParser.add_argument('--workers', type=int, help='worker processes (default: available cores)')
+    argumentParser.add_argument('--results', type=int, default=DEFAULT_RESULTS, help='responses kept for repeated requests')
+    arguments = argumentParser.parse_args()
+
+    server = CompileServer(arguments.workers, arguments.results)
+    try:
+        if arguments.stdio: asyncio.run(server.serve_stdio())
+        else: asyncio.run(server.serve_unix(arguments.socket or default_socket_path()))
+    except KeyboardInterrupt:
+        pass
+    except OSError as exception:
+        print(f'{exception.strerror} : {exception.filename}', file=sys.stderr)
+        sys.exit(1)
@@ -1,9 +1,13 @@
-import main
+import argparse , main
+
+argumentParser = argparse.ArgumentParser(description='Compile OurJS a line at a time')
+argumentParser.add_argument('--emit', choices=main.EMIT_STAGES, default=main.STAGE_IC, help='stage to stop after and print (default: ic)')
+arguments = argumentParser.parse_args()
 
 while True:
     text = input("myjs > ")
     if text.strip() == "": continue
-    result, error = main.run('<stdin>', text)
+    result, error = main.run('<stdin>', text, emit=arguments.emit)
 
     if error: print(error.as_string())
-    else: print(result)
\ No newline at end of file
+    else: print(result, end='')
@@ -1,16 +1,15 @@
-def string_with_arrows(text, pos_start, pos_end):
+def string_with_arrows(source, pos_start, pos_end):
     result = ''
 
     # Calculate indices
-    idx_start = max(text.rfind('\n', 0, pos_start.index), 0)
-    idx_end = text.find('\n', idx_start + 1)
-    if idx_end < 0: idx_end = len(text)
+    idx_start = max(source.get_line_start(pos_start.index) - 1, 0)
+    idx_end = source.get_line_end(idx_start + 1)
     
     # Generate each line
     line_count = pos_end.line - pos_start.line + 1
     for i in range(line_count):
         # Calculate line columns
-        line = text[idx_start:idx_end]
+        line = source.get_text(idx_start, idx_end)
         col_start = pos_start.col if i == 0 else 0
         col_end = pos_end.col if i == line_count - 1 else len(line) - 1
 
@@ -20,7 +19,6 @@ def string_with_arrows(text, pos_start, pos_end):
 
         # Re-calculate indices
         idx_start = idx_end
-        idx_end = text.find('\n', idx_start + 1)
-        if idx_end < 0: idx_end = len(text)
+        idx_end = source.get_line_end(idx_start + 1)
 
     return result.replace('\t', '')
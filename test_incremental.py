@@ -0,0 +1,156 @@
+import random, unittest
+import main
+from bytecode import get_children
+from incremental import Document
+
+# Checks incremental.Document against a full re-parse of the edited text:
+# after every edit the error, and when asked for, the tree with the offsets
+# of its nodes and tokens and the token stream, must be what
+# main.parse_source and the lexer give for the whole text.
+
+LEXER_ENGINES = ('regex', 'classic')
+
+# Inserted at random offsets; most break the text for an edit or two
+SNIPPETS = ['\n', ' ', '"', 'x', '1', '+', '(', ')', '{', '}', 'let ', '= ', ';', '&', '&&', '!', '=',
+            'if (a) { b }\n', 'let q = 3\n', '\nlog(1)\n', 'func g(z) { z }\n', ', ', 'else', '.5', '|']
+
+##################################################
+# PROGRAMS
+##################################################
+
+def expression(rng, depth=0):
+    kind = rng.randint(0, 4 if depth < 2 else 1)
+    if kind == 0: return str(rng.randint(0, 9))
+    if kind == 1: return rng.choice(['a', 'b', 'c', '"s"'])
+    if kind == 2: return f'({expression(rng, depth + 1)} {rng.choice(["+", "-", "*", "<", "=="])} {expression(rng, depth + 1)})'
+    if kind == 3: return f'g({expression(rng, depth + 1)})'
+    return f'{expression(rng, depth + 1)} + {expression(rng, depth + 1)}'
+
+def statements(rng, depth=0, count=None):
+    lines = []
+    for _ in range(count or rng.randint(1, 3)):
+        kind = rng.randint(0, 5 if depth < 2 else 2)
+        if kind == 0: lines.append(f'let {rng.choice("abc")} = {expression(rng)}')
+        elif kind == 1: lines.append(f'log({expression(rng)})')
+        elif kind == 2: lines.append(expression(rng))
+        elif kind == 3:
+            text = f'if ({expression(rng)}) {{\n{statements(rng, depth + 1)}\n}}'
+            if rng.random() < 0.5: text += f' else {{\n{statements(rng, depth + 1)}\n}}'
+            lines.append(text)
+        elif kind == 4: lines.append(f'while ({expression(rng)}) {{\n{statements(rng, depth + 1)}\n}}')
+        else: lines.append(f'func g(z) {{\n{statements(rng, depth + 1)}\n}}')
+    return rng.choice(['\n', '\n\n', ';', '\n;\n']).join(lines)
+
+def random_edit(rng, text):
+    # (offset, removed length, inserted text)
+    offset = rng.randint(0, len(text))
+    removed = min(rng.choice([0, 0, 1, 2, 5]), len(text) - offset)
+    inserted = rng.choice(SNIPPETS) if rng.random() < 0.8 else ''
+    return offset, removed, inserted
+
+##################################################
+# COMPARING
+##################################################
+
+def describe_tree(node):
+    # Every node with its offsets and those of the tokens it holds
+    nodes = []
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        item = [type(node).__name__, node.start, node.end]
+        for name in ('token', 'var_name_token', 'op_token'):
+            token = getattr(node, name, None)
+            if token is not None: item.append((token.type, token.value, token.start, token.end))
+        for token in getattr(node, 'arg_name_tokens', ()): item.append((token.type, token.value, token.start, token.end))
+        nodes.append(tuple(item))
+        pending.extend(get_children(node))
+    return nodes
+
+def describe_error(error):
+    if error is None: return None
+    return error.as_string(), error.pos_start.index, error.pos_end.index
+
+def describe_result(ast, error):
+    node = ast.node if ast is not None else None
+    if node is None: return describe_error(error), None
+    return describe_error(error), repr(node), describe_tree(node)
+
+def describe_tokens(tokens):
+    return list(tokens.types), list(tokens.starts), list(tokens.ends), tokens.values
+
+class IncrementalTest(unittest.TestCase):
+    def assert_matches_full_parse(self, document, text, error, lexer_engine, check_tree=True):
+        full_ast, full_error = main.parse_source('<test>', text, lexer_engine)
+        self.assertEqual(describe_error(error), describe_error(full_error))
+        if not check_tree: return
+
+        ast, tree_error = document.get_ast()
+        self.assertIs(tree_error, error)
+        self.assertEqual(describe_result(ast, tree_error), describe_result(full_ast, full_error))
+        if document.tokens is not None:
+            tokens, _ = main.LEXERS[lexer_engine]('<test>', text).make_tokens()
+            self.assertEqual(describe_tokens(document.tokens), describe_tokens(tokens))
+
+    ##################################################
+    # TESTS
+    ##################################################
+
+    def test_random_edits(self):
+        for lexer_engine in LEXER_ENGINES:
+            for seed in range(40):
+                rng = random.Random(seed)
+                text = statements(rng, 0, rng.randint(3, 30))
+                document = Document('<test>', text, lexer_engine)
+                for step in range(30):
+                    offset, removed, inserted = random_edit(rng, text)
+                    text = text[:offset] + inserted + text[offset + removed:]
+                    with self.subTest(lexer=lexer_engine, seed=seed, step=step):
+                        error = document.edit(offset, removed, inserted)
+                        # The tree is only built now and then, so reused statements move by several edits at once
+                        self.assert_matches_full_parse(document, text, error, lexer_engine, rng.random() < 0.3)
+
+    def test_edit_fixing_an_error_reuses_the_cached_run(self):
+        for lexer_engine in LEXER_ENGINES:
+            with self.subTest(lexer=lexer_engine):
+                lines = [f'let a{index} = {index} + b' for index in range(40)]
+                text = '\n'.join(lines)
+                document = Document('<test>', text, lexer_engine)
+
+                # Breaking a statement in the middle stops the parse there
+                offset = text.index('let a20')
+                error = document.edit(offset, 0, ')')
+                broken = text[:offset] + ')' + text[offset:]
+                self.assertIsNotNone(error)
+                self.assert_matches_full_parse(document, broken, error, lexer_engine)
+                self.assertGreater(len(document.statements), document.chain_length)
+
+                # Fixing it picks the old statements after it up again
+                error = document.edit(offset, 1, '')
+                self.assertIsNone(error)
+                self.assert_matches_full_parse(document, text, error, lexer_engine)
+                self.assertEqual(document.chain_length, len(lines))
+
+                # An edit before the error moves the cached run along with it
+                document.edit(offset, 0, ')')
+                document.edit(0, 0, 'let q = 1\n')
+                error = document.edit(offset + len('let q = 1\n'), 1, '')
+                self.assertIsNone(error)
+                self.assert_matches_full_parse(document, 'let q = 1\n' + text, error, lexer_engine)
+
+    def test_edit_after_a_lexing_error(self):
+        for lexer_engine in LEXER_ENGINES:
+            with self.subTest(lexer=lexer_engine):
+                text = 'let a = 1\nlet b = 2\nlog(a + b)'
+                document = Document('<test>', text, lexer_engine)
+                offset = text.index('2')
+                error = document.edit(offset, 0, '@')
+                self.assert_matches_full_parse(document, text[:offset] + '@' + text[offset:], error, lexer_engine)
+                self.assertIsNone(document.tokens)
+
+                error = document.edit(offset, 1, '')
+                self.assertIsNone(error)
+                self.assert_matches_full_parse(document, text, error, lexer_engine)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import random, unittest
+import main
+from benchsuite import generate_corpus
+
+# Checks main.run(..., recover=True): streamed and not, both lexers must
+# report the same errors, and each error only once.
+
+LEXER_ENGINES = ('regex', 'classic')
+
+# Inserted into generated programs to break them
+PIECES = ['@', '$', '&', '|', '\n', ')', '(', '+', '{', '}', 'let ', '= ', '1', 'x', ';', '"', '!']
+
+def describe_errors(error):
+    if error is None: return None
+    return [(each.error_name, each.details, each.pos_start.index, each.pos_end.index) for each in error]
+
+def mutate(rng, text):
+    for _ in range(rng.randint(1, 4)):
+        offset = rng.randint(0, len(text))
+        text = text[:offset] + rng.choice(PIECES) + text[offset + rng.choice([0, 0, 1, 3]):]
+    return text
+
+class RecoveryTest(unittest.TestCase):
+    def recover(self, text, lexer_engine, streaming, max_errors=None):
+        result, error = main.run('<test>', text, lexer_engine, streaming=streaming, recover=True, max_errors=max_errors, emit=main.STAGE_AST)
+        return result, describe_errors(error)
+
+    def assert_streaming_agrees(self, text, max_errors=None):
+        for lexer_engine in LEXER_ENGINES:
+            with self.subTest(lexer=lexer_engine, text=text):
+                self.assertEqual(self.recover(text, lexer_engine, True, max_errors), self.recover(text, lexer_engine, False, max_errors))
+
+    ##################################################
+    # TESTS
+    ##################################################
+
+    def test_skipped_character_is_reported_once(self):
+        for lexer_engine in LEXER_ENGINES:
+            _, errors = self.recover('let a = 1\nlet b = @\nlet c = 2', lexer_engine, False)
+            self.assertEqual([details for _, details, _, _ in errors], ["'@'"])
+
+    def test_error_before_a_skipped_character_is_kept(self):
+        # The expression is incomplete at the newline, before the '@' is read
+        text = 'let x = 1 +\n@\nlet y = 2\n'
+        self.assert_streaming_agrees(text)
+        _, errors = self.recover(text, 'regex', True)
+        self.assertEqual([(details, start) for _, details, start, _ in errors],
+                         [("Expected number, identifier, 'if', 'for', 'while', 'func'", 11), ("'@'", 12)])
+
+    def test_error_reaching_max_errors_in_a_block_is_reported_once(self):
+        # The lexer's '@' leaves the parser one error, which it finds in the block
+        for lexer_engine in LEXER_ENGINES:
+            for streaming in (False, True):
+                _, errors = self.recover('while (a) {\n  let b = (1\n}\nlet c = @\n', lexer_engine, streaming, 2)
+                self.assertEqual(len(set(errors)), len(errors))
+
+    def test_streaming_agrees_on_broken_programs(self):
+        rng = random.Random(0)
+        programs = [generate_corpus(400, seed) for seed in range(10)]
+        for _ in range(150):
+            self.assert_streaming_agrees(mutate(rng, rng.choice(programs)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import sys
+from error import *
+from operations import *
+from bytecode import *
+
+##################################################
+# VIRTUAL MACHINE
+##################################################
+
+# Deeper recursion is reported as a runtime error
+MAX_CALL_DEPTH = 1000
+
+BINARY_OPCODE_OPERATIONS = {
+    OP_ADD: add,
+    OP_SUB: subtract,
+    OP_MUL: multiply,
+    OP_DIV: divide,
+    OP_EE: equal,
+    OP_NE: not_equal,
+    OP_LT: less_than,
+    OP_GT: greater_than,
+    OP_LTE: less_than_or_equal,
+    OP_GTE: greater_than_or_equal
+}
+
+class VM:
+    # A stack machine over Bytecode. Values are ints, floats and strs; None
+    # marks a variable slot that has not been assigned yet. log() writes to
+    # output, sys.stdout by default.
+    def __init__(self, bytecode, output=None):
+        self.bytecode = bytecode
+        self.output = output if output is not None else sys.stdout
+        self.globals = [None] * len(bytecode.global_names)
+
+    def error(self, offset, details):
+        source = self.bytecode.source
+        return RTError(
+            source.get_position(self.bytecode.get_start(offset)),
+            source.get_end_position(self.bytecode.get_end(offset)),
+            details
+        )
+
+    def operation_error(self, offset, opcode, left, right):
+        if opcode == OP_DIV and is_number(left) and is_number(right):
+            return self.error(offset, 'Division by zero')
+        return self.error(offset, f"Illegal operation {OP_NAMES[opcode]} on {to_string(left)!r} and {to_string(right)!r}")
+
+    def run(self):
+        # Returns (value of the program, error)
+        # Indexing a list is cheaper than unboxing from the compact array
+        code = list(self.bytecode.code)
+        constants = self.bytecode.constants
+        functions = self.bytecode.functions
+        globals_ = self.globals
+        write = self.output.write
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        frames = []
+        locals_ = None
+        pc = 0
+
+        while True:
+            opcode = code[pc]
+            arg = code[pc + 1]
+            pc += 2
+
+            if opcode == OP_LOAD_LOCAL:
+                value = locals_[arg]
+                if value is None:
+                    function = functions[frames[-1][2]]
+                    return None, self.error(pc - 2, f"'{function.local_names[arg]}' is not defined")
+                push(value)
+            elif opcode == OP_LOAD_GLOBAL:
+                value = globals_[arg]
+                if value is None: return None, self.error(pc - 2, f"'{self.bytecode.global_names[arg]}' is not defined")
+                push(value)
+            elif opcode == OP_CONST:
+                push(constants[arg])
+            elif opcode == OP_STORE_LOCAL:
+                locals_[arg] = pop()
+            elif opcode == OP_STORE_GLOBAL:
+                globals_[arg] = pop()
+            elif opcode == OP_JUMP_IF_FALSE:
+                value = pop()
+                if value == 0 or value == '': pc = arg
+            elif opcode == OP_JUMP:
+                pc = arg
+            elif opcode <= OP_GTE:
+                # Binary operators, with a fast path for ints
+                right = pop()
+                left = stack[-1]
+                if type(left) is int and type(right) is int:
+                    if opcode == OP_ADD: stack[-1] = left + right
+                    elif opcode == OP_SUB: stack[-1] = left - right
+                    elif opcode == OP_LT: stack[-1] = 1 if left < right else 0
+                    elif opcode == OP_MUL: stack[-1] = left * right
+                    elif opcode == OP_EE: stack[-1] = 1 if left == right else 0
+                    elif opcode == OP_GT: stack[-1] = 1 if left > right else 0
+                    elif opcode == OP_LTE: stack[-1] = 1 if left <= right else 0
+                    elif opcode == OP_GTE: stack[-1] = 1 if left >= right else 0
+                    elif opcode == OP_NE: stack[-1] = 1 if left != right else 0
+                    else:
+                        value = divide(left, right)
+                        if value is None: return None, self.operation_error(pc - 2, opcode, left, right)
+                        stack[-1] = value
+                else:
+                    value = BINARY_OPCODE_OPERATIONS[opcode](left, right)
+                    if value is None: return None, self.operation_error(pc - 2, opcode, left, right)
+                    stack[-1] = value
+            elif opcode == OP_POP:
+                pop()
+            elif opcode == OP_DUP:
+                push(stack[-1])
+            elif opcode == OP_CALL:
+                function = functions[arg]
+                if len(frames) >= MAX_CALL_DEPTH: return None, self.error(pc - 2, 'Maximum call depth exceeded')
+                frames.append((pc, locals_, arg))
+                arg_count = function.arg_count
+                if arg_count:
+                    locals_ = stack[-arg_count:]
+                    del stack[-arg_count:]
+                else:
+                    locals_ = []
+                locals_.extend([None] * (len(function.local_names) - arg_count))
+                pc = function.entry
+            elif opcode == OP_RETURN:
+                pc, locals_, _ = frames.pop()
+            elif opcode == OP_JUMP_IF_FALSE_OR_POP:
+                value = stack[-1]
+                if value == 0 or value == '': pc = arg
+                else: pop()
+            elif opcode == OP_JUMP_IF_TRUE_OR_POP:
+                value = stack[-1]
+                if value == 0 or value == '': pop()
+                else: pc = arg
+            elif opcode == OP_NOT:
+                value = stack[-1]
+                stack[-1] = 1 if value == 0 or value == '' else 0
+            elif opcode == OP_NEG:
+                value = negate(stack[-1])
+                if value is None: return None, self.error(pc - 2, f"Illegal operation NEG on {to_string(stack[-1])!r}")
+                stack[-1] = value
+            elif opcode == OP_LOG:
+                values = stack[len(stack) - arg:]
+                del stack[len(stack) - arg:]
+                write(' '.join(map(to_string, values)) + '\n')
+                push(0)
+            elif opcode == OP_FAIL:
+                return None, self.error(pc - 2, constants[arg])
+            elif opcode == OP_HALT:
+                return pop(), None